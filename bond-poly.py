@@ -7,7 +7,17 @@ import sys
 import re
 from bondapi import *
 import time
+import threading
+import collections
+import json
+import concurrent.futures
+import os
+import http.server
+import logging
+import tracemalloc
 import polyinterface
+import bondaio
+import bondworker
 
 # contstants for ISY Nodeserver interface
 _ISY_BOOL_UOM =2 # Used for reporting status values for Controller and Bridge nodes
@@ -16,6 +26,8 @@ _ISY_ON_OFF_UOM = 78 # For non-dimmable light: 0-Off 100-On
 _ISY_BARRIER_STATUS_UOM = 97 # For shades: 0-Closed, 100-Open, 101-Unknown, 102-Stopped, 103-Closing, 104–Opening
 _ISY_RAW_UOM = 56 # Raw value form device UOM (speed and direction)
 _ISY_INDEX_UOM = 25 # Custom index UOM for translating direction values
+_ISY_MILLISECONDS_UOM = 42 # For bridge command latency and poll cycle time
+_ISY_SECONDS_UOM = 58 # For time since last BPUP status update of bridge
 _IX_CFM_DIR_NA = 0
 _IX_CFM_DIR_FORWARD = 1 # 1 for fan direction
 _IX_CFM_DIR_REVERSE = 2 # -1 for fan direction
@@ -23,12 +35,57 @@ _IX_CFM_DIR_REVERSE = 2 # -1 for fan direction
 # custom parameter values for this nodeserver
 _PARAM_HOSTNAMES = "hostname"
 _PARAM_TOKENS = "token"
+_PARAM_FORCE_COMMANDS = "forcecommands"
+_PARAM_TRACE_FILE = "tracefile"
+_PARAM_API_STATS = "apistats" # "log" or file name for per-endpoint REST API call stats
+_PARAM_METRICS_PORT = "metricsport" # localhost port for the metrics endpoint
+_PARAM_BPUP_RECORD_FILE = "bpuprecordfile" # file name for recording BPUP traffic from all bridges
+_PARAM_WATCH_ADDRESSES = "watchaddresses" # "true" to follow bridge IP address changes with mDNS
+_PARAM_RUNTIME = "runtime" # "asyncio" to run all bridge I/O on a single event loop thread
+_PARAM_WORKER_PROCESSES = "workerprocesses" # number of worker processes to run the bridge connections in
+_PARAM_HTTP_TRANSPORT = "httptransport" # HTTP transport for REST API calls - "requests" (default) or "httpclient"
+_PARAM_DRIVER_FLUSH_DELAY = "driverflushdelay" # maximum delay for batched driver updates (milliseconds)
+_PARAM_GROUP_PREFIX = "group_" # e.g., key: group_allfans, value: semicolon separated list of node addresses
 
 _LOGGER = polyinterface.LOGGER
 
 # delay after calling API execDeviceAction() before calling getDeviceState() to avoid error (seconds)
 _DELAY_AFTER_ACTION = 0.100 
 
+# maximum age of cached device state used to suppress redundant commands (seconds)
+_STATE_CACHE_MAX_AGE = 90
+
+# maximum number of device actions executed concurrently through a single bridge
+_BRIDGE_MAX_CONCURRENT_ACTIONS = 4
+
+# maximum number of bridges onboarded concurrently by discovery
+_DISCOVER_MAX_WORKERS = 8
+_RUNTIME_ASYNCIO = "asyncio"
+_DRIVER_BUFFER_SIZE = 10000 # maximum number of driver updates buffered while Polyglot is disconnected
+_DRIVER_BUFFER_CHECK_INTERVAL = 1 # interval for checking whether Polyglot has reconnected (seconds)
+
+# maximum number of threads used to fan out a group command to the member nodes
+_GROUP_MAX_WORKERS = 16
+
+# results of a group command for each member node, and the overall status of the group (ST driver)
+_GROUP_RESULT_SUCCEEDED = "succeeded"
+_GROUP_RESULT_FAILED = "failed"
+_GROUP_RESULT_UNKNOWN = "unknown" # no action was sent (e.g., device already in state) or no result was returned
+_GROUP_STATUS_NONE = 0
+_GROUP_STATUS_SUCCEEDED = 1
+_GROUP_STATUS_PARTIAL = 2
+_GROUP_STATUS_FAILED = 3
+
+# readiness states for bridge bring-up
+_BRIDGE_PENDING = "pending"
+_BRIDGE_CONNECTING = "connecting"
+_BRIDGE_READY = "ready"
+_BRIDGE_UNREACHABLE = "unreachable"
+
+# file for the snapshot of node topology and device states used for instant startup
+_SNAPSHOT_FILE_NAME = "snapshot.json"
+_SNAPSHOT_VERSION = 1
+
 # constants for type of light node (up light, down light, or default)
 _LIGHT_TYPE_DEFAULT = 0
 _LIGHT_TYPE_DOWN_LIGHT = 1
@@ -44,6 +101,761 @@ _LIGHT_STATE_BRIGHTNESS = ("brightness", "down_light_brightness", "up_light_brig
 _LIGHT_STATE_ENABLED = ("light", "down_light", "up_light")
 _LIGHT_STATE_POWER = "light"
 
+# constants for command latency tracing
+_TRACE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000) # histogram bucket upper bounds
+_TRACE_CONFIRM_TIMEOUT = 10 # time to wait for BPUP confirmation of a traced command (seconds)
+_TRACE_HISTORY_SIZE = 100 # number of recent traces kept for dumping
+_TRACE_SEGMENTS = ( # (segment name, start stage, end stage)
+    ("queue", "entry", "send"),
+    ("http", "send", "response"),
+    ("confirm", "response", "bpup"),
+    ("publish", "bpup", "publish"),
+    ("total", "entry", "publish")
+)
+
+# Traces device commands from the command handler through the HTTP call to the BPUP confirmation
+# and the driver update, and keeps per-action latency histograms for each segment
+class CommandTracer(object):
+
+    unconfirmed = 0
+    failed = 0
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._nextID = 1
+        self._pending = {} # traces awaiting BPUP confirmation keyed by (bridge address, device ID)
+        self._histograms = {} # histograms keyed by action, then segment
+        self._history = collections.deque(maxlen=_TRACE_HISTORY_SIZE)
+        self._bridgeLatencies = {} # [total latency (seconds), count] of commands recorded since last taken, by bridge
+
+    # Start a trace for a command at entry to the command handler
+    def begin(self, address, cmd):
+
+        with self._lock:
+            traceID = self._nextID
+            self._nextID += 1
+
+        trace = {"id": traceID, "node": address, "cmd": cmd, "deviceID": None, "action": None, "times": {"entry": time.time()}}
+        self._local.trace = trace
+
+        return trace
+
+    # End the command handler portion of the trace
+    def end(self):
+        self._local.trace = None
+
+    # Return the trace for the command being handled on the current thread (if any)
+    def current(self):
+        return getattr(self._local, "trace", None)
+
+    # Mark the HTTP call for the device action being sent and wait for the BPUP confirmation
+    # Note: the trace is pending before the HTTP call since bridges push the new state before or while responding
+    def sent(self, bridgeAddr, trace, deviceID, action):
+
+        trace["bridge"] = bridgeAddr
+        trace["deviceID"] = deviceID
+        trace["action"] = action
+
+        with self._lock:
+            trace["times"]["send"] = time.time()
+            self._expirePending()
+            key = (bridgeAddr, deviceID)
+            if key in self._pending:
+                self.unconfirmed += 1
+                self._history.append(self._pending[key])
+            self._pending[key] = trace
+
+    # Mark the response to the HTTP call - records the trace if the BPUP confirmation has already been published
+    def responded(self, bridgeAddr, trace, success):
+
+        with self._lock:
+            trace["times"]["response"] = time.time()
+            if success:
+                if "publish" in trace["times"]:
+                    self._recordTrace(trace)
+            else:
+                trace["failed"] = True
+                self.failed += 1
+                key = (bridgeAddr, trace["deviceID"])
+                if self._pending.get(key) is trace:
+                    del self._pending[key]
+                self._history.append(trace)
+
+    # Match a BPUP status update for a device to a pending trace (the response to the HTTP call may not be in yet)
+    def confirm(self, bridgeAddr, deviceID):
+
+        with self._lock:
+            trace = self._pending.pop((bridgeAddr, deviceID), None)
+            if trace is not None:
+                trace["times"]["bpup"] = time.time()
+
+        return trace
+
+    # Complete the trace when the driver values have been published - the segment latencies are recorded now
+    # or when the response to the HTTP call arrives
+    def complete(self, trace):
+
+        with self._lock:
+            trace["times"]["publish"] = time.time()
+            if "response" in trace["times"] and not trace.get("failed"):
+                self._recordTrace(trace)
+
+    # Record the segment latencies of a completed trace (lock must be held)
+    # Note: the confirm segment is 0 if the BPUP confirmation arrived before the response to the HTTP call
+    def _recordTrace(self, trace):
+
+        times = trace["times"]
+        histograms = self._histograms.setdefault(trace["action"], {})
+        for (segment, start, end) in _TRACE_SEGMENTS:
+            self._record(histograms, segment, max(0.0, times[end] - times[start]) * 1000)
+        self._history.append(trace)
+
+        # total latency (command to published driver values) for the bridge
+        latency = self._bridgeLatencies.setdefault(trace["bridge"], [0.0, 0])
+        latency[0] += times["publish"] - times["entry"]
+        latency[1] += 1
+
+    # Return the average latency (seconds) of the commands for the bridge recorded since the last call (None if none)
+    def takeAverageLatency(self, bridgeAddr):
+
+        with self._lock:
+            latency = self._bridgeLatencies.pop(bridgeAddr, None)
+
+        return latency[0] / latency[1] if latency is not None else None
+
+    # Return the latency histograms and counters
+    def getStats(self):
+
+        with self._lock:
+            self._expirePending()
+            return {
+                "histograms": json.loads(json.dumps(self._histograms)),
+                "pending": len(self._pending),
+                "unconfirmed": self.unconfirmed,
+                "failed": self.failed
+            }
+
+    # Write the stats and the recent traces to the specified file
+    def dump(self, fileName):
+
+        stats = self.getStats()
+        with self._lock:
+            stats["traces"] = list(self._history)
+
+        with open(fileName, "w") as f:
+            json.dump(stats, f, indent=2)
+
+    # Add a latency value (ms) to the histogram for the segment
+    def _record(self, histograms, segment, latency):
+
+        histogram = histograms.get(segment)
+        if histogram is None:
+            histogram = {"count": 0, "sum": 0.0, "buckets": [0] * (len(_TRACE_BUCKETS_MS) + 1)}
+            histograms[segment] = histogram
+
+        histogram["count"] += 1
+        histogram["sum"] += latency
+        for i in range(len(_TRACE_BUCKETS_MS)):
+            if latency <= _TRACE_BUCKETS_MS[i]:
+                break
+        else:
+            i = len(_TRACE_BUCKETS_MS)
+        histogram["buckets"][i] += 1
+
+    # Drop pending traces that never received a BPUP confirmation (lock must be held)
+    def _expirePending(self):
+
+        expireTime = time.time() - _TRACE_CONFIRM_TIMEOUT
+        for key in [key for key in self._pending if self._pending[key]["times"]["send"] < expireTime]:
+            self.unconfirmed += 1
+            self._history.append(self._pending.pop(key))
+
+# Buffers driver updates while the connection to Polyglot is down and replays them in a single burst when it is
+# restored - only the node and driver are kept, since the current driver value of the node is the latest value
+class DriverBuffer(object):
+
+    def __init__(self, controller, maxSize=_DRIVER_BUFFER_SIZE):
+
+        self._controller = controller
+        self._maxSize = maxSize
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict() # [node, force] by (node address, driver)
+        self._replayThread = None
+        self.buffered = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    # Buffer a driver update for the node (the driver value of the node must already be set)
+    def add(self, node, driver, force):
+
+        key = (node.address, driver)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [node, force]
+            else:
+                entry[1] = entry[1] or force
+            self.buffered += 1
+            self._trim()
+
+            # wait for the connection to be restored in the background
+            if self._replayThread is None:
+                _LOGGER.warning("Connection to Polyglot is down - buffering driver updates.")
+                self._replayThread = threading.Thread(target=self._waitAndReplay, name="DriverReplay", daemon=True)
+                self._replayThread.start()
+
+    # Drop the oldest updates while the buffer is over its size (must be called with the lock held)
+    def _trim(self):
+
+        # the value is no longer known to Polyglot, so remove it from the driver shadow
+        while len(self._pending) > self._maxSize:
+            ((addr, oldDriver), (oldNode, oldForce)) = self._pending.popitem(last=False)
+            if getattr(oldNode, "_driverShadow", None) is not None:
+                oldNode._driverShadow.pop(oldDriver, None)
+            self.dropped += 1
+
+    # Return the number of buffered driver updates
+    def getPendingCount(self):
+        return len(self._pending)
+
+    # Wait for the connection to Polyglot to be restored and replay the buffered driver updates
+    def _waitAndReplay(self):
+
+        replayed = 0
+        startTime = None
+        while True:
+            time.sleep(_DRIVER_BUFFER_CHECK_INTERVAL)
+            if not self._controller.isPolyglotLinkUp():
+                continue
+
+            with self._lock:
+                pending = self._pending
+                self._pending = collections.OrderedDict()
+
+            # report the current value of each buffered driver, grouped by node
+            if startTime is None:
+                startTime = time.time()
+            keys = sorted(pending)
+            for (i, key) in enumerate(keys):
+
+                # stop and buffer the remaining updates again if the connection goes down during the replay
+                if not self._controller.isPolyglotLinkUp():
+                    self._requeue(pending, keys[i:])
+                    break
+
+                (node, force) = pending[key]
+                for driver in node.drivers:
+                    if driver["driver"] == key[1]:
+                        polyinterface.Node.reportDriver(node, driver, True, force)
+                        break
+                replayed += 1
+                self.replayed += 1
+
+            # finished once no updates were buffered in the meantime
+            with self._lock:
+                if not self._pending:
+                    self._replayThread = None
+                    break
+
+        _LOGGER.info("Connection to Polyglot restored - replayed %d driver updates in %.3f seconds (%d dropped).", replayed, time.time() - startTime, self.dropped)
+
+    # Put the keys of the pending updates that weren't replayed back in the buffer, ahead of any later updates
+    def _requeue(self, pending, keys):
+
+        with self._lock:
+            later = self._pending
+            self._pending = collections.OrderedDict((key, pending[key]) for key in keys)
+            for (key, (node, force)) in later.items():
+                entry = self._pending.get(key)
+                if entry is None:
+                    self._pending[key] = [node, force]
+                else:
+                    entry[1] = entry[1] or force
+            self._trim()
+
+# Report a driver value to Polyglot, or buffer it for replay if the connection to Polyglot is down
+def _reportDriver(node, driver, value, uom, force):
+
+    controller = node.controller
+    if controller.isPolyglotLinkUp():
+        polyinterface.Node.setDriver(node, driver, value, True, force, uom)
+    else:
+        polyinterface.Node.setDriver(node, driver, value, False, False, uom)
+        controller.driverBuffer.add(node, driver, force)
+
+# Collects driver updates for all nodes and reports them to Polyglot in batches grouped by node, within a bounded delay
+# or when a poll cycle completes - only the latest value of each driver is reported, so bursts of BPUP status updates
+# and changes that are reverted before the flush don't each produce a message
+class DriverBatcher(object):
+
+    def __init__(self, flushDelay):
+
+        self._flushDelay = flushDelay
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock() # keeps flushes in order
+        self._pending = {} # list of [node, value, uom, force] by (node address, driver)
+        self._wake = threading.Event()
+        self._stopped = False
+        self.flushes = 0
+        self.reported = 0 # driver updates passed to polyinterface in flushes
+        self.coalesced = 0 # driver updates replaced by a later value before the flush
+
+        threading.Thread(target=self._run, name="DriverFlush", daemon=True).start()
+
+    # Add a driver update for the node to the batch
+    def add(self, node, driver, value, uom, force):
+
+        key = (node.address, driver)
+        with self._lock:
+
+            # check for stopped under the lock so no update is added after the final flush
+            stopped = self._stopped
+            if stopped:
+                first = False
+            else:
+                entry = self._pending.get(key)
+                if entry is None:
+                    self._pending[key] = [node, value, uom, force]
+                    first = len(self._pending) == 1
+                else:
+                    entry[1] = value
+                    if uom is not None:
+                        entry[2] = uom
+                    entry[3] = entry[3] or force
+                    self.coalesced += 1
+                    first = False
+
+        # report directly once stopped (after the final flush has completed so an older value isn't reported last)
+        if stopped:
+            with self._flushLock:
+                _reportDriver(node, driver, value, uom, force)
+
+        # start the flush delay with the first update of the batch
+        if first:
+            self._wake.set()
+
+    # Flush the batches after the flush delay
+    def _run(self):
+
+        while not self._stopped:
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(self._flushDelay)
+            self.flush()
+
+    # Report the pending driver updates to Polyglot, grouped by node (stops batching if stop is set)
+    def flush(self, stop=False):
+
+        with self._flushLock:
+
+            with self._lock:
+                if stop:
+                    self._stopped = True
+                pending = self._pending
+                self._pending = {}
+
+            if not pending:
+                return
+
+            for key in sorted(pending):
+                (node, value, uom, force) = pending[key]
+                _reportDriver(node, key[1], value, uom, force)
+
+            self.flushes += 1
+            self.reported += len(pending)
+
+    # Flush the pending driver updates and report any later updates directly
+    def stop(self):
+
+        self.flush(True)
+        self._wake.set()
+
+# quantiles of HTTP request latency estimated from the REST API call stats for the metrics endpoint
+_METRICS_QUANTILES = (0.5, 0.9, 0.99)
+
+# metric families for the metrics endpoint as (name, type, help)
+_METRICS_FAMILIES = (
+    ("bond_nodes", "gauge", "Number of nodes by node type."),
+    ("bond_poll_cycle_seconds", "gauge", "Duration of the last shortPoll cycle for all bridges."),
+    ("bond_polyglot_input_queue_depth", "gauge", "Number of Polyglot messages waiting to be processed."),
+    ("bond_command_traces_pending", "gauge", "Number of commands awaiting BPUP confirmation."),
+    ("bond_commands_unconfirmed_total", "counter", "Number of commands never confirmed by a BPUP status update."),
+    ("bond_commands_failed_total", "counter", "Number of commands with failed HTTP calls."),
+    ("bond_driver_updates_total", "counter", "Number of driver updates by result (passed to Polyglot, suppressed as unchanged, coalesced in a batch, or buffered or dropped while Polyglot was disconnected)."),
+    ("bond_driver_updates_pending", "gauge", "Number of driver updates buffered for replay while Polyglot is disconnected."),
+    ("bond_driver_flushes_total", "counter", "Number of batches of driver updates reported to Polyglot."),
+    ("bond_bridge_up", "gauge", "Whether the bridge was reachable on the last poll."),
+    ("bond_bridge_poll_cycle_seconds", "gauge", "Duration of the last poll of the bridge and its devices."),
+    ("bond_commands_suppressed_total", "counter", "Number of redundant commands suppressed."),
+    ("bond_bpup_messages_total", "counter", "Number of BPUP status updates received."),
+    ("bond_bpup_last_message_age_seconds", "gauge", "Time since the last BPUP status update."),
+    ("bond_bpup_keepalive_rtt_seconds", "gauge", "Round trip time of the last BPUP keep-alive."),
+    ("bond_http_request_duration_seconds", "histogram", "Latency of REST API calls to the bridge."),
+    ("bond_http_request_latency_seconds", "gauge", "Estimated quantiles of REST API call latency for the bridge."),
+    ("bond_http_responses_total", "counter", "Number of REST API responses by status code."),
+    ("bond_http_timeouts_total", "counter", "Number of REST API calls that timed out."),
+    ("bond_http_errors_total", "counter", "Number of REST API calls that failed to connect."),
+    ("bond_http_received_bytes_total", "counter", "Number of bytes received in REST API responses.")
+)
+
+# Estimate a quantile from histogram bucket counts by interpolating within the bucket (bounds in ms)
+def _histogramQuantile(bounds, buckets, q):
+
+    total = sum(buckets)
+    if total == 0:
+        return None
+
+    rank = q * total
+    count = 0
+    for i in range(len(buckets)):
+        if buckets[i] and count + buckets[i] >= rank:
+            lower = bounds[i - 1] if i > 0 else 0
+            if i == len(bounds): # values above the last bound
+                return lower
+            return lower + (bounds[i] - lower) * (rank - count) / buckets[i]
+        count += buckets[i]
+
+    return bounds[-1]
+
+# Format a set of metric labels, escaping the values for the text exposition format
+def _metricLabels(**labels):
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for (name, value) in sorted(labels.items())) + "}"
+
+# Serves the nodeserver metrics in the Prometheus text exposition format on localhost from a background thread
+class MetricsServer(object):
+
+    def __init__(self, controller, port):
+
+        self.controller = controller
+        metricsServer = self
+
+        class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metricsServer.formatMetrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # log requests at debug level rather than to stderr
+            def log_message(self, format, *args):
+                _LOGGER.debug("Metrics endpoint: " + format, *args)
+
+        self._server = http.server.HTTPServer(("127.0.0.1", port), _MetricsRequestHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True)
+
+    def start(self):
+
+        self._thread.start()
+        _LOGGER.info("Metrics endpoint started at http://127.0.0.1:%d/metrics", self._server.server_address[1])
+
+    def stop(self):
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Return the current metrics in the text exposition format
+    def formatMetrics(self):
+
+        controller = self.controller
+        samples = collections.defaultdict(list) # lists of (sample name suffix, labels, value) keyed by metric family
+
+        def add(family, labels, value, suffix=""):
+            if value is not None:
+                samples[family].append((suffix, labels, value))
+
+        # node counts by node type
+        nodes = [controller.nodes[addr] for addr in list(controller.nodes)]
+        nodeCounts = collections.Counter(node.id for node in nodes)
+        for nodeDefID in sorted(nodeCounts):
+            add("bond_nodes", _metricLabels(type=nodeDefID), nodeCounts[nodeDefID])
+
+        # nodeserver poll cycle and queue depths
+        add("bond_poll_cycle_seconds", "", controller.pollCycleTime)
+        add("bond_polyglot_input_queue_depth", "", controller.poly.inQueue.qsize())
+        tracerStats = controller.tracer.getStats()
+        add("bond_command_traces_pending", "", tracerStats["pending"])
+        add("bond_commands_unconfirmed_total", "", tracerStats["unconfirmed"])
+        add("bond_commands_failed_total", "", tracerStats["failed"])
+        add("bond_driver_updates_total", _metricLabels(result="passed"), controller.driverUpdates)
+        add("bond_driver_updates_total", _metricLabels(result="suppressed"), controller.driverUpdatesSuppressed)
+        add("bond_driver_updates_total", _metricLabels(result="buffered"), controller.driverBuffer.buffered)
+        add("bond_driver_updates_total", _metricLabels(result="dropped"), controller.driverBuffer.dropped)
+        add("bond_driver_updates_pending", "", controller.driverBuffer.getPendingCount())
+        if controller.driverBatcher is not None:
+            add("bond_driver_updates_total", _metricLabels(result="coalesced"), controller.driverBatcher.coalesced)
+            add("bond_driver_flushes_total", "", controller.driverBatcher.flushes)
+
+        # bridge metrics
+        currentTime = time.time()
+        for bridge in [node for node in nodes if node.id == "BRIDGE"]:
+
+            bridgeLabels = _metricLabels(bridge=bridge.address)
+            add("bond_bridge_up", bridgeLabels, 1 if bridge.readiness == _BRIDGE_READY else 0)
+            add("bond_bridge_poll_cycle_seconds", bridgeLabels, bridge.pollCycleTime)
+            add("bond_commands_suppressed_total", bridgeLabels, bridge.suppressedCommands)
+            add("bond_bpup_messages_total", bridgeLabels, bridge.bpupMessages)
+            if bridge.lastPushTime is not None:
+                add("bond_bpup_last_message_age_seconds", bridgeLabels, currentTime - bridge.lastPushTime)
+
+            if bridge.bondBridge is None:
+                continue
+
+            add("bond_bpup_keepalive_rtt_seconds", bridgeLabels, bridge.bondBridge.getKeepAliveRTT())
+
+            # HTTP request metrics by endpoint from the REST API call stats
+            apiStats = bridge.bondBridge.getStats() or {}
+            bridgeBuckets = [0] * (len(API_STATS_BUCKETS_MS) + 1)
+            for endpoint in sorted(apiStats):
+
+                endpointStats = apiStats[endpoint]
+                endpointLabels = _metricLabels(bridge=bridge.address, endpoint=endpoint)
+                cumulative = 0
+                for i in range(len(API_STATS_BUCKETS_MS)):
+                    cumulative += endpointStats["buckets"][i]
+                    add("bond_http_request_duration_seconds", _metricLabels(bridge=bridge.address, endpoint=endpoint, le=API_STATS_BUCKETS_MS[i] / 1000), cumulative, "_bucket")
+                add("bond_http_request_duration_seconds", _metricLabels(bridge=bridge.address, endpoint=endpoint, le="+Inf"), endpointStats["requests"], "_bucket")
+                add("bond_http_request_duration_seconds", endpointLabels, endpointStats["latencySum"] / 1000, "_sum")
+                add("bond_http_request_duration_seconds", endpointLabels, endpointStats["requests"], "_count")
+                bridgeBuckets = [x + y for (x, y) in zip(bridgeBuckets, endpointStats["buckets"])]
+
+                for code in sorted(endpointStats["statusCodes"]):
+                    add("bond_http_responses_total", _metricLabels(bridge=bridge.address, endpoint=endpoint, code=code), endpointStats["statusCodes"][code])
+                add("bond_http_timeouts_total", endpointLabels, endpointStats["timeouts"])
+                add("bond_http_errors_total", endpointLabels, endpointStats["errors"])
+                add("bond_http_received_bytes_total", endpointLabels, endpointStats["bytesReceived"])
+
+            for q in _METRICS_QUANTILES:
+                latency = _histogramQuantile(API_STATS_BUCKETS_MS, bridgeBuckets, q)
+                if latency is not None:
+                    add("bond_http_request_latency_seconds", _metricLabels(bridge=bridge.address, quantile=q), latency / 1000)
+
+        # format the samples with the HELP and TYPE lines for each metric family
+        lines = []
+        for (family, metricType, help) in _METRICS_FAMILIES:
+            if family in samples:
+                lines.append("# HELP {} {}".format(family, help))
+                lines.append("# TYPE {} {}".format(family, metricType))
+                for (suffix, labels, value) in samples[family]:
+                    lines.append("{}{}{} {}".format(family, suffix, labels, value))
+
+        return "\n".join(lines) + "\n"
+
+# constants for runtime profiling (profiling modes are index values of the GV21 driver of the controller)
+_PROFILE_OFF = 0
+_PROFILE_CPU = 1
+_PROFILE_MEMORY = 2
+_PROFILE_CPU_AND_MEMORY = 3
+_PROFILE_SAMPLE_INTERVAL = 0.010 # interval between stack samples of the nodeserver threads (seconds)
+_PROFILE_TRACEMALLOC_FRAMES = 10 # number of frames stored for each memory allocation
+_PROFILE_TOP_COUNT = 50 # number of top functions and allocation sites written to the results
+
+# Return the directory of the nodeserver log file
+def _getLogDirectory():
+
+    for handler in _LOGGER.handlers:
+        if isinstance(handler, logging.FileHandler):
+            return os.path.dirname(os.path.abspath(handler.baseFilename))
+
+    return os.path.abspath("logs")
+
+# Samples the stacks of all nodeserver threads (polyinterface, BPUP listeners, poll workers, etc.) and traces
+# memory allocations with tracemalloc, and writes the results to the log directory when stopped
+class RuntimeProfiler(object):
+
+    def __init__(self, mode):
+
+        self.mode = mode
+        self.startTime = None
+        self._stacks = collections.Counter() # sample counts keyed by collapsed stack
+        self._samples = 0
+        self._idleSamples = 0 # thread samples skipped because the thread used no CPU time since the last sample
+        self._cpuClocks = hasattr(time, "pthread_getcpuclockid")
+        self._stopEvent = threading.Event()
+        self._thread = None
+        self._startedTracemalloc = False
+
+    # Start the sampling profiler and/or tracemalloc session
+    def start(self):
+
+        self.startTime = time.time()
+
+        # only stop tracemalloc when done if it was started here
+        if self.mode & _PROFILE_MEMORY and not tracemalloc.is_tracing():
+            tracemalloc.start(_PROFILE_TRACEMALLOC_FRAMES)
+            self._startedTracemalloc = True
+
+        if self.mode & _PROFILE_CPU:
+            self._thread = threading.Thread(target=self._sampler, name="Profiler", daemon=True)
+            self._thread.start()
+
+    # Stop profiling and write the results to the log directory - returns list of files written
+    def stop(self):
+
+        fileBase = os.path.join(_getLogDirectory(), "profile-" + time.strftime("%Y%m%d-%H%M%S", time.localtime(self.startTime)))
+        files = []
+
+        if self._thread is not None:
+            self._stopEvent.set()
+            self._thread.join()
+            files.extend(self._writeCPUResults(fileBase))
+
+        if self.mode & _PROFILE_MEMORY and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            if self._startedTracemalloc:
+                tracemalloc.stop()
+                self._startedTracemalloc = False
+            files.extend(self._writeMemoryResults(fileBase, snapshot))
+
+        return files
+
+    # Return the CPU time used by the thread (seconds), or None if not available
+    def _getThreadCPUTime(self, threadID):
+
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(threadID))
+        except (AttributeError, OSError):
+            return None
+
+    # Sample the stacks of the other threads until stopped
+    # Note: where per-thread CPU clocks are available, threads that used no CPU time since the last sample (blocked
+    # in recv(), Event.wait(), sleep(), etc.) are skipped, so that the results reflect CPU time rather than wall-clock time
+    def _sampler(self):
+
+        ownID = threading.get_ident()
+        cpuTimes = {}
+        while not self._stopEvent.wait(_PROFILE_SAMPLE_INTERVAL):
+
+            threadNames = {thread.ident: thread.name for thread in threading.enumerate()}
+            for (threadID, frame) in sys._current_frames().items():
+                if threadID == ownID:
+                    continue
+
+                if self._cpuClocks:
+                    cpuTime = self._getThreadCPUTime(threadID)
+                    lastCPUTime = cpuTimes.get(threadID)
+                    cpuTimes[threadID] = cpuTime
+                    if cpuTime is not None and cpuTime == lastCPUTime:
+                        self._idleSamples += 1
+                        continue
+
+                stack = []
+                while frame is not None:
+                    stack.append("{} ({}:{})".format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename), frame.f_code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(threadNames.get(threadID, str(threadID)))
+                stack.reverse()
+
+                self._stacks[";".join(stack)] += 1
+
+            self._samples += 1
+
+    # Write the collapsed stacks (for flame graph tools) and the functions with the most samples
+    def _writeCPUResults(self, fileBase):
+
+        # the collapsed stacks include the thread name as the root frame
+        with open(fileBase + "-cpu.collapsed", "w") as f:
+            for (stack, count) in self._stacks.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+        # samples where each function was on the stack (total) or at the top of the stack (self)
+        selfCounts = collections.Counter()
+        totalCounts = collections.Counter()
+        for (stack, count) in self._stacks.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                selfCounts[frames[-1]] += count
+            for frame in set(frames):
+                totalCounts[frame] += count
+
+        with open(fileBase + "-cpu.txt", "w") as f:
+            if self._cpuClocks:
+                f.write("{} samples of threads using CPU time at {:.0f} ms intervals over {:.1f} seconds ({} idle thread samples skipped)\n\n".format(self._samples, _PROFILE_SAMPLE_INTERVAL * 1000, time.time() - self.startTime, self._idleSamples))
+            else:
+                f.write("{} wall-clock samples of all threads (including idle threads) at {:.0f} ms intervals over {:.1f} seconds\n\n".format(self._samples, _PROFILE_SAMPLE_INTERVAL * 1000, time.time() - self.startTime))
+            f.write("{:>10} {:>10}  {}\n".format("self", "total", "function"))
+            for (frame, count) in selfCounts.most_common(_PROFILE_TOP_COUNT):
+                f.write("{:>10} {:>10}  {}\n".format(count, totalCounts[frame], frame))
+
+        return [fileBase + "-cpu.collapsed", fileBase + "-cpu.txt"]
+
+    # Write the snapshot and the allocation sites with the most memory
+    def _writeMemoryResults(self, fileBase, snapshot):
+
+        # the snapshot file can be loaded with tracemalloc.Snapshot.load() for further analysis
+        snapshot.dump(fileBase + "-memory.tracemalloc")
+
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        stats = snapshot.statistics("lineno")
+        with open(fileBase + "-memory.txt", "w") as f:
+            f.write("{} bytes in {} blocks allocated while tracing\n\n".format(sum(stat.size for stat in stats), sum(stat.count for stat in stats)))
+            f.write("{:>12} {:>10}  {}\n".format("bytes", "blocks", "allocation site"))
+            for stat in stats[:_PROFILE_TOP_COUNT]:
+                f.write("{:>12} {:>10}  {}\n".format(stat.size, stat.count, stat.traceback))
+
+        return [fileBase + "-memory.tracemalloc", fileBase + "-memory.txt"]
+
+# Run a command for a device node with command tracing (replaces polyinterface.Node.runCmd for device nodes)
+def _runTracedCmd(self, command):
+
+    if command["cmd"] in self.commands:
+
+        trace = self.controller.tracer.begin(self.address, command["cmd"])
+        try:
+            self.commands[command["cmd"]](self, command)
+        finally:
+            self.controller.tracer.end()
+
+        return trace
+
+# Set a driver value - skips the call to polyinterface if the value and UOM are unchanged from those last reported
+# (replaces polyinterface.Node.setDriver, which searches the driver lists and compares the values as strings)
+def _setShadowedDriver(self, driver, value, report=True, force=False, uom=None):
+
+    # shadow of the last value (as a string, for the same comparison as polyinterface) and UOM reported by driver
+    shadow = getattr(self, "_driverShadow", None)
+    if shadow is None:
+        shadow = self._driverShadow = {}
+
+    strValue = str(value)
+    last = shadow.get(driver)
+    if report and not force and last is not None and last[0] == strValue and (uom is None or uom == last[1]):
+        self.controller.driverUpdatesSuppressed += 1
+        return
+
+    # report the value in the next batch if driver updates are batched (the node's driver value is set right away)
+    batcher = self.controller.driverBatcher
+    if report and batcher is not None:
+        polyinterface.Node.setDriver(self, driver, value, False, False, uom)
+        batcher.add(self, driver, value, uom, force)
+    elif report:
+        _reportDriver(self, driver, value, uom, force)
+    else:
+        polyinterface.Node.setDriver(self, driver, value, False, force, uom)
+    self.controller.driverUpdates += 1
+
+    # the value is unknown to Polyglot until it is reported
+    if report:
+        shadow[driver] = (strValue, uom if uom is not None else last[1] if last is not None else None)
+    else:
+        shadow.pop(driver, None)
+
+# Update the record of reported driver values (replaces polyinterface.Node.updateDrivers to clear the driver shadow
+# when polyinterface resets its record, i.e., on reportDrivers() and when Polyglot sends the config)
+def _updateShadowedDrivers(self, drivers):
+
+    self._driverShadow = None
+    polyinterface.Node.updateDrivers(self, drivers)
+
 # Node for a celing fan
 class CeilingFan(polyinterface.Node):
 
@@ -53,6 +865,10 @@ class CeilingFan(polyinterface.Node):
     _maxSpeed = 0
     _hasDirection = 0
     
+    runCmd = _runTracedCmd
+    setDriver = _setShadowedDriver
+    updateDrivers = _updateShadowedDrivers
+
     def __init__(self, controller, primary, addr, name, deviceID=None, hasDirection=0):
         super(CeilingFan, self).__init__(controller, primary, addr, name)
     
@@ -93,8 +909,12 @@ class CeilingFan(polyinterface.Node):
             # compute a speed value for the %
             speed = self.computeFanSpeed(value, self._maxSpeed)
 
+            # skip the command if the fan is already on at the speed
+            if self.parent.isCommandRedundant(self.deviceID, {"power": 1, "speed": speed}):
+                return
+
             # Set the speed value for the fan (this turns the power on)
-            if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_SET_SPEED, speed):
+            if self.parent.execDeviceAction(self.deviceID, API_ACTION_SET_SPEED, speed):
         
                 # Let BPUP process the state change
                 pass
@@ -106,8 +926,13 @@ class CeilingFan(polyinterface.Node):
                 _LOGGER.warning("Call to exceDeviceAction() failed in DON command handler.")
 
         else:
+
+            # skip the command if the fan is already on
+            if self.parent.isCommandRedundant(self.deviceID, {"power": 1}):
+                return
+
             # execute the TurnOn action through the Bond bridge (to the previous speed)
-            if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_TURN_ON):
+            if self.parent.execDeviceAction(self.deviceID, API_ACTION_TURN_ON):
 
                 # Let BPUP process the state change
                 pass
@@ -116,7 +941,7 @@ class CeilingFan(polyinterface.Node):
                 #time.sleep(_DELAY_AFTER_ACTION)
 
                 # Get current speed
-                #respData = self.parent.bondBridge.getDeviceState(self.deviceID)
+                #respData = self.parent.getDeviceState(self.deviceID)
                 #state = self.computePercentSpeed(respData["speed"], self._maxSpeed)
     
                 # update the state driver
@@ -130,8 +955,12 @@ class CeilingFan(polyinterface.Node):
 
         _LOGGER.debug("Turn off fan in cmd_dof()...")
 
+        # skip the command if the fan is already off
+        if self.parent.isCommandRedundant(self.deviceID, {"power": 0}):
+            return
+
         # execute the TurnOff action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_TURN_OFF):
+        if self.parent.execDeviceAction(self.deviceID, API_ACTION_TURN_OFF):
 
             # Let BPUP process the state change
             pass
@@ -148,7 +977,7 @@ class CeilingFan(polyinterface.Node):
         _LOGGER.debug("Increase fan speed cmd_increase_speed()...")
 
         # execute the IncreaseSpeed action (by 1 speed) through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_INCREASE_SPEED, 1):
+        if self.parent.execDeviceAction(self.deviceID, API_ACTION_INCREASE_SPEED, 1):
 
             # Let BPUP process the state change
             pass
@@ -157,7 +986,7 @@ class CeilingFan(polyinterface.Node):
             #time.sleep(_DELAY_AFTER_ACTION)
 
             # Get current speed
-            #respData = self.parent.bondBridge.getDeviceState(self.deviceID)
+            #respData = self.parent.getDeviceState(self.deviceID)
             #state = self.computePercentSpeed(respData["speed"], self._maxSpeed)
     
             # update the state driver
@@ -172,7 +1001,7 @@ class CeilingFan(polyinterface.Node):
         _LOGGER.debug("Decrease fan speed cmd_decrease_speed()...")
 
         # execute the DecreaseSpeed action (by 1 speed) through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_DECREASE_SPEED, 1):
+        if self.parent.execDeviceAction(self.deviceID, API_ACTION_DECREASE_SPEED, 1):
 
             # Let BPUP process the state change
             pass
@@ -181,7 +1010,7 @@ class CeilingFan(polyinterface.Node):
             #time.sleep(_DELAY_AFTER_ACTION)
 
             # Get current speed
-            #respData = self.parent.bondBridge.getDeviceState(self.deviceID)
+            #respData = self.parent.getDeviceState(self.deviceID)
             #state = self.computePercentSpeed(respData["speed"], self._maxSpeed)
     
             # update the state driver
@@ -202,9 +1031,13 @@ class CeilingFan(polyinterface.Node):
         # If the speed value is greater than the max speed, then set to max speed
         if speed > self._maxSpeed:
             speed = self._maxSpeed
+
+        # skip the command if the fan is already on at the speed
+        if self.parent.isCommandRedundant(self.deviceID, {"power": 1, "speed": speed}):
+            return
         
         # Set the speed value for the fan (this turns the power on)
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_SET_SPEED, speed):
+        if self.parent.execDeviceAction(self.deviceID, API_ACTION_SET_SPEED, speed):
         
             # Let BPUP process the state change
             pass
@@ -239,8 +1072,12 @@ class CeilingFan(polyinterface.Node):
                 else:
                     direction = 1
 
+                # skip the command if the fan is already set to the direction
+                if self.parent.isCommandRedundant(self.deviceID, {"direction": direction}):
+                    return
+
                 # execute the SetDirection action through the Bond bridge
-                if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_SET_DIRECTION, direction):
+                if self.parent.execDeviceAction(self.deviceID, API_ACTION_SET_DIRECTION, direction):
                 
                     # Let BPUP process the state change
                     pass
@@ -257,7 +1094,7 @@ class CeilingFan(polyinterface.Node):
         _LOGGER.debug("Update fan driver values in updateState...")
 
         # retrieve the state data for the device from the Bond bridge
-        respData = self.parent.bondBridge.getDeviceState(self.deviceID)
+        respData = self.parent.getDeviceState(self.deviceID)
 
         if respData:
 
@@ -318,6 +1155,10 @@ class Light(polyinterface.Node):
     _lightType = 0
     _hasOwnBrightness = 0
     
+    runCmd = _runTracedCmd
+    setDriver = _setShadowedDriver
+    updateDrivers = _updateShadowedDrivers
+
     def __init__(self, controller, primary, addr, name, deviceID=None, lightType=_LIGHT_TYPE_DEFAULT, hasOwnBrightness=0):
         super(Light, self).__init__(controller, primary, addr, name)
     
@@ -355,10 +1196,16 @@ class Light(polyinterface.Node):
             # use the light specific action if supported
             if self._hasOwnBrightness:
                 action = _LIGHT_ACTION_SET_BRIGHTNESS[self._lightType]
+                brightness = _LIGHT_STATE_BRIGHTNESS[self._lightType]
             else:
                 action = _LIGHT_ACTION_SET_BRIGHTNESS[_LIGHT_TYPE_DEFAULT]
+                brightness = _LIGHT_STATE_BRIGHTNESS[_LIGHT_TYPE_DEFAULT]
 
-            if self.parent.bondBridge.execDeviceAction(self.deviceID, action, value):
+            # skip the command if the light is already on at the brightness level
+            if self.parent.isCommandRedundant(self.deviceID, {_LIGHT_STATE_POWER: 1, _LIGHT_STATE_ENABLED[self._lightType]: 1, brightness: value}):
+                return
+
+            if self.parent.execDeviceAction(self.deviceID, action, value):
         
                 # Let BPUP process the state change
                 pass
@@ -371,8 +1218,12 @@ class Light(polyinterface.Node):
 
         else:
 
+            # skip the command if the light is already on
+            if self.parent.isCommandRedundant(self.deviceID, {_LIGHT_STATE_POWER: 1, _LIGHT_STATE_ENABLED[self._lightType]: 1}):
+                return
+
             # execute the TurnOn action through the Bond bridge (to the previous brightness)
-            if self.parent.bondBridge.execDeviceAction(self.deviceID, _LIGHT_ACTION_ON[self._lightType]):
+            if self.parent.execDeviceAction(self.deviceID, _LIGHT_ACTION_ON[self._lightType]):
 
                 # Let BPUP process the state change
                 pass
@@ -392,8 +1243,12 @@ class Light(polyinterface.Node):
 
         _LOGGER.debug("Turn off light in cmd_dof: %s", str(command))
 
+        # skip the command if the light is already off
+        if self.parent.isCommandRedundant(self.deviceID, {_LIGHT_STATE_ENABLED[self._lightType]: 0}):
+            return
+
         # execute the TurnLightOff action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, _LIGHT_ACTION_OFF[self._lightType]):
+        if self.parent.execDeviceAction(self.deviceID, _LIGHT_ACTION_OFF[self._lightType]):
 
             # Let BPUP process the state change
             pass
@@ -416,7 +1271,7 @@ class Light(polyinterface.Node):
             action = _LIGHT_ACTION_INC_BRIGHTNESS[_LIGHT_TYPE_DEFAULT]
 
         # execute the IncreaseBrightness action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, action, 15):
+        if self.parent.execDeviceAction(self.deviceID, action, 15):
 
             # Let BPUP process the state change
             pass
@@ -442,7 +1297,7 @@ class Light(polyinterface.Node):
             action = _LIGHT_ACTION_DEC_BRIGHTNESS[_LIGHT_TYPE_DEFAULT]
 
         # execute the DecreaseBrightness action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, action, 15):
+        if self.parent.execDeviceAction(self.deviceID, action, 15):
 
             # Let BPUP process the state change
             pass
@@ -461,7 +1316,7 @@ class Light(polyinterface.Node):
         _LOGGER.debug("Update light driver values in updateState...")
         
         # retrieve the state data for the device from the Bond bridge
-        respData = self.parent.bondBridge.getDeviceState(self.deviceID)
+        respData = self.parent.getDeviceState(self.deviceID)
 
         if respData:
             self.setDrivers(respData, forceReport)
@@ -503,6 +1358,10 @@ class NoDimLight(polyinterface.Node):
     deviceID = ""
     _lightType = 0
     
+    runCmd = _runTracedCmd
+    setDriver = _setShadowedDriver
+    updateDrivers = _updateShadowedDrivers
+
     def __init__(self, controller, primary, addr, name, deviceID=None, lightType=_LIGHT_TYPE_DEFAULT):
         super(NoDimLight, self).__init__(controller, primary, addr, name)
     
@@ -529,8 +1388,12 @@ class NoDimLight(polyinterface.Node):
 
         _LOGGER.debug("Turn on light in cmd_don: %s", str(command))
 
+        # skip the command if the light is already on
+        if self.parent.isCommandRedundant(self.deviceID, {_LIGHT_STATE_POWER: 1, _LIGHT_STATE_ENABLED[self._lightType]: 1}):
+            return
+
         # execute the TurnLightOn action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, _LIGHT_ACTION_ON[self._lightType]):
+        if self.parent.execDeviceAction(self.deviceID, _LIGHT_ACTION_ON[self._lightType]):
 
             # Let BPUP process the state change
             pass
@@ -546,8 +1409,12 @@ class NoDimLight(polyinterface.Node):
 
         _LOGGER.debug("Turn off light in cmd_dof: %s", str(command))
 
+        # skip the command if the light is already off
+        if self.parent.isCommandRedundant(self.deviceID, {_LIGHT_STATE_ENABLED[self._lightType]: 0}):
+            return
+
          # execute the TurnLightOff action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, _LIGHT_ACTION_OFF[self._lightType]):
+        if self.parent.execDeviceAction(self.deviceID, _LIGHT_ACTION_OFF[self._lightType]):
 
             # Let BPUP process the state change
             pass
@@ -563,7 +1430,7 @@ class NoDimLight(polyinterface.Node):
         _LOGGER.debug("Update light driver values in updateState...")
         
         # retrieve the state data for the device from the Bond bridge
-        respData = self.parent.bondBridge.getDeviceState(self.deviceID)
+        respData = self.parent.getDeviceState(self.deviceID)
 
         if respData:
             self.setDrivers(respData, forceReport)
@@ -598,6 +1465,10 @@ class Generic(polyinterface.Node):
     hint = [0x01, 0x04, 0x02, 0x00] # Residential/Relay/On/Off Power Switch
     deviceID = ""
     
+    runCmd = _runTracedCmd
+    setDriver = _setShadowedDriver
+    updateDrivers = _updateShadowedDrivers
+
     def __init__(self, controller, primary, addr, name, deviceID=None):
         super(Generic, self).__init__(controller, primary, addr, name)
     
@@ -620,8 +1491,12 @@ class Generic(polyinterface.Node):
 
         _LOGGER.debug("Turn on device in cmd_don: %s", str(command))
 
+        # skip the command if the device is already on
+        if self.parent.isCommandRedundant(self.deviceID, {"power": 1}):
+            return
+
         # execute the TurnOn action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_TURN_ON):
+        if self.parent.execDeviceAction(self.deviceID, API_ACTION_TURN_ON):
 
             # Let BPUP process the state change
             pass
@@ -637,8 +1512,12 @@ class Generic(polyinterface.Node):
 
         _LOGGER.debug("Turn off device in cmd_dof()...")
 
+        # skip the command if the device is already off
+        if self.parent.isCommandRedundant(self.deviceID, {"power": 0}):
+            return
+
          # execute the TurnOff action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_TURN_OFF):
+        if self.parent.execDeviceAction(self.deviceID, API_ACTION_TURN_OFF):
 
             # Let BPUP process the state change
             pass
@@ -654,7 +1533,7 @@ class Generic(polyinterface.Node):
         _LOGGER.debug("Update device driver values in updateState()...")
         
         # retrieve the device state from the Bond bridge
-        respData = self.parent.bondBridge.getDeviceState(self.deviceID)
+        respData = self.parent.getDeviceState(self.deviceID)
 
         if respData:
             self.setDrivers(respData, forceReport)
@@ -699,8 +1578,12 @@ class Shade(Generic):
 
         _LOGGER.debug("Open shade in cmd_don: %s", str(command))
 
+        # skip the command if the shade is already open
+        if self.parent.isCommandRedundant(self.deviceID, {"open": 1}):
+            return
+
         # execute the Open action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_OPEN):
+        if self.parent.execDeviceAction(self.deviceID, API_ACTION_OPEN):
 
             # Let BPUP process the state change
             pass
@@ -716,8 +1599,12 @@ class Shade(Generic):
 
         _LOGGER.debug("Close shade in cmd_dof()...")
 
+        # skip the command if the shade is already closed
+        if self.parent.isCommandRedundant(self.deviceID, {"open": 0}):
+            return
+
          # execute the Close action through the Bond bridge
-        if self.parent.bondBridge.execDeviceAction(self.deviceID, API_ACTION_CLOSE):
+        if self.parent.execDeviceAction(self.deviceID, API_ACTION_CLOSE):
 
             # Let BPUP process the state change
             pass
@@ -733,7 +1620,7 @@ class Shade(Generic):
         _LOGGER.debug("Update shade driver values in updateState()...")
         
         # retrieve the device state from the Bond bridge
-        respData = self.parent.bondBridge.getDeviceState(self.deviceID)
+        respData = self.parent.getDeviceState(self.deviceID)
 
         if respData:
             self.setDrivers(respData, forceReport)
@@ -758,18 +1645,154 @@ class Shade(Generic):
         "DOF": cmd_dof
     }
     
+# Node for a group of device nodes (scene) configured in custom parameters
+# Fans commands out to the member nodes concurrently, across bridges
+class Group(polyinterface.Node):
+
+    id = "GROUP"
+    hint = [0x01, 0x02, 0x00, 0x00] # Residential/Controller
+    members = None
+    memberResults = None # (result, reason) by member node address for the last command
+
+    setDriver = _setShadowedDriver
+    updateDrivers = _updateShadowedDrivers
+
+    def __init__(self, controller, primary, addr, name, members=None):
+        super(Group, self).__init__(controller, primary, addr, name)
+
+        if members is None:
+
+            # retrieve the member node addresses from polyglot custom data
+            self.members = controller.getCustomData(addr).split(";")
+
+        else:
+            self.setMembers(members)
+
+    # Set the member node addresses and store them in polyglot custom data
+    def setMembers(self, members):
+
+        self.members = members
+        self.controller.addCustomData(self.address, ";".join(self.members))
+
+    # Turn on member devices
+    def cmd_don(self, command):
+
+        _LOGGER.debug("Turn on group in cmd_don: %s", str(command))
+
+        self.fanOutCommand(command)
+
+    # Turn off member devices
+    def cmd_dof(self, command):
+
+        _LOGGER.debug("Turn off group in cmd_dof: %s", str(command))
+
+        self.fanOutCommand(command)
+
+    # Run the command for all member nodes concurrently and report the result for each member and the totals
+    def fanOutCommand(self, command):
+
+        # lookup the member nodes that support the command - other members count as failed
+        results = {} # result for each member node address
+        nodes = []
+        for addr in self.members:
+            node = self.controller.nodes.get(addr)
+            if node is None:
+                results[addr] = (_GROUP_RESULT_FAILED, "node not found")
+            elif node.id == "GROUP":
+                results[addr] = (_GROUP_RESULT_FAILED, "groups can't be members of groups")
+            elif command["cmd"] not in node.commands:
+                results[addr] = (_GROUP_RESULT_FAILED, "command not supported")
+            else:
+                nodes.append(node)
+
+        # run the command handlers for the member nodes on the controller's pool of threads
+        # Note: the number of concurrent actions per bridge is limited in Bridge.execDeviceAction()
+        startTime = time.time()
+        futures = {self.controller.groupExecutor.submit(node.runCmd, dict(command, address=node.address)): node for node in nodes}
+        for future in concurrent.futures.as_completed(futures):
+            node = futures[future]
+            try:
+                trace = future.result()
+            except Exception as e:
+                results[node.address] = (_GROUP_RESULT_FAILED, "raised an exception: " + str(e))
+            else:
+
+                # the trace shows whether an action was sent to the bridge and the bridge accepted it
+                if trace is None:
+                    results[node.address] = (_GROUP_RESULT_UNKNOWN, "no result")
+                elif trace.get("failed"):
+                    results[node.address] = (_GROUP_RESULT_FAILED, "bridge request failed")
+                elif "send" not in trace["times"]:
+                    results[node.address] = (_GROUP_RESULT_UNKNOWN, "not sent (device already in state)")
+                else:
+                    results[node.address] = (_GROUP_RESULT_SUCCEEDED, "succeeded")
+
+        # log the result for each member
+        counts = {_GROUP_RESULT_SUCCEEDED: 0, _GROUP_RESULT_FAILED: 0, _GROUP_RESULT_UNKNOWN: 0}
+        for addr in self.members:
+            (result, reason) = results[addr]
+            counts[result] += 1
+            _LOGGER.log(logging.WARNING if result == _GROUP_RESULT_FAILED else logging.INFO, "Group %s command %s for member node %s: %s", self.address, command["cmd"], addr, reason)
+        self.memberResults = results
+
+        _LOGGER.info("Group %s command %s completed in %.3f seconds - succeeded: %d, failed: %d, unknown: %d", self.address, command["cmd"], time.time() - startTime, counts[_GROUP_RESULT_SUCCEEDED], counts[_GROUP_RESULT_FAILED], counts[_GROUP_RESULT_UNKNOWN])
+
+        # update the overall result and the counts
+        if not self.members:
+            status = _GROUP_STATUS_NONE
+        elif counts[_GROUP_RESULT_FAILED] == 0:
+            status = _GROUP_STATUS_SUCCEEDED
+        elif counts[_GROUP_RESULT_FAILED] < len(self.members):
+            status = _GROUP_STATUS_PARTIAL
+        else:
+            status = _GROUP_STATUS_FAILED
+        self.setDriver("ST", status)
+        self.setDriver("GV0", counts[_GROUP_RESULT_SUCCEEDED])
+        self.setDriver("GV1", counts[_GROUP_RESULT_FAILED])
+        self.setDriver("GV2", counts[_GROUP_RESULT_UNKNOWN])
+
+    drivers = [
+        {"driver": "ST", "value": 0, "uom": _ISY_INDEX_UOM},
+        {"driver": "GV0", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV1", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV2", "value": 0, "uom": _ISY_RAW_UOM}
+    ]
+    commands = {
+        "DON": cmd_don,
+        "DOF": cmd_dof
+    }
+
 # Class for Bond Bridge or SBB composite device
 class Bridge(polyinterface.Node):
 
     id = "BRIDGE"
     hint = [0x01, 0x0E, 0x01, 0x00] # Residential/Gateway
     bondBridge = None
+    setDriver = _setShadowedDriver
+    updateDrivers = _updateShadowedDrivers
+    readiness = _BRIDGE_PENDING
+    suppressedCommands = 0
+    bpupMessages = 0
+    lastPushTime = None
+    pollCycleTime = None
+    _lastPerformanceUpdate = None # time and BPUP message count at the last performance update
     _bridgeHostName = ""
     _bridgeToken = ""
+    _deviceStates = None
+    _listenerStarted = False
 
     def __init__(self, controller, primary, addr, name, bridgeHostName=None, bridgeToken=None):
         super(Bridge, self).__init__(controller, addr, addr, name) # send its own address as primary
 
+        # last known state of each device (keyed by device ID) as a tuple of (time, state data)
+        self._deviceStates = {}
+
+        # limit the number of concurrent device actions sent to the bridge
+        self._actionSemaphore = threading.BoundedSemaphore(_BRIDGE_MAX_CONCURRENT_ACTIONS)
+
+        # serializes starting the BPUP listener between bring-up, discovery, and onboarding threads
+        self._connectLock = threading.Lock()
+
         # make the receiver a primary node
         self.isPrimary = True
 
@@ -789,7 +1812,26 @@ class Bridge(polyinterface.Node):
             controller.addCustomData(addr, cData)
        
         # create an instance of the API object for the bridge with the specified hostname and token
-        self.bondBridge = bondBridgeConnection(self._bridgeHostName, self._bridgeToken, stateCallback=self._BPUP_statusUpdate, logger=_LOGGER)
+        # (on the shared event loop if the controller is running the asyncio runtime)
+        # Note: the BPUP listener is started separately in connect() so that bridge construction never blocks
+        if self.controller.workerPool is not None:
+            self.bondBridge = self.controller.workerPool.createConnection(self.address, self._bridgeHostName, self._bridgeToken)
+        elif self.controller.runtime is not None:
+            self.bondBridge = bondaio.LoopBondBridgeConnection(self._bridgeHostName, self._bridgeToken, self.controller.runtime, logger=_LOGGER)
+        else:
+            transport = API_HTTP_TRANSPORTS[self.controller.httpTransport]() if self.controller.httpTransport else None
+            self.bondBridge = bondBridgeConnection(self._bridgeHostName, self._bridgeToken, logger=_LOGGER, transport=transport)
+
+        # collect REST API call stats if sinks were configured for the controller
+        if self.controller.apiStatsSinks is not None:
+            self.bondBridge.enableStats(self.controller.apiStatsSinks)
+
+        # record BPUP traffic if a recorder was configured for the controller
+        if self.controller.bpupRecorder is not None:
+            self.bondBridge.setBPUPRecorder(self.controller.bpupRecorder)
+
+        # set when the bridge has been connected and the first poll of its devices has completed
+        self.ready = threading.Event()
 
         # register the stop method for the bridge node
         self.controller.poly.onStop(self.stop)
@@ -804,6 +1846,44 @@ class Bridge(polyinterface.Node):
         # Set the bridge  status flag to indicate bridge is disconnected
         self.setDriver("ST", 0, True, True)
 
+    # Change the host of the bridge to the specified IP address (e.g., after a DHCP address change)
+    def setHostAddress(self, ipAddress):
+
+        # keep the port of the REST API, if one was specified (e.g., "192.168.1.145:8080")
+        hostParts = self._bridgeHostName.split(":")
+        if hostParts[0] == ipAddress:
+            return
+        hostParts[0] = ipAddress
+        self._bridgeHostName = ":".join(hostParts)
+
+        _LOGGER.info("Bridge %s moved to %s - updating connection.", self.address, self._bridgeHostName)
+
+        # store the new host name in polyglot custom data
+        self.controller.addCustomData(self.address, ";".join([self._bridgeHostName, self._bridgeToken]))
+        self.controller.saveCustomData(self.controller._customData)
+
+        # swap the host in the connection (REST API and BPUP listener)
+        self.bondBridge.setHostName(self._bridgeHostName)
+
+    # Start the BPUP listener for status updates from the bridge (if not already started)
+    def connect(self):
+
+        with self._connectLock:
+            if not self._listenerStarted:
+                self._listenerStarted = True
+                self.bondBridge.startBPUPListener(self._BPUP_statusUpdate)
+
+    # Connect to the bridge and perform the first poll of the devices - to be executed on a separate thread
+    def bringUp(self, forceReport=True):
+
+        startTime = time.time()
+
+        self.readiness = _BRIDGE_CONNECTING
+        self.connect()
+        self.updateNodeStates(forceReport)
+
+        _LOGGER.info("Bridge %s bring-up completed in %.3f seconds - %s.", self.address, time.time() - startTime, self.readiness)
+
     # Update node states for this and child nodes
     def cmd_query(self, command):
 
@@ -956,48 +2036,207 @@ class Bridge(polyinterface.Node):
                         )
                         self.controller.addNode(node)
 
+    # Retrieve the state of a device through the Bond bridge and cache it
+    def getDeviceState(self, deviceID):
+
+        respData = self.bondBridge.getDeviceState(deviceID)
+        if respData:
+            self._deviceStates[deviceID] = (time.time(), respData)
+
+        return respData
+
+    # Execute an action for a device through the Bond bridge
+    def execDeviceAction(self, deviceID, action, argument=None):
+
+        # the cached state for the device is unreliable until the bridge reports the new state
+        self._deviceStates.pop(deviceID, None)
+
+        # trace the action if it was sent from a command handler
+        trace = self.controller.tracer.current()
+        if trace is not None:
+            self.controller.tracer.sent(self.address, trace, deviceID, action)
+
+        with self._actionSemaphore:
+            success = self.bondBridge.execDeviceAction(deviceID, action, argument)
+
+        if trace is not None:
+            self.controller.tracer.responded(self.address, trace, success)
+
+        return success
+
+    # Check whether an absolute command would leave the device in its last known state
+    def isCommandRedundant(self, deviceID, targetState):
+
+        # always send the command if the user has configured commands to be forced
+        if self.controller.forceCommands:
+            return False
+
+        # don't suppress the command if the cached state is missing or stale
+        cachedState = self._deviceStates.get(deviceID)
+        if cachedState is None or time.time() - cachedState[0] > _STATE_CACHE_MAX_AGE:
+            return False
+
+        # compare the target state values to the cached state values
+        for key in targetState:
+            if cachedState[1].get(key) != targetState[key]:
+                return False
+
+        self.suppressedCommands += 1
+        _LOGGER.debug("Suppressed redundant command for device %s (%d suppressed).", deviceID, self.suppressedCommands)
+
+        return True
+
+    # return the device IDs of the device nodes belonging to this bridge
+    def getDeviceIDs(self):
+        return list(set(node.deviceID for node in self.getDeviceNodes()))
+
+    # return the device nodes belonging to this bridge
+    def getDeviceNodes(self):
+
+        # ignore the controller and this bridge node - device nodes have this node's address as primary
+        return [node for (addr, node) in list(self.controller.nodes.items()) if addr != self.address and addr != self.controller.address and node.primary == self.address]
+
+    # poll the bridge and the states of its devices concurrently on the event loop of the asyncio runtime
+    # returns an awaitable for a tuple of (bridge alive, dictionary of state data by device ID)
+    def pollDeviceStates(self):
+        return self.bondBridge.connection.pollDeviceStates(self.getDeviceIDs())
+
     # update the state of all nodes through the Bond bridge
-    def updateNodeStates(self, forceReport=False):
+    # pollResult is the result of pollDeviceStates() if the states were already polled on the event loop
+    def updateNodeStates(self, forceReport=False, pollResult=None):
+
+        startTime = time.time()
+
+        # in worker processes and the asyncio runtime, the bridge and device states are polled in a single call
+        if pollResult is None and self.controller.workerPool is not None:
+            pollResult = self.bondBridge.pollDeviceStates(self.getDeviceIDs())
+        elif pollResult is None and self.controller.runtime is not None:
+            pollResult = self.controller.runtime.run(self.pollDeviceStates())
+
+        if pollResult is not None:
+            (status, states) = pollResult
+            pollTime = time.time()
 
         # Make sure the bridge is alive
-        status = self.bondBridge.isBridgeAlive()
+        else:
+            status = self.bondBridge.isBridgeAlive()
         
         if status:
 
             # Update the Bond connection driver value
             self.setDriver("ST", 1, True, forceReport)
 
-            # iterate through the nodes of the nodeserver
-            for addr in self.controller.nodes:
-        
-                # ignore the controller and this bridge node
-                if addr != self.address and addr != self.controller.address:
+            # update the state of the drivers of the device nodes
+            for node in self.getDeviceNodes():
+                if pollResult is None:
+                    node.updateState(forceReport)
+                elif node.deviceID in states:
+                    self._deviceStates[node.deviceID] = (pollTime, states[node.deviceID])
+                    node.setDrivers(states[node.deviceID], forceReport)
+                else:
+                    _LOGGER.warning("Call to getDeviceState() for device %s failed in updateNodeStates.", node.deviceID)
 
-                    # if the device belongs to this bridge (node's primary is this nodes address),
-                    # then update the state of the nodes drivers
-                    node = self.controller.nodes[addr] 
-                    if node.primary == self.address:
-                        node.updateState(forceReport)
+            self.readiness = _BRIDGE_READY
 
         else:
 
             # Update the Bond connection driver value
             self.setDriver("ST", 0, True, forceReport)
 
+            self.readiness = _BRIDGE_UNREACHABLE
+
+        self.pollCycleTime = time.time() - startTime
+        self.ready.set()
+
+        # report the batched driver updates for the poll right away
+        if self.controller.driverBatcher is not None:
+            self.controller.driverBatcher.flush()
+
     # update the state of nodes from BPUP status messages
     def _BPUP_statusUpdate(self, deviceID, respData):
 
+        # cache the state data for command suppression
+        self.lastPushTime = time.time()
+        self.bpupMessages += 1
+        self._deviceStates[deviceID] = (self.lastPushTime, respData)
+
+        # match the status update to a traced command for the device
+        trace = self.controller.tracer.confirm(self.address, deviceID)
+
+        self._setDeviceDrivers(deviceID, respData, False)
+
+        if trace is not None:
+            self.controller.tracer.complete(trace)
+
+    # update the performance driver values of the bridge node (called every longPoll)
+    def updatePerformanceDrivers(self, forceReport=False):
+
+        currentTime = time.time()
+
+        # average latency of the commands confirmed since the last update (0 if none were confirmed)
+        # Note: recorded by the command tracer once both the HTTP response and the BPUP confirmation are in, so
+        # commands that failed aren't included
+        latency = self.controller.tracer.takeAverageLatency(self.address)
+        self.setDriver("GV0", round(latency * 1000) if latency is not None else 0, True, forceReport)
+
+        # BPUP message rate (per minute) since the last update
+        if self._lastPerformanceUpdate is not None:
+            (lastTime, lastMessages) = self._lastPerformanceUpdate
+            if currentTime > lastTime:
+                self.setDriver("GV1", round((self.bpupMessages - lastMessages) / (currentTime - lastTime) * 60, 1), True, forceReport)
+        self._lastPerformanceUpdate = (currentTime, self.bpupMessages)
+
+        # time since the last BPUP status update
+        if self.lastPushTime is not None:
+            self.setDriver("GV2", round(currentTime - self.lastPushTime), True, forceReport)
+
+        # failed REST API calls to the bridge
+        if self.bondBridge is not None:
+            self.setDriver("GV3", self.bondBridge.getFailedRequestCount(), True, forceReport)
+
+        # duration of the last poll of the bridge and its devices
+        if self.pollCycleTime is not None:
+            self.setDriver("GV4", round(self.pollCycleTime * 1000), True, forceReport)
+
+    # update the driver values of the nodes for the device from the state data
+    def _setDeviceDrivers(self, deviceID, respData, forceReport):
+
         # iterate through the nodes of the nodeserver
-        for addr in self.controller.nodes:
+        for addr in list(self.controller.nodes):
     
-            # if the state data is for the device ID of the node,
+            # if the state data is for the device ID of a node of this bridge,
             # then update the driver values for the node from the state data
             node = self.controller.nodes[addr] 
-            if node.id not in ("CONTROLLER", "BRIDGE") and node.deviceID == deviceID:
-                node.setDrivers(respData, False)
+            if node.id not in ("CONTROLLER", "BRIDGE", "GROUP") and node.primary == self.address and node.deviceID == deviceID:
+                node.setDrivers(respData, forceReport)
+
+    # Return the last known state data of the devices of the bridge
+    def getDeviceStates(self):
+
+        return {deviceID: cachedState[1] for (deviceID, cachedState) in list(self._deviceStates.items())}
+
+    # Restore device states (e.g., from a snapshot) and update the driver values of the nodes
+    def restoreDeviceStates(self, deviceStates):
+
+        for deviceID in deviceStates:
+
+            # don't overwrite state data already received from the bridge
+            # Note: restored states are cached as stale so they are never used to suppress commands
+            if deviceID not in self._deviceStates:
+                self._deviceStates[deviceID] = (0, deviceStates[deviceID])
+
+                try:
+                    self._setDeviceDrivers(deviceID, deviceStates[deviceID], True)
+                except (KeyError, TypeError, ValueError):
+                    _LOGGER.warning("Invalid state data for device %s in snapshot.", deviceID)
 
     drivers = [
-        {"driver": "ST", "value": 0, "uom": _ISY_BOOL_UOM}
+        {"driver": "ST", "value": 0, "uom": _ISY_BOOL_UOM},
+        {"driver": "GV0", "value": 0, "uom": _ISY_MILLISECONDS_UOM},
+        {"driver": "GV1", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV2", "value": 0, "uom": _ISY_SECONDS_UOM},
+        {"driver": "GV3", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV4", "value": 0, "uom": _ISY_MILLISECONDS_UOM}
     ]
     commands = {
         "QUERY": cmd_query
@@ -1007,12 +2246,40 @@ class Bridge(polyinterface.Node):
 class Controller(polyinterface.Controller):
 
     id = "CONTROLLER"
+    forceCommands = False
+    apiStatsSinks = None
+    metricsServer = None
+    bpupRecorder = None
+    bridgeWatcher = None
+    profiler = None
+    runtime = None
+    workerPool = None
+    httpTransport = None
+    driverUpdates = 0 # setDriver() calls passed to polyinterface
+    driverUpdatesSuppressed = 0 # setDriver() calls skipped because the value was unchanged
+    driverBatcher = None
+    setDriver = _setShadowedDriver
+    updateDrivers = _updateShadowedDrivers
+    pollCycleTime = None
     _customData = {}
 
     def __init__(self, poly):
         super(Controller, self).__init__(poly)
         self.name = "Bond NodeServer"
 
+        # tracer for command latency from command handler to BPUP confirmation
+        self.tracer = CommandTracer()
+
+        # serializes creation of bridge nodes by the discovery workers
+        self._discoverLock = threading.Lock()
+
+        # buffer for driver updates while the connection to Polyglot is down
+        self.driverBuffer = DriverBuffer(self)
+
+        # pool of threads for fanning out group commands to the member nodes (threads are started as needed)
+        self.groupExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=_GROUP_MAX_WORKERS, thread_name_prefix="Group")
+        self._polyglotConnectedSeen = False
+
     # Start the nodeserver
     def start(self):
 
@@ -1023,6 +2290,79 @@ class Controller(polyinterface.Controller):
 
         # load custom data from polyglot
         self._customData = self.polyConfig["customData"]
+
+        # check custom parameters for forcing commands even if the device state wouldn't change
+        customParams = self.polyConfig["customParams"]
+        self.forceCommands = customParams.get(_PARAM_FORCE_COMMANDS, "false").lower() == "true"
+
+        # batch driver updates if a flush delay was specified in custom parameters
+        flushDelay = customParams.get(_PARAM_DRIVER_FLUSH_DELAY)
+        if flushDelay:
+            try:
+                delay = int(flushDelay)
+                if delay <= 0:
+                    raise ValueError
+                self.driverBatcher = DriverBatcher(delay / 1000)
+            except ValueError:
+                _LOGGER.error("Invalid driver flush delay: %s", flushDelay)
+
+        # check custom parameters for the HTTP transport for REST API calls (must be set before the bridge nodes are created)
+        httpTransport = customParams.get(_PARAM_HTTP_TRANSPORT, "").lower()
+        if httpTransport in API_HTTP_TRANSPORTS:
+            self.httpTransport = httpTransport
+        elif httpTransport:
+            _LOGGER.error("Invalid HTTP transport: %s - must be one of %s", httpTransport, ", ".join(API_HTTP_TRANSPORTS))
+
+        # run all bridge I/O on a single event loop thread if the asyncio runtime was specified in custom parameters
+        # Note: must be started before the bridge nodes are created
+        if customParams.get(_PARAM_RUNTIME, "").lower() == _RUNTIME_ASYNCIO:
+            self.runtime = bondaio.EventLoopThread("BridgeLoop")
+            _LOGGER.info("Running bridge I/O on the asyncio event loop runtime")
+
+        # run the bridge connections in worker processes if a number of processes was specified in custom parameters
+        # Note: takes precedence over the asyncio runtime
+        workerProcesses = customParams.get(_PARAM_WORKER_PROCESSES)
+        if workerProcesses:
+            try:
+                count = int(workerProcesses)
+            except ValueError:
+                _LOGGER.error("Invalid number of worker processes: %s", workerProcesses)
+            else:
+                if count > 0:
+                    self.workerPool = bondworker.WorkerPool(count, _LOGGER, self.httpTransport)
+                    _LOGGER.info("Running bridge connections in %d worker processes", count)
+
+        # check custom parameters for REST API call stats sink - "log" for the log file, otherwise a file name
+        apiStats = customParams.get(_PARAM_API_STATS)
+        if apiStats:
+            if apiStats.lower() == "log":
+                self.apiStatsSinks = [bondApiStatsLogSink(_LOGGER)]
+            else:
+                self.apiStatsSinks = [bondApiStatsFileSink(apiStats)]
+
+        # record BPUP traffic from all bridges if a file was specified in the custom parameters
+        recordFile = customParams.get(_PARAM_BPUP_RECORD_FILE)
+        if recordFile:
+            try:
+                self.bpupRecorder = bondBPUPRecorder(recordFile)
+            except OSError as e:
+                _LOGGER.error("Unable to open BPUP recording file %s: %s", recordFile, str(e))
+            else:
+                _LOGGER.info("Recording BPUP traffic to file %s", recordFile)
+
+        # start the metrics endpoint if a port was specified in the custom parameters
+        metricsPort = customParams.get(_PARAM_METRICS_PORT)
+        if metricsPort:
+            try:
+                self.metricsServer = MetricsServer(self, int(metricsPort))
+            except (ValueError, OSError) as e:
+                _LOGGER.error("Unable to start metrics endpoint on port %s: %s", metricsPort, str(e))
+            else:
+                self.metricsServer.start()
+
+                # the HTTP metrics need the REST API call stats of the bridges
+                if self.apiStatsSinks is None:
+                    self.apiStatsSinks = []
             
         # If a logger level was stored for the controller, then use to set the logger level
         level = self.getCustomData("loggerlevel")
@@ -1060,24 +2400,92 @@ class Controller(polyinterface.Controller):
                     self.addNode(Fireplace(self, node["primary"], addr, node["name"]))
                 elif node["node_def_id"] == "GENERIC":
                     self.addNode(Generic(self, node["primary"], addr, node["name"]))
+                elif node["node_def_id"] == "GROUP":
+                    self.addNode(Group(self, node["primary"], addr, node["name"]))
+
+        # add or update group nodes configured in custom parameters
+        self.addGroupNodes()
+        self.saveCustomData(self._customData)
 
         # Set the nodeserver status flag to indicate nodeserver is running
         self.setDriver("ST", 1, True, True)
 
         # Set the log level to the currently set log level
         self.setDriver("GV20", _LOGGER.level, True, True)
+
+        # profiling is always off at startup
+        self.setDriver("GV21", _PROFILE_OFF, True, True)
  
-        # update the driver values of all nodes (force report)
-        self.updateNodeStates(True)
+        # restore the driver values from the last snapshot, if available
+        restored = self.restoreSnapshot()
+
+        # follow IP address changes of the bridges if specified in custom parameters
+        if customParams.get(_PARAM_WATCH_ADDRESSES, "false").lower() == "true":
+            self.bridgeWatcher = bondBridgeWatcher(self.bridgeAddressChanged, _LOGGER)
+            self.bridgeWatcher.start()
+
+        # connect and poll each bridge concurrently in the background so that an unreachable bridge
+        # doesn't delay the others (force report of driver values if they weren't restored from the snapshot)
+        for addr in list(self.nodes):
+            node = self.nodes[addr]
+            if node.id == "BRIDGE":
+                threading.Thread(target=node.bringUp, args=(not restored,), name="BringUp_" + addr, daemon=True).start()
 
     # nodeserver is being shutdown
     def stop(self):
                            
         # bridge nodes have registerd their own stop() methods to handle their own connections
 
+        # write the final command traces to the trace file
+        self.dumpCommandTraces()
+
+        # save the node topology and device states for the next startup
+        self.saveSnapshot()
+
+        # shutdown the metrics endpoint
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+
+        # write the results of any running profiling session
+        self.stopProfiling()
+
+        # close the BPUP recording file
+        if self.bpupRecorder is not None:
+            self.bpupRecorder.close()
+
+        # stop watching for bridge IP address changes
+        if self.bridgeWatcher is not None:
+            self.bridgeWatcher.stop()
+
+        # stop the worker processes
+        if self.workerPool is not None:
+            self.workerPool.stop()
+
+        # stop the threads for group commands (without waiting for commands in progress)
+        self.groupExecutor.shutdown(wait=False)
+
+        # stop the event loop of the asyncio runtime (after the bridge nodes have closed their connections)
+        if self.runtime is not None:
+            self.runtime.call(self.runtime.stop)
+
+        # report any batched driver updates (later updates, e.g., from the bridge nodes stopping, are reported directly)
+        if self.driverBatcher is not None:
+            self.driverBatcher.stop()
+
         # Set the nodeserver status flag to indicate nodeserver is not running
         self.setDriver("ST", 0, True, True)
     
+    # Return whether driver updates can be sent to Polyglot - the MQTT client is connected and Polyglot hasn't reported
+    # that it disconnected (Polyglot's connection status is only used once it has been received)
+    def isPolyglotLinkUp(self):
+
+        poly = self.poly
+        if poly.polyglotConnected:
+            self._polyglotConnectedSeen = True
+            return poly.connected
+        else:
+            return poly.connected and not self._polyglotConnectedSeen
+
     # Run discovery for Bond bridges and configured devices
     def cmd_discover(self, command):
 
@@ -1110,10 +2518,84 @@ class Controller(polyinterface.Controller):
         # update the state driver to the level set
         self.setDriver("GV20", value)
         
+    # Start or stop runtime profiling
+    def cmd_setProfiling(self, command):
+
+        _LOGGER.debug("Set profiling in cmd_setProfiling(): %s", str(command))
+
+        # retrieve the parameter value for the command
+        value = int(command.get("value"))
+
+        # stop any running profiling session and write the results
+        self.stopProfiling()
+
+        # start a new profiling session for the specified mode
+        if value != _PROFILE_OFF:
+            self.profiler = RuntimeProfiler(value)
+            self.profiler.start()
+            _LOGGER.info("Started runtime profiling (mode %d).", value)
+
+        # update the state driver to the mode set
+        self.setDriver("GV21", value)
+
+    # Stop runtime profiling (if running) and write the results to the log directory
+    def stopProfiling(self):
+
+        if self.profiler is not None:
+            profiler = self.profiler
+            self.profiler = None
+            try:
+                files = profiler.stop()
+            except OSError as e:
+                _LOGGER.warning("Unable to write profiling results: %s", str(e))
+            else:
+                _LOGGER.info("Stopped runtime profiling - results written to %s", ", ".join(files))
+
     # called every longPoll seconds (default 30)
     def longPoll(self):
 
-        pass
+        # log a summary of the command latency tracing
+        stats = self.tracer.getStats()
+        for action in stats["histograms"]:
+            total = stats["histograms"][action]["total"]
+            _LOGGER.debug("Command latency for %s actions - count: %d, average: %.1f ms", action, total["count"], total["sum"] / total["count"])
+
+        # dump the command traces to the trace file if one was specified
+        self.dumpCommandTraces()
+
+        # log the suppression ratio of driver updates
+        total = self.driverUpdates + self.driverUpdatesSuppressed
+        if total:
+            _LOGGER.debug("Driver updates - passed: %d, suppressed as unchanged: %d (%.1f%%)", self.driverUpdates, self.driverUpdatesSuppressed, self.driverUpdatesSuppressed * 100 / total)
+        if self.driverBatcher is not None:
+            _LOGGER.debug("Batched driver updates - flushes: %d, reported: %d, coalesced: %d", self.driverBatcher.flushes, self.driverBatcher.reported, self.driverBatcher.coalesced)
+        if self.driverBuffer.buffered:
+            _LOGGER.debug("Buffered driver updates - buffered: %d, replayed: %d, dropped: %d, pending: %d", self.driverBuffer.buffered, self.driverBuffer.replayed, self.driverBuffer.dropped, self.driverBuffer.getPendingCount())
+
+        # restart any worker processes that have died or hung
+        if self.workerPool is not None:
+            self.workerPool.checkWorkers()
+
+        # update the performance drivers of the bridges and send their REST API call stats to the configured sinks
+        for addr in list(self.nodes):
+            node = self.nodes[addr]
+            if node.id == "BRIDGE":
+                node.updatePerformanceDrivers()
+                if self.apiStatsSinks is not None and node.bondBridge is not None:
+                    node.bondBridge.flushStats()
+
+        # save the node topology and device states for the next startup
+        self.saveSnapshot()
+
+    # Write command latency traces to the file specified in custom parameters (if any)
+    def dumpCommandTraces(self):
+
+        fileName = self.polyConfig["customParams"].get(_PARAM_TRACE_FILE)
+        if fileName:
+            try:
+                self.tracer.dump(fileName)
+            except OSError as e:
+                _LOGGER.warning("Unable to write command traces to file %s: %s", fileName, str(e))
 
     # called every shortPoll seconds (default 10)
     def shortPoll(self):
@@ -1168,127 +2650,298 @@ class Controller(polyinterface.Controller):
 
         else:
 
-            # Discover Bond Bridges and SBB devices using mDNS
-            bridges.extend(bondDiscoverBridges(5, _LOGGER))
+            # Discover Bond Bridges and SBB devices using mDNS - each bridge is processed as soon as it is resolved
+            # Note: runs for the full timeout, since new bridges may answer after the bridges that already have nodes
+            bridges = bondDiscoverBridgesStream(5, logger=_LOGGER)
 
             dynamicDiscovery = True
 
-        # Process each discovered or specified bridge or SBB device
-        for bridge in bridges:
-
-            # better chance for success using IP address
-            if "ipaddress" in bridge:
-                host = bridge["ipaddress"]
-            else:
-                host = bridge["hostname"]
-
-            # check for token
-            if "token" in bridge:
-
-                token = bridge["token"]
-
-            else:
-
-                # get token for host
-                token = bondGetBridgeToken(host, _LOGGER)
+        # onboard each discovered or specified bridge or SBB device concurrently with a bounded pool of workers
+        # Note: with mDNS discovery, bridges are submitted as they are resolved
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_DISCOVER_MAX_WORKERS, thread_name_prefix="Onboard") as executor:
+            futures = [(bridge, executor.submit(self.onboardBridge, bridge, dynamicDiscovery)) for bridge in bridges]
+            for (bridge, future) in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    _LOGGER.error("Unexpected error onboarding bridge %s: %s", bridge.get("ipaddress", bridge.get("hostname")), str(e))
+
+        # report the timing of each bridge
+        for result in results:
+            _LOGGER.info("Onboarding of bridge at %s %s in %.2f seconds (token: %.2f s, info: %.2f s, devices: %.2f s, poll: %.2f s).",
+                result["host"],
+                result["status"],
+                result["token"] + result["info"] + result["devices"] + result["poll"],
+                result["token"],
+                result["info"],
+                result["devices"],
+                result["poll"]
+            )
+
+        # add or update group nodes configured in custom parameters
+        self.addGroupNodes()
 
-                # check the returned token
-                if token == API_TOKEN_FAILED: # general failure
+        # send custom data added by new nodes to polyglot
+        self.saveCustomData(self._customData)
 
-                    # Log a warning and add a notice to Polyglot dashboard
-                    _LOGGER.warning("Unable to connect to specified hostname %s", host)
-                    self.addNotice("Unable to connect to Bond bridge at hostname {}. Please check the 'hostname' parameter value in the Custom Configuration Parameters and/or that the Bond bridge or device is reachable on your network from you Polyglot server before retrying.".format(host))
+        # update the driver values for any other bridges and devices (force report)
+        onboarded = [result["address"] for result in results]
+        for addr in list(self.nodes):
+            node = self.nodes[addr]
+            if node.id == "BRIDGE" and addr not in onboarded and node.readiness != _BRIDGE_CONNECTING:
+                node.updateNodeStates(True)
+
+    # Onboard a discovered or specified bridge or SBB device: retrieve the token (if needed) and the bridge info,
+    # add the bridge node, and discover its devices - to be executed on a worker thread
+    # Returns dictionary with the host, the status, and the time for each stage (seconds)
+    def onboardBridge(self, bridge, dynamicDiscovery):
+
+        # better chance for success using IP address
+        if "ipaddress" in bridge:
+            host = bridge["ipaddress"]
+        else:
+            host = bridge["hostname"]
 
-                    # move to the next bridge
-                    continue
+        result = {"host": host, "address": None, "status": "failed", "token": 0.0, "info": 0.0, "devices": 0.0, "poll": 0.0}
 
-                elif token == API_TOKEN_LOCKED: # bond bridge locked
+        # check for token
+        if "token" in bridge:
 
-                    # Log a warning and add a notice to Polyglot dashboard
-                    _LOGGER.warning("Token locked on bridge at hostname %s", host)
-                    self.addNotice("Bond bridge or device at hostname {} is locked. Please unlock the Bond bridge or device before executing the Discover Devices command.".format(host))
+            token = bridge["token"]
 
-                    # move to the next bridge
-                    continue
+        else:
 
-            # get info for the bridge
-            bridgeInfo = bondGetBridgeInfo(host, token, _LOGGER)
+            # get token for host
+            stageTime = time.time()
+            token = bondGetBridgeToken(host, _LOGGER)
+            result["token"] = time.time() - stageTime
 
             # check the returned token
-            if bridgeInfo == API_BRIDGE_INFO_FAILED: # general failure
+            if token == API_TOKEN_FAILED: # general failure
 
                 # Log a warning and add a notice to Polyglot dashboard
                 _LOGGER.warning("Unable to connect to specified hostname %s", host)
-                if dynamicDiscovery:
-                    self.addNotice("Unable to connect to Bond bridge at hostname {} retrieved from mDNS. Please check that the Bond bridge or device is reachable on your network from your Polyglot server.".format(host))
-                else:
-                    self.addNotice("Unable to connect to Bond bridge at hostname {}. Please check the 'hostname' parameter value in the Custom Configuration Parameters and restart this nodeserver.".format(host))
+                self.addNotice("Unable to connect to Bond bridge at hostname {}. Please check the 'hostname' parameter value in the Custom Configuration Parameters and/or that the Bond bridge or device is reachable on your network from you Polyglot server before retrying.".format(host))
 
                 # move to the next bridge
-                continue
+                return result
 
-            elif bridgeInfo == API_BRIDGE_INFO_BAD_TOKEN: # bond bridge locked
+            elif token == API_TOKEN_LOCKED: # bond bridge locked
 
                 # Log a warning and add a notice to Polyglot dashboard
-                _LOGGER.warning("Aunthentication error (bad token) for bridge at hostname %s", host)
-                if dynamicDiscovery:
-                    self.addNotice("Unable to authenticate with the Bond bridge at hostname {} using the retrieved token. Consider specifying the hostname and token manually through Custom Configuration Parameters and try discovery again.".format(host))
-                else:
-                    self.addNotice("Unable to authenticate with the Bond bridge at hostname {} using the supplied token. Please check the corresponding 'token' parameter value in the Custom Configuration Parameters and restart this nodeserver.".format(host))
+                _LOGGER.warning("Token locked on bridge at hostname %s", host)
+                self.addNotice("Bond bridge or device at hostname {} is locked. Please unlock the Bond bridge or device before executing the Discover Devices command.".format(host))
 
                 # move to the next bridge
-                continue
+                return result
+
+        # get info for the bridge
+        stageTime = time.time()
+        bridgeInfo = bondGetBridgeInfo(host, token, _LOGGER)
+        result["info"] = time.time() - stageTime
+
+        # check the returned token
+        if bridgeInfo == API_BRIDGE_INFO_FAILED: # general failure
 
+            # Log a warning and add a notice to Polyglot dashboard
+            _LOGGER.warning("Unable to connect to specified hostname %s", host)
+            if dynamicDiscovery:
+                self.addNotice("Unable to connect to Bond bridge at hostname {} retrieved from mDNS. Please check that the Bond bridge or device is reachable on your network from your Polyglot server.".format(host))
             else:
+                self.addNotice("Unable to connect to Bond bridge at hostname {}. Please check the 'hostname' parameter value in the Custom Configuration Parameters and restart this nodeserver.".format(host))
 
-                # Older firmware may not return the bondid property, so use the one in the bridge list (or the last eight of the token)
-                bridgeID = bridgeInfo.get("bondid", bridge.get("bondid", token[-8:]))
+            # move to the next bridge
+            return result
 
-                # If the name is missing, just use the bridgeID
-                bridgeName = bridgeInfo.get("name", bridgeID)
+        elif bridgeInfo == API_BRIDGE_INFO_BAD_TOKEN: # bond bridge locked
 
-                # check to see if a bridge node already exists for the bridge
-                bridgeAddr = getValidNodeAddress(bridgeID)
+            # Log a warning and add a notice to Polyglot dashboard
+            _LOGGER.warning("Aunthentication error (bad token) for bridge at hostname %s", host)
+            if dynamicDiscovery:
+                self.addNotice("Unable to authenticate with the Bond bridge at hostname {} using the retrieved token. Consider specifying the hostname and token manually through Custom Configuration Parameters and try discovery again.".format(host))
+            else:
+                self.addNotice("Unable to authenticate with the Bond bridge at hostname {} using the supplied token. Please check the corresponding 'token' parameter value in the Custom Configuration Parameters and restart this nodeserver.".format(host))
+
+            # move to the next bridge
+            return result
+
+        else:
+
+            # Older firmware may not return the bondid property, so use the one in the bridge list (or the last eight of the token)
+            bridgeID = bridgeInfo.get("bondid", bridge.get("bondid", token[-8:]))
+
+            # If the name is missing, just use the bridgeID
+            bridgeName = bridgeInfo.get("name", bridgeID)
+
+            # check to see if a bridge node already exists for the bridge
+            # Note: the lock keeps two workers from creating a node for the same bridge (e.g., listed twice)
+            bridgeAddr = getValidNodeAddress(bridgeID)
+            with self._discoverLock:
                 if bridgeAddr not in self.nodes:
 
-                    # create a Bridge node for the Bond Bridge
+                    # create a Bridge node for the Bond Bridge and start the BPUP listener
                     bridge = Bridge(self, self.address, bridgeAddr, getValidNodeName(bridgeName), host, token)
                     self.addNode(bridge)
+                    bridge.connect()
                     
                 else:
                     bridge = self.nodes[bridgeAddr]
 
-                # perform device discovery for the bridge node
-                bridge.discoverDevices()
+            # perform device discovery for the bridge node
+            stageTime = time.time()
+            bridge.discoverDevices()
+            result["devices"] = time.time() - stageTime
+
+            # update the driver values for the bridge and its devices (force report)
+            stageTime = time.time()
+            bridge.updateNodeStates(True)
+            result["poll"] = time.time() - stageTime
+
+            result["address"] = bridgeAddr
+            result["status"] = "completed"
+
+            return result
+
+    # Update the host of the bridge node for a bridge announced by the bridge watcher (called on a Zeroconf thread)
+    def bridgeAddressChanged(self, bondID, ipAddress):
+
+        node = self.nodes.get(getValidNodeAddress(bondID))
+        if node is not None and node.id == "BRIDGE":
+            node.setHostAddress(ipAddress)
+
+    # Save a snapshot of the node topology and last known device states to the snapshot file
+    def saveSnapshot(self):
+
+        snapshot = {"version": _SNAPSHOT_VERSION, "time": time.time(), "nodes": {}, "bridges": {}}
+        for addr in list(self.nodes):
+            node = self.nodes[addr]
+            if node.id == "BRIDGE":
+                snapshot["bridges"][addr] = node.getDeviceStates()
+            elif addr != self.address:
+                snapshot["nodes"][addr] = [node.id, node.primary, getattr(node, "deviceID", None)]
+
+        # write to a temporary file and replace the snapshot file so a partial snapshot is never loaded
+        try:
+            with open(_SNAPSHOT_FILE_NAME + ".tmp", "w") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(_SNAPSHOT_FILE_NAME + ".tmp", _SNAPSHOT_FILE_NAME)
+        except OSError as e:
+            _LOGGER.warning("Unable to save snapshot file %s: %s", _SNAPSHOT_FILE_NAME, str(e))
+
+    # Restore driver values for the nodes from the snapshot file - returns True if restored
+    def restoreSnapshot(self):
+
+        try:
+            with open(_SNAPSHOT_FILE_NAME) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            _LOGGER.warning("Unable to load snapshot file %s: %s", _SNAPSHOT_FILE_NAME, str(e))
+            return False
+
+        if snapshot.get("version") != _SNAPSHOT_VERSION:
+            return False
+
+        # make sure the topology of the snapshot matches the loaded nodes
+        for addr in snapshot["nodes"]:
+            node = self.nodes.get(addr)
+            if node is None or node.id != snapshot["nodes"][addr][0]:
+                _LOGGER.info("Node topology has changed since snapshot was saved - snapshot ignored.")
+                return False
+
+        _LOGGER.info("Restoring device states from snapshot saved at %s", time.ctime(snapshot["time"]))
+
+        for addr in snapshot["bridges"]:
+            if addr in self.nodes:
+                self.nodes[addr].restoreDeviceStates(snapshot["bridges"][addr])
+
+        return True
+
+    # add group nodes for groups configured in custom parameters (or update the members of existing group nodes),
+    # and remove group nodes for groups no longer configured
+    def addGroupNodes(self):
 
-        # send custom data added by new nodes to polyglot
-        self.saveCustomData(self._customData)
+        customParams = self.polyConfig["customParams"]
+        groupKeys = {} # custom parameter key by group node address
+        for key in customParams:
+            if key.startswith(_PARAM_GROUP_PREFIX):
+
+                groupName = key[len(_PARAM_GROUP_PREFIX):]
+                members = [getValidNodeAddress(addr) for addr in customParams[key].split(";") if addr]
+                groupAddr = getValidNodeAddress("grp_" + groupName.replace(" ", ""))
+
+                # groups can't be members of groups
+                for addr in [addr for addr in members if addr in self.nodes and self.nodes[addr].id == "GROUP"]:
+                    _LOGGER.error("Group node %s can't be a member of group %s - ignored.", addr, groupName)
+                    members.remove(addr)
+
+                # node addresses are truncated, so different group names may map to the same address
+                if groupAddr in groupKeys:
+                    _LOGGER.error("Group %s has the same node address (%s) as group %s - use a shorter or more distinct group name.", groupName, groupAddr, groupKeys[groupAddr][len(_PARAM_GROUP_PREFIX):])
+                    continue
+                groupKeys[groupAddr] = key
 
-        # update the driver values for the discovered bridges and devices (force report)
-        self.updateNodeStates(True)
+                if groupAddr not in self.nodes:
+                    _LOGGER.info("Adding group node - addr: %s, name: %s, members: %s", groupAddr, groupName, str(members))
+                    self.addNode(Group(self, self.address, groupAddr, getValidNodeName(groupName), members))
+                else:
+                    self.nodes[groupAddr].setMembers(members)
+
+        # remove the group nodes (and their custom data) for groups that were deleted from custom parameters
+        for addr in list(self.nodes):
+            if self.nodes[addr].id == "GROUP" and addr not in groupKeys:
+                _LOGGER.info("Removing group node - addr: %s", addr)
+                self.delNode(addr)
+                self._customData.pop(addr, None)
 
     # update the node states for all bridge and device nodes
     def updateNodeStates(self, forceReport=False):
 
-        # iterate through the nodes of the nodeserver
-        for addr in self.nodes:
-        
-            # ignore the controller node
-            if addr != self.address:
+        startTime = time.time()
+
+        # bridge nodes that have been brought up (not still pending or connecting)
+        bridges = [node for node in list(self.nodes.values()) if node.id == "BRIDGE" and node.readiness not in (_BRIDGE_PENDING, _BRIDGE_CONNECTING)]
+
+        # with worker processes, start the polls of all of the bridges and update the drivers as the results arrive
+        # so that a hung worker process only delays its own bridges
+        if self.workerPool is not None:
+            futures = {bridge.bondBridge.submitPoll(bridge.getDeviceIDs()): bridge for bridge in bridges}
+            try:
+                for future in concurrent.futures.as_completed(futures, timeout=bondworker.WORKER_CALL_TIMEOUT):
+                    bridge = futures.pop(future)
+                    bridge.updateNodeStates(forceReport, bridge.bondBridge.getPollResult(future))
+            except concurrent.futures.TimeoutError:
+                for (future, bridge) in futures.items():
+                    bridge.updateNodeStates(forceReport, bridge.bondBridge.getPollResult(future, 0))
+
+        # in the asyncio runtime, poll all of the bridges concurrently on the event loop, then update the drivers
+        elif self.runtime is not None:
+            pollResults = self.runtime.runAll([bridge.pollDeviceStates() for bridge in bridges])
+            for (bridge, pollResult) in zip(bridges, pollResults):
+                bridge.updateNodeStates(forceReport, pollResult)
+
+        else:
+            for bridge in bridges:
+                bridge.updateNodeStates(forceReport)
+
+        self.pollCycleTime = time.time() - startTime
 
-                # if the device is a bridge node, call the updateNodeStates method
-                node = self.controller.nodes[addr]
-                if node.id == "BRIDGE":
-                    node.updateNodeStates(forceReport)
+        # report the batched driver updates for the poll cycle right away
+        if self.driverBatcher is not None:
+            self.driverBatcher.flush()
 
     drivers = [
         {"driver": "ST", "value": 0, "uom": _ISY_BOOL_UOM},
-        {"driver": "GV20", "value": 0, "uom": _ISY_INDEX_UOM}
+        {"driver": "GV20", "value": 0, "uom": _ISY_INDEX_UOM},
+        {"driver": "GV21", "value": 0, "uom": _ISY_INDEX_UOM}
     ]
     commands = {
         "DISCOVER": cmd_discover,
         "UPDATE_PROFILE" : cmd_updateProfile,
-        "SET_LOGLEVEL": cmd_setLogLevel
+        "SET_LOGLEVEL": cmd_setLogLevel,
+        "SET_PROFILING": cmd_setProfiling
     }
 
 # Removes invalid charaters and lowercase ISY Node address
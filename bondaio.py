@@ -0,0 +1,600 @@
+#!/usr/bin/python3
+"""
+Asyncio client for the Olibra Bond Bridge local REST API and Bond Push UDP Protocol (BPUP)
+Provides the same calls as bondapi.bondBridgeConnection as coroutines so that many bridges and many in-flight
+requests can share a single event loop - request building, response parsing, and BPUP message handling are shared
+with bondapi, and only the non-blocking I/O is implemented here
+"""
+
+import logging
+import json
+import time
+import asyncio
+import socket
+import threading
+import bondapi
+
+# Pickup the root logger, and add a handler for module testing if none exists
+_LOGGER = logging.getLogger()
+if not _LOGGER.hasHandlers():
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.DEBUG)
+
+# maximum number of concurrent HTTP connections (and in-flight requests) to a single bridge
+_AIO_MAX_CONNECTIONS = 4
+
+# maximum number of idle keep-alive connections kept for a single bridge
+_AIO_MAX_IDLE_CONNECTIONS = 2
+
+# Protocol for the BPUP UDP connection - datagrams are passed to the bridge connection
+class _BPUPProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def connection_made(self, transport):
+        self._connection._BPUP_connectionMade(transport)
+
+    def datagram_received(self, data, addr):
+        self._connection._BPUP_datagramReceived(data)
+
+    def error_received(self, exc):
+        self._connection._logger.warning("UDP connection to Bond Bridge returned error: %s", str(exc))
+
+    def connection_lost(self, exc):
+        self._connection._BPUP_connectionLost(exc)
+
+# Asyncio connection to a Bond Bridge
+class AsyncBondBridgeConnection(object):
+
+    # Primary constructor method
+    # Note: must be constructed from a coroutine running on the event loop (or with the loop specified) - raises
+    # RuntimeError otherwise, rather than binding to a loop that may not be the one the connection is used on
+    def __init__(self, hostName, token, stateCallback=None, logger=_LOGGER, loop=None, maxConnections=_AIO_MAX_CONNECTIONS):
+
+        self._logger = logger
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+
+        # declare instance variables
+        self._hostName = hostName
+        self._headers = bondapi._getRequestHeaders(token)
+        self._closed = False
+
+        # prepared requests (method, path, and stats endpoint) for the REST API calls
+        self._preparedRequests = {}
+
+        # keep-alive HTTP connections as (reader, writer) and a limit on concurrent requests
+        self._idleConnections = []
+        self._requestSemaphore = asyncio.Semaphore(maxConnections)
+
+        # BPUP transport, callback, and keep-alive timers
+        self._BPUP_transport = None
+        self._stateCallback = None
+        self._keepAliveHandle = None
+        self._ackTimeoutHandle = None
+        self._keepAliveSentTime = None
+        self._keepAliveRTT = None
+        self._BPUP_recorder = None
+
+        # number of REST API calls that failed (timeouts, connection errors, and HTTP errors)
+        self._failedRequests = 0
+
+        # API call stats are only collected if enabled with enableStats()
+        self._stats = None
+        self._statsSinks = []
+
+        # if a callback function was specified, start the BPUP listener on the loop
+        if stateCallback is not None:
+            self._loop.create_task(self.startBPUPListener(stateCallback))
+
+    # Start listening for status updates from the bridge - stateCallback(deviceID, state) may be a function or a coroutine function
+    async def startBPUPListener(self, stateCallback):
+
+        self._logger.debug("Starting BPUP listener...")
+        self._stateCallback = stateCallback
+
+        # Note: the host name may include a port for the REST API (e.g., "192.168.1.145:8080"), which is stripped
+        try:
+            await self._loop.create_datagram_endpoint(lambda: _BPUPProtocol(self), remote_addr=(self._hostName.split(":")[0], bondapi._BPUP_UDP_PORT))
+        except (socket.error, socket.herror, socket.gaierror) as e:
+            self._logger.error("Unable to establish UDP connection with Bond Bridge. Socket error: %s", str(e))
+
+    # Change the host name (or IP address) of the bridge and reconnect the BPUP listener
+    def setHostName(self, hostName):
+
+        if hostName == self._hostName:
+            return
+
+        self._logger.info("Host name for Bond Bridge changed from %s to %s.", self._hostName, hostName)
+        self._hostName = hostName
+        self._closeIdleConnections()
+
+        # reconnect the BPUP listener to the new address
+        if self._stateCallback is not None and not self._closed:
+            if self._BPUP_transport is not None:
+                self._BPUP_transport.close()
+            self._loop.create_task(self.startBPUPListener(self._stateCallback))
+
+    # Return the host name (or IP address) of the bridge
+    def getHostName(self):
+        return self._hostName
+
+    # Set a recorder (bondapi.bondBPUPRecorder) for the BPUP datagrams received from the bridge (None to stop recording)
+    def setBPUPRecorder(self, recorder):
+        self._BPUP_recorder = recorder
+
+    # Return the number of REST API calls that failed
+    def getFailedRequestCount(self):
+        return self._failedRequests
+
+    # Return the round trip time of the last successful BPUP keep-alive (seconds, or None if none yet)
+    def getKeepAliveRTT(self):
+        return self._keepAliveRTT
+
+    # Enable collection of API call stats, with optional sinks (objects with emit(), e.g., bondapi.bondApiStatsLogSink) for flushStats()
+    def enableStats(self, sinks=None):
+
+        self._stats = bondapi.bondApiStats()
+        self._statsSinks = list(sinks or [])
+
+    # Return a copy of the API call stats by endpoint (or None if not enabled)
+    def getStats(self):
+
+        if self._stats is None:
+            return None
+        else:
+            return self._stats.snapshot()
+
+    # Send the API call stats to the sinks
+    def flushStats(self):
+
+        if self._stats is not None:
+            stats = self._stats.snapshot()
+            for sink in self._statsSinks:
+                try:
+                    sink.emit(self._hostName, stats)
+                except Exception as e:
+                    self._logger.warning("Error sending API call stats to sink %s: %s", type(sink).__name__, str(e))
+
+    # Call the specified REST API
+    async def _call_api(self, api, deviceID=None, action=None, arg=None):
+
+        # only the body is built for each call - the method, path, and stats endpoint are prepared once
+        (method, path, endpoint) = bondapi._getPreparedRequest(self._preparedRequests, api, deviceID, action)
+        data = bondapi._getRequestBody(arg).encode("utf-8")
+
+        # time the call if stats are enabled
+        stats = self._stats
+        if stats is not None:
+            startTime = time.perf_counter()
+
+        # May want to add special handling for 404 errors for unsupported commands and 401 errors for bad token
+        # For now _request() raises all HTTP errors as bondapi.bondTransportError, as the bondapi transports do
+        try:
+            async with self._requestSemaphore:
+                try:
+                    response = await asyncio.wait_for(self._request(method, path, data), bondapi._HTTP_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise bondapi.bondTransportError("Timeout for {}{}".format(self._hostName, path), timeout=True)
+
+        # Allow timeout and connection errors to be ignored - log and return false
+        except bondapi.bondTransportError as e:
+            self._failedRequests += 1
+            if stats is not None:
+                stats.record(endpoint, (time.perf_counter() - startTime) * 1000, e.response, len(data), e.timeout)
+            self._logger.warning("HTTP %s in _call_api() failed: %s", method, str(e))
+            return False
+
+        if stats is not None:
+            stats.record(endpoint, (time.perf_counter() - startTime) * 1000, response, len(data))
+
+        return response
+
+    # Send an HTTP request on a keep-alive connection and read the response
+    async def _request(self, method, path, data):
+
+        # same headers as the bondapi transports send, with the Host and Content-Length headers http.client adds
+        request = "{} {} HTTP/1.1\r\nHost: {}\r\n".format(method, path, self._hostName)
+        for (name, value) in self._headers.items():
+            request += "{}: {}\r\n".format(name, value)
+        request = (request + "Content-Length: {}\r\n\r\n".format(len(data))).encode("utf-8") + data
+
+        # try an idle connection first and a new connection if the bridge has closed the idle one
+        while True:
+
+            reused = bool(self._idleConnections)
+            if reused:
+                (reader, writer) = self._idleConnections.pop()
+            else:
+                hostParts = self._hostName.split(":")
+                try:
+                    (reader, writer) = await asyncio.open_connection(hostParts[0], int(hostParts[1]) if len(hostParts) > 1 else 80)
+                except OSError as e:
+                    raise bondapi.bondTransportError("Connection error for {}{}: {}".format(self._hostName, path, str(e)))
+
+            sent = False
+            try:
+                writer.write(request)
+                await writer.drain()
+                sent = True
+                (response, reason, keepAlive) = await self._readResponse(reader)
+
+            # retry with a new connection if the bridge closed an idle connection - only if the request wasn't sent
+            # or is a GET, as bondapi.bondHTTPClientTransport does
+            except (OSError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if reused and (not sent or method == "GET"):
+                    continue
+                raise bondapi.bondTransportError("Connection error for {}{}: {}".format(self._hostName, path, str(e) or type(e).__name__))
+            except:
+                writer.close()
+                raise
+
+            # keep the connection for the next request
+            if keepAlive and len(self._idleConnections) < _AIO_MAX_IDLE_CONNECTIONS and not self._closed:
+                self._idleConnections.append((reader, writer))
+            else:
+                writer.close()
+
+            bondapi._checkResponseStatus(response, reason, self._hostName, path)
+            return response
+
+    # Read an HTTP response - returns tuple of (response, reason, whether the connection can be kept alive)
+    async def _readResponse(self, reader):
+
+        statusLine = await reader.readuntil(b"\r\n")
+        parts = statusLine.decode("latin-1").strip().split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+            raise bondapi.bondTransportError("Unexpected HTTP status line for {}: {}".format(self._hostName, statusLine.decode("latin-1").strip()))
+        statusCode = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            (name, value) = line.decode("latin-1").split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+        keepAlive = headers.get("connection", "").lower() != "close" and parts[0] != "HTTP/1.0"
+
+        # read the body by content length, by chunks, or until the connection is closed
+        if "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            content = b""
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                content += await reader.readexactly(size)
+                await reader.readuntil(b"\r\n")
+                if size == 0:
+                    break
+        elif statusCode in (204, 304):
+            content = b""
+        else:
+            content = await reader.read()
+            keepAlive = False
+
+        # Note: header names are lowercase
+        return (bondapi.bondHTTPResponse(statusCode, headers, content), reason, keepAlive)
+
+    # Close the idle keep-alive connections
+    def _closeIdleConnections(self):
+
+        for (reader, writer) in self._idleConnections:
+            writer.close()
+        self._idleConnections = []
+
+    # Get list of devices
+    async def getDeviceList(self):
+        """Returns list of devices setup in the bond bridge."""
+
+        self._logger.debug("in API getDeviceList()...")
+
+        # get the device list
+        response = await self._call_api(bondapi._API_GET_DEVICE_LIST)
+
+        # if data returned, get the device info for all devices concurrently
+        respData = bondapi._getResponseData(response)
+        if respData is not False:
+
+            deviceIDs = bondapi._getDeviceIDs(respData)
+            responses = await asyncio.gather(*[self._call_api(bondapi._API_GET_DEVICE_INFO, deviceID) for deviceID in deviceIDs])
+
+            deviceList = {}
+            for (deviceID, response) in zip(deviceIDs, responses):
+                devInfo = bondapi._getResponseData(response)
+                if devInfo is not False:
+                    deviceList.update({deviceID: devInfo})
+
+            return deviceList
+
+        # otherwise return error (False)
+        else:
+            return False
+
+    # Get properties of device
+    async def getDeviceProperties(self, deviceID):
+        """Returns dictionary of properties for the device."""
+
+        self._logger.debug("in API getDeviceProperties()...")
+
+        response = await self._call_api(bondapi._API_GET_DEVICE_PROPERTIES, deviceID)
+
+        # return the properties dictionary from the response data (or False if no data was returned)
+        return bondapi._getResponseData(response)
+
+    # Get state of device
+    async def getDeviceState(self, deviceID):
+        """Returns dictionary of state variables for the device."""
+
+        self._logger.debug("in API getDeviceState()...")
+
+        response = await self._call_api(bondapi._API_GET_DEVICE_STATE, deviceID)
+
+        # return the state vars dictionary from the response data (or False if no data was returned)
+        return bondapi._getResponseData(response)
+
+    # Execute a device action
+    async def execDeviceAction(self, deviceID, action, argument = None):
+        """Executes the specified action for the device."""
+
+        self._logger.debug("in API execDeviceAction()...")
+
+        # Call the API with the specified action and device ID
+        response = await self._call_api(bondapi._API_DEVICE_ACTION, deviceID, action, argument)
+
+        # If a good code was returned, then return True
+        return bondapi._isActionSuccess(response)
+
+    # Get bridge information
+    async def getBridgeInfo(self):
+        """Returns dictionary of properties for the bridge."""
+
+        self._logger.debug("in API getBridgeInfo()...")
+
+        # Get the version information and the name of the bridge concurrently
+        # Note the bridge API is not in the v2 documentation, so it may go away
+        (response, nameResponse) = await asyncio.gather(self._call_api(bondapi._API_GET_BRIDGE_VERSION), self._call_api(bondapi._API_GET_BRIDGE_INFO))
+
+        # If a response was returned and it has contents, add the name property from the name response
+        bridgeInfo = bondapi._getResponseData(response)
+        if bridgeInfo is not False:
+            return bondapi._addBridgeName(bridgeInfo, bondapi._getResponseData(nameResponse))
+
+        # otherwise return error (False)
+        else:
+            return False
+
+    # Ping the bridge to see if it is connected
+    async def isBridgeAlive(self):
+        """Pings a Bond bridge to ensure it is responding."""
+
+        return (await self._call_api(bondapi._API_GET_BRIDGE_VERSION) != False)
+
+    # Ping the bridge and get the state of the specified devices concurrently
+    async def pollDeviceStates(self, deviceIDs):
+        """Returns tuple of (bridge alive, dictionary of state variables by device ID) - failed devices are omitted."""
+
+        if not await self.isBridgeAlive():
+            return (False, {})
+
+        states = await asyncio.gather(*[self.getDeviceState(deviceID) for deviceID in deviceIDs])
+
+        return (True, {deviceID: state for (deviceID, state) in zip(deviceIDs, states) if state})
+
+    # Close the BPUP transport, the keep-alive timers, and the idle HTTP connections
+    def close(self):
+
+        self._closed = True
+
+        if self._BPUP_transport is not None:
+            self._BPUP_transport.close()
+
+        self._cancelKeepAliveTimers()
+        self._closeIdleConnections()
+
+    # BPUP transport connected - send the first keep-alive to start status updates
+    def _BPUP_connectionMade(self, transport):
+
+        self._logger.info("Started BPUP listener.")
+        self._BPUP_transport = transport
+        self._BPUP_sendKeepAlive()
+
+    # BPUP transport closed
+    def _BPUP_connectionLost(self, exc):
+
+        if exc is not None:
+            self._logger.error("UDP connection to Bond Bridge unexpectedly closed. Socket error: %s", str(exc))
+
+        self._BPUP_transport = None
+        self._cancelKeepAliveTimers()
+
+    # Send a keep-alive and schedule the acknowledgement timeout and the next keep-alive
+    def _BPUP_sendKeepAlive(self):
+
+        if self._BPUP_transport is None:
+            return
+
+        self._logger.debug("Sending keep alive message to Bond Bridge...")
+        self._keepAliveSentTime = time.perf_counter()
+        self._BPUP_transport.sendto(bondapi._BPUP_KEEP_ALIVE_DATAGRAM)
+
+        self._cancelKeepAliveTimers()
+        self._ackTimeoutHandle = self._loop.call_later(bondapi._BPUP_ACK_TIMEOUT, self._BPUP_ackTimeout)
+        self._keepAliveHandle = self._loop.call_later(bondapi._BPUP_KEEP_ALIVE_TIME, self._BPUP_sendKeepAlive)
+
+    # No response to the keep-alive - the next keep-alive is still sent on schedule
+    def _BPUP_ackTimeout(self):
+
+        self._ackTimeoutHandle = None
+        self._keepAliveSentTime = None
+        self._logger.error("Bond Bridge did not respond to keep-alive message.")
+
+    def _cancelKeepAliveTimers(self):
+
+        for handle in (self._ackTimeoutHandle, self._keepAliveHandle):
+            if handle is not None:
+                handle.cancel()
+        self._ackTimeoutHandle = None
+        self._keepAliveHandle = None
+
+    # Handle a datagram from the bridge
+    def _BPUP_datagramReceived(self, msg):
+
+        # record the raw datagram if recording is enabled
+        if self._BPUP_recorder is not None:
+            self._BPUP_recorder.record(self._hostName, msg)
+
+        try:
+            deviceID, state, error = bondapi._BPUP_readMessage(msg, self._logger)
+        except (json.decoder.JSONDecodeError, KeyError):
+            self._logger.error("Bond Bridge returned unexpected message data '%s'.", msg.decode("utf-8", "replace"))
+            return
+
+        # error messages have already been logged - the next keep-alive is still sent on schedule
+        if error:
+            return
+
+        # check for a status message
+        if deviceID is not None:
+
+            # call state callback function (scheduled as a task if it is a coroutine function)
+            result = self._stateCallback(deviceID, state)
+            if asyncio.iscoroutine(result):
+                self._loop.create_task(result)
+
+        # otherwise a response to the keep-alive
+        elif self._keepAliveSentTime is not None:
+
+            self._keepAliveRTT = time.perf_counter() - self._keepAliveSentTime
+            self._keepAliveSentTime = None
+            if self._ackTimeoutHandle is not None:
+                self._ackTimeoutHandle.cancel()
+                self._ackTimeoutHandle = None
+
+# Runs an asyncio event loop on a background thread and accepts coroutines from other threads
+class EventLoopThread(object):
+
+    def __init__(self, name="EventLoop"):
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    # Return whether the current thread is the loop thread
+    def isLoopThread(self):
+        return threading.current_thread() is self._thread
+
+    # Return whether the loop is running
+    def isRunning(self):
+        return self.loop.is_running() and not self.loop.is_closed()
+
+    # Run a coroutine on the loop and wait for the result (must not be called from the loop thread)
+    def run(self, coro, timeout=None):
+
+        if self.isLoopThread():
+            coro.close()
+            raise RuntimeError("Blocking call on the event loop thread")
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    # Run coroutines concurrently on the loop and wait for all of the results
+    def runAll(self, coros, timeout=None):
+
+        async def gatherAll():
+            return await asyncio.gather(*coros)
+
+        return self.run(gatherAll(), timeout)
+
+    # Schedule a coroutine on the loop without waiting - returns a concurrent.futures.Future
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # Call a function on the loop without waiting
+    def call(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    # Stop the loop and wait for the thread to finish
+    def stop(self):
+
+        if self.isRunning():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if not self.isLoopThread():
+                self._thread.join()
+
+# Blocking connection with the surface of bondapi.bondBridgeConnection that performs all I/O for the bridge
+# with an AsyncBondBridgeConnection on a shared event loop thread
+# Note: BPUP state callbacks are called on the loop thread and must not make blocking calls to the bridge
+class LoopBondBridgeConnection(object):
+
+    def __init__(self, hostName, token, runtime, stateCallback=None, logger=_LOGGER):
+
+        self._runtime = runtime
+
+        # create the connection on the loop thread
+        async def createConnection():
+            return AsyncBondBridgeConnection(hostName, token, logger=logger, loop=runtime.loop)
+        self.connection = runtime.run(createConnection())
+
+        if stateCallback is not None:
+            self.startBPUPListener(stateCallback)
+
+    def startBPUPListener(self, stateCallback):
+        self._runtime.submit(self.connection.startBPUPListener(stateCallback))
+
+    def setHostName(self, hostName):
+        self._runtime.call(self.connection.setHostName, hostName)
+
+    def getHostName(self):
+        return self.connection.getHostName()
+
+    def setBPUPRecorder(self, recorder):
+        self.connection.setBPUPRecorder(recorder)
+
+    def getFailedRequestCount(self):
+        return self.connection.getFailedRequestCount()
+
+    def getKeepAliveRTT(self):
+        return self.connection.getKeepAliveRTT()
+
+    def enableStats(self, sinks=None):
+        self.connection.enableStats(sinks)
+
+    def getStats(self):
+        return self.connection.getStats()
+
+    def flushStats(self):
+        self.connection.flushStats()
+
+    def getDeviceList(self):
+        return self._runtime.run(self.connection.getDeviceList())
+
+    def getDeviceProperties(self, deviceID):
+        return self._runtime.run(self.connection.getDeviceProperties(deviceID))
+
+    def getDeviceState(self, deviceID):
+        return self._runtime.run(self.connection.getDeviceState(deviceID))
+
+    def execDeviceAction(self, deviceID, action, argument = None):
+        return self._runtime.run(self.connection.execDeviceAction(deviceID, action, argument))
+
+    def getBridgeInfo(self):
+        return self._runtime.run(self.connection.getBridgeInfo())
+
+    def isBridgeAlive(self):
+        return self._runtime.run(self.connection.isBridgeAlive())
+
+    def pollDeviceStates(self, deviceIDs):
+        return self._runtime.run(self.connection.pollDeviceStates(deviceIDs))
+
+    def close(self):
+
+        if self._runtime.isRunning():
+            self._runtime.call(self.connection.close)
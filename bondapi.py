@@ -7,6 +7,7 @@ by Goose66 (W. Randy King) kingwrandy@gmail.com
 import sys
 import logging
 import requests
+import http.client
 import json
 from zeroconf import ServiceBrowser, Zeroconf
 import ipaddress
@@ -14,6 +15,10 @@ import time
 import threading
 import re
 import socket
+import select
+import bisect
+import struct
+import queue
 
 # Pickup the root logger, and add a handler for module testing if none exists
 _LOGGER = logging.getLogger()
@@ -119,9 +124,32 @@ API_BRIDGE_INFO_FAILED = "error"
 # Timeout duration for HTTP calls - defined here for easy tweaking
 _HTTP_TIMEOUT = 6.05
 
+# maximum number of idle keep-alive connections kept for a single bridge by bondHTTPClientTransport
+_HTTP_MAX_IDLE_CONNECTIONS = 2
+
+# maximum number of prepared requests (method, path, and stats endpoint by API, device, and action) cached for a bridge
+_API_REQUEST_CACHE_SIZE = 512
+
+# request body for API calls without an argument
+_API_EMPTY_BODY = "{}"
+
+# time the resolved IP address of a bridge host name is pinned for before resolving again in the background (seconds)
+_DNS_PIN_TTL = 300
+
+# minimum time between resolutions of a bridge host name, e.g., for repeated connection failures (seconds)
+_DNS_MIN_RESOLVE_INTERVAL = 10
+
+# Latency histogram bucket upper bounds for API call stats (milliseconds)
+API_STATS_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# File signature and record header (time, host name length, message length) for BPUP traffic recordings
+_BPUP_RECORD_SIGNATURE = b"BPUPREC1"
+_BPUP_RECORD_HEADER = struct.Struct("<dBH")
+
 _BPUP_UDP_PORT = 30007
 _BPUP_KEEP_ALIVE_DATAGRAM = b"\n"
 _BPUP_STATE_PATH_REGEX = r"devices\/(.+)\/state"
+_BPUP_STATE_PATH_PATTERN = re.compile(_BPUP_STATE_PATH_REGEX)
 _BPUP_BUFFER_SIZE = 256
 _BPUP_KEEP_ALIVE_TIME = 90
 _BPUP_STATUS_TIMEOUT = 20
@@ -131,7 +159,7 @@ _BPUP_ACK_TIMEOUT = 2
 class bondBridgeConnection(object):
 
     # Primary constructor method
-    def __init__(self, hostName, token, stateCallback=None, logger=_LOGGER):
+    def __init__(self, hostName, token, stateCallback=None, logger=_LOGGER, transport=None):
 
         self._logger = logger
 
@@ -139,59 +167,151 @@ class bondBridgeConnection(object):
         self._hostName = hostName
         self._token = token
 
+        # resolved IP address of the host name shared by the REST API calls and the BPUP connection
+        self._resolver = bondHostResolver(hostName, logger)
+
+        # HTTP transport (see bondRequestsTransport) for the REST API calls - defaults to requests
+        self._transport = transport if transport is not None else bondRequestsTransport()
+
+        # headers (same every call) and prepared requests for the REST API calls
+        self._headers = _getRequestHeaders(token)
+        self._preparedRequests = {}
+
         self._BPUP_conn = None
+        self._listenerThread = None
+        self._stateCallback = None
+        self._closed = False
+
+        # number of REST API calls that failed (timeouts, connection errors, and HTTP errors)
+        self._failedRequests = 0
+
+        # round trip time of the last successful BPUP keep-alive (seconds)
+        self._keepAliveRTT = None
+
+        # API call stats are only collected if enabled with enableStats()
+        self._stats = None
+        self._statsSinks = []
+
+        # BPUP datagrams are only recorded if a recorder is set with setBPUPRecorder()
+        self._BPUP_recorder = None
 
         # No HTTP sessions for Bond Bridge
            
         # if a callback function was specified, setup a thread for BPUP listener for status from Bridge
         if stateCallback is not None:
+            self.startBPUPListener(stateCallback)
 
-            self._logger.debug("Starting BPUP listener thread...")
-            self._listenerThread = threading.Thread(target=self._BPUP_Listener, name="BPUP_Listener", args=(stateCallback,))
-            self._listenerThread.daemon = True
-            try:
-                self._listenerThread.start()
-            except:
-                self._logger.error("Error starting listener thread.")
-                raise
+    # Start a thread for the BPUP listener for status from the Bridge
+    def startBPUPListener(self, stateCallback):
+
+        self._logger.debug("Starting BPUP listener thread...")
+        self._stateCallback = stateCallback
+        self._listenerThread = threading.Thread(target=self._BPUP_Listener, name="BPUP_Listener", args=(stateCallback,))
+        self._listenerThread.daemon = True
+        try:
+            self._listenerThread.start()
+        except:
+            self._logger.error("Error starting listener thread.")
+            raise
+
+    # Change the host name (or IP address) of the bridge, e.g., when the bridge gets a new IP address from DHCP
+    # Note: REST API calls use the new host name immediately and the BPUP listener reconnects its socket
+    def setHostName(self, hostName):
+
+        if hostName == self._hostName:
+            return
+
+        self._logger.info("Host name for Bond Bridge changed from %s to %s.", self._hostName, hostName)
+        self._hostName = hostName
+        self._resolver.setHostName(hostName)
+
+        # restart the BPUP listener if it has died (e.g., when the keep-alive to the old address failed)
+        if self._stateCallback is not None and not self._closed and (self._listenerThread is None or not self._listenerThread.is_alive()):
+            self.startBPUPListener(self._stateCallback)
+
+    # Return the host name (or IP address) of the bridge
+    def getHostName(self):
+        return self._hostName
+
+    # Enable collection of API call stats, with optional sinks (objects with emit(), e.g., bondApiStatsLogSink) for flushStats()
+    def enableStats(self, sinks=None):
+
+        self._stats = bondApiStats()
+        self._statsSinks = list(sinks or [])
+
+    # Add a sink for the API call stats
+    def addStatsSink(self, sink):
+        self._statsSinks.append(sink)
+
+    # Return a copy of the API call stats by endpoint (or None if not enabled)
+    def getStats(self):
+
+        if self._stats is None:
+            return None
+        else:
+            return self._stats.snapshot()
+
+    # Set a recorder (bondBPUPRecorder) for the BPUP datagrams received from the bridge (None to stop recording)
+    def setBPUPRecorder(self, recorder):
+        self._BPUP_recorder = recorder
+
+    # Return the number of REST API calls that failed
+    def getFailedRequestCount(self):
+        return self._failedRequests
+
+    # Return the round trip time of the last successful BPUP keep-alive (seconds, or None if none yet)
+    def getKeepAliveRTT(self):
+        return self._keepAliveRTT
+
+    # Send the API call stats to the sinks
+    def flushStats(self):
+
+        if self._stats is not None:
+            stats = self._stats.snapshot()
+            for sink in self._statsSinks:
+                try:
+                    sink.emit(self._hostName, stats)
+                except Exception as e:
+                    self._logger.warning("Error sending API call stats to sink %s: %s", type(sink).__name__, str(e))
 
     # Call the specified REST API
     def _call_api(self, api, deviceID=None, action=None, arg=None):
 
-        if arg:
-            payload = {"argument": arg}
-        else:
-            payload = {}
-        
-        method = api["method"]
-        path = api["path"].format(device_id = deviceID, action_id = action) 
+        # only the body is built for each call - the method, path, and stats endpoint are prepared once
+        (method, path, endpoint) = _getPreparedRequest(self._preparedRequests, api, deviceID, action)
+        data = _getRequestBody(arg)
 
         # uncomment the next line to dump HTTP request data to log file for debugging
-        #self._logger.debug("HTTP %s data: %s", method + " " + path, payload)
+        #self._logger.debug("HTTP %s data: %s", method + " " + path, data)
 
+        # time the call if stats are enabled
+        stats = self._stats
+        if stats is not None:
+            startTime = time.perf_counter()
+
+        # May want to add special handling for 404 errors for unsupported commands and 401 errors for bad token
+        # For now the transport raises all HTTP errors to be handled in exception handling
         try:
-            response = requests.request(method,
-                _API_ENDPOINT.format(
-                    host_name = self._hostName,
-                    path = path
-                ),
-                data = json.dumps(payload), # because REST API requires double quotes on parameter names
-                headers = {"BOND-Token": self._token}, # same every call     
-                timeout=_HTTP_TIMEOUT
-            )
-            
-            # May want to add special handling for 404 errors for unsupported commands and 401 errors for bad token
-            # For now just raise all HTTP errors to be handled in exception handling
-            response.raise_for_status()
+            response = self._transport.request(method, self._resolver.getHost(), path, data, self._headers, _HTTP_TIMEOUT)
 
         # Allow timeout and connection errors to be ignored - log and return false
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
+        except bondTransportError as e:
+            self._failedRequests += 1
+
+            # the bridge may have a new address if it can't be reached
+            if e.response is None:
+                self._resolver.refresh()
+            if stats is not None:
+                stats.record(endpoint, (time.perf_counter() - startTime) * 1000, e.response, len(data), e.timeout)
             self._logger.warning("HTTP %s in _call_api() failed: %s", method, str(e))
             return False
         except:
             self._logger.error("Unexpected error occured: %s", sys.exc_info()[0])
             raise
 
+        if stats is not None:
+            stats.record(endpoint, (time.perf_counter() - startTime) * 1000, response, len(data))
+
         # uncomment the next line to dump HTTP response to log file for debugging
         #self._logger.debug("HTTP response code: %d data: %s", response.status_code, response.text)
 
@@ -209,21 +329,19 @@ class bondBridgeConnection(object):
         response  = self._call_api(_API_GET_DEVICE_LIST)
         
         # if data returned, get the device IDs from the response data
-        if response and int(response.headers["content-length"]) > 0:
+        respData = _getResponseData(response)
+        if respData is not False:
 
-            respData = response.json()
             deviceList = {}
 
-            # iterate through key IDs
-            for deviceID in respData.keys():
+            # iterate through device IDs
+            for deviceID in _getDeviceIDs(respData):
 
-                if deviceID != "_":
+                # get the device info
+                devInfo = _getResponseData(self._call_api(_API_GET_DEVICE_INFO, deviceID))
 
-                    # get the device info
-                    response = self._call_api(_API_GET_DEVICE_INFO, deviceID)
-                    devInfo = response.json()
-
-                    # add the device as an item to the device list dict
+                # add the device as an item to the device list dict
+                if devInfo is not False:
                     deviceList.update({deviceID: devInfo})
 
             return deviceList
@@ -239,16 +357,9 @@ class bondBridgeConnection(object):
         self._logger.debug("in API getDeviceProperties()...")
 
         response = self._call_api(_API_GET_DEVICE_PROPERTIES, deviceID)
-        
-        # if response data was returned, then return the properties dictionary from the response data
-        if response and int(response.headers["content-length"]) > 0:
-
-            respData = response.json()
-            return respData
 
-        # otherwise return error (false)
-        else:
-            return False
+        # return the properties dictionary from the response data (or False if no data was returned)
+        return _getResponseData(response)
 
     # Get state of device
     def getDeviceState(self, deviceID):
@@ -257,16 +368,9 @@ class bondBridgeConnection(object):
         self._logger.debug("in API getDeviceState()...")
 
         response = self._call_api(_API_GET_DEVICE_STATE, deviceID)
-        
-        # if response data was returned, then return the state vars dictionary from the response data
-        if response and int(response.headers["content-length"]) > 0:
-
-            respData = response.json()
-            return respData
 
-        # otherwise return error (false)
-        else:
-            return False
+        # return the state vars dictionary from the response data (or False if no data was returned)
+        return _getResponseData(response)
        
     # Execute a device action
     def execDeviceAction(self, deviceID, action, argument = None):
@@ -278,12 +382,7 @@ class bondBridgeConnection(object):
         response = self._call_api(_API_DEVICE_ACTION, deviceID, action, argument)
 
         # If a good code was returned, then return True
-        if response and response.status_code in (200, 204):
-            return True
-
-        # Otherwise, return False
-        else:
-            return False
+        return _isActionSuccess(response)
 
     # Get bridge information
     def getBridgeInfo(self):
@@ -295,22 +394,15 @@ class bondBridgeConnection(object):
         response = self._call_api(_API_GET_BRIDGE_VERSION)
 
         # If a response was returned and it has contents
-        if response and int(response.headers["content-length"]) > 0:
-
-            # Get the bridge properties dictionary from the response data
-            bridgeInfo = response.json()
+        bridgeInfo = _getResponseData(response)
+        if bridgeInfo is not False:
 
             # Get the name of the bridge.
             # Note this API is not in the v2 documentation, so it may go away
             response = self._call_api(_API_GET_BRIDGE_INFO)
-            if response and int(response.headers["content-length"]) > 0:
 
-                # add the name property from the response to the return data
-                respData = response.json()
-                if "name" in respData.keys():
-                    bridgeInfo["name"] = respData["name"]
-                
-            return bridgeInfo
+            # add the name property from the response to the return data
+            return _addBridgeName(bridgeInfo, _getResponseData(response))
 
         # otherwise return error (False)
         else:
@@ -325,6 +417,11 @@ class bondBridgeConnection(object):
     # Attempt to close the BPUP UDP socket if it exists
     def close(self):
 
+        self._closed = True
+
+        # close any keep-alive connections of the HTTP transport
+        self._transport.close()
+
         # If the BPUP UDP socket is still open, then the 
         if self._BPUP_conn is not None:
 
@@ -341,10 +438,12 @@ class bondBridgeConnection(object):
         # for tracking keep-alive time in BPUP
         self._lastKeepAliveTime = 0
 
-        # Open a socket for communication with the bridge
+        # Open a socket for communication with the bridge at the resolved address of the host name
+        # Note: the host name may include a port for the REST API (e.g., "192.168.1.145:8080"), which is stripped
         conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        address = self._resolver.getAddress()
         try:
-            conn.connect((self._hostName, _BPUP_UDP_PORT))
+            conn.connect((address, _BPUP_UDP_PORT))
         except (socket.error, socket.herror, socket.gaierror) as e:
             self._logger.error("Unable to establish UDP connection with Bond Bridge. Socket error: %s", str(e))
             conn.close()
@@ -361,10 +460,26 @@ class bondBridgeConnection(object):
             # Loop continuously and Listen for status messages over UDP connection
             while True:
 
+                # reconnect the socket to the new address if the host name was changed with setHostName() or
+                # resolves to a new address
+                if self._resolver.getAddress() != address:
+                    address = self._resolver.getAddress()
+                    try:
+                        conn.connect((address, _BPUP_UDP_PORT))
+                    except (socket.error, socket.herror, socket.gaierror) as e:
+                        self._logger.error("Unable to reconnect UDP connection with Bond Bridge at %s. Socket error: %s", address, str(e))
+                        conn.close()
+                        break
+
+                    # send a keep-alive right away so the bridge sends status updates to the new connection
+                    self._lastKeepAliveTime = 0
+
                 # check keep alive timer and send keep-alive
                 if not self._BPUP_keepAlive(conn):
                     
                     # if returns false, then error has already been logged just exit the loop
+                    # (and check whether the bridge has a new address)
+                    self._resolver.refresh()
                     break
 
                 # Get next status message
@@ -389,39 +504,28 @@ class bondBridgeConnection(object):
 
                 else:
 
+                    # record the raw datagram if recording is enabled
+                    if self._BPUP_recorder is not None:
+                        self._BPUP_recorder.record(self._hostName, msg)
+
                     # uncomment next line for debugging of message data
                     #self._logger.debug("UDP message received from bridge: '%s'",  msg.decode("utf-8"))
 
                     # attempt to parse status message from bridge
                     try:
     
-                        # check response
-                        # Note: BPUP byte list responses should parse with json.loads() including trailing newline character
-                        respData = json.loads(msg)
+                        deviceID, state, error = _BPUP_readMessage(msg, self._logger)
 
-                        # check for error message
-                        if "err_id" in respData:
-                            self._logger.warning("Bridge %s returned BPUP error: %d - %s", respData["B"], respData["err_id"], respData["err_msg"])
+                        # close the connection for an error message
+                        if error:
                             conn.close()
                             break
 
                         # check for a status message
-                        elif "t" in respData:
+                        elif deviceID is not None:
 
-                            # parse details from status message device ID from status message
-                            state = respData["b"]
-                            matches = re.match(_BPUP_STATE_PATH_REGEX, respData["t"])
-                            if matches:
-
-                                # pull the device ID from the matched expression
-                                deviceID = matches.groups()[0]
-                                self._logger.debug("Status update message received from Bond Bridge: Device ID %s, Message %s", deviceID, state)
-
-                                # call state callback function in bridge
-                                stateCallback(deviceID, state) 
-
-                            else:
-                                raise KeyError
+                            # call state callback function in bridge
+                            stateCallback(deviceID, state) 
 
                     except (json.decoder.JSONDecodeError, KeyError):
                         self._logger.error("Bond Bridge returned unexpected message data '%s'. Connection closed.", msg.decode("utf-8"))
@@ -444,6 +548,7 @@ class bondBridgeConnection(object):
             try:
                 # set short timeout for response and send keep-alive
                 conn.settimeout(_BPUP_ACK_TIMEOUT)
+                sendTime = time.perf_counter()
                 conn.send(_BPUP_KEEP_ALIVE_DATAGRAM)
 
                 # wait for response
@@ -455,6 +560,7 @@ class bondBridgeConnection(object):
                 bridgeID = respData["B"]
                 
                 # if no errors returned, then keep-alive successful
+                self._keepAliveRTT = time.perf_counter() - sendTime
                 self._lastKeepAliveTime = currentTime
                 return True
 
@@ -481,6 +587,556 @@ class bondBridgeConnection(object):
         else:
             return True
 
+# Return the prepared request for the API call as a tuple of (method, path, stats endpoint) from the cache,
+# preparing and caching it on first use
+def _getPreparedRequest(cache, api, deviceID, action):
+
+    key = (api["path"], deviceID, action)
+    prepared = cache.get(key)
+    if prepared is None:
+
+        # start over if the cache is full (e.g., after many devices have been removed and added)
+        if len(cache) >= _API_REQUEST_CACHE_SIZE:
+            cache.clear()
+
+        prepared = (api["method"], api["path"].format(device_id = deviceID, action_id = action), api["method"] + " " + api["path"])
+        cache[key] = prepared
+
+    return prepared
+
+# Return the JSON request body for the API call argument
+# Note: same as json.dumps({"argument": arg}) - REST API requires double quotes on parameter names
+def _getRequestBody(arg):
+
+    if arg:
+        return '{"argument": ' + json.dumps(arg) + '}'
+    else:
+        return _API_EMPTY_BODY
+
+# Return the headers for the REST API calls with the authentication token
+def _getRequestHeaders(token):
+    return {"BOND-Token": token}
+
+# Raise bondTransportError for a response with an HTTP error status code (400 and above)
+def _checkResponseStatus(response, reason, hostName, path):
+
+    if response.status_code >= 400:
+        raise bondTransportError("{} Error: {} for {}{}".format(response.status_code, reason, hostName, path), response)
+
+# Return the data dictionary from the response to a REST API call (or False if there was no response or it has no contents)
+# Note: shared by the REST API calls of bondBridgeConnection and bondaio.AsyncBondBridgeConnection
+def _getResponseData(response):
+
+    if response and len(response.content) > 0:
+        return response.json()
+    else:
+        return False
+
+# Return the device IDs from the device list response data
+def _getDeviceIDs(respData):
+    return [deviceID for deviceID in respData.keys() if deviceID != "_"]
+
+# Return whether the response to a device action has a good status code
+def _isActionSuccess(response):
+    return bool(response) and response.status_code in (200, 204)
+
+# Add the name property from the bridge info response data (if any) to the bridge properties dictionary
+def _addBridgeName(bridgeInfo, respData):
+
+    if respData and "name" in respData.keys():
+        bridgeInfo["name"] = respData["name"]
+
+    return bridgeInfo
+
+# Resolves the host name of a bridge (e.g., "ZZBL12345.local" over mDNS) and pins the IP address for the REST API
+# calls and the BPUP connection - the name is resolved again in the background when the TTL expires or the bridge
+# can't be reached, and the last address keeps being used in the meantime
+class bondHostResolver(object):
+
+    def __init__(self, hostName, logger=_LOGGER, ttl=_DNS_PIN_TTL):
+
+        self._logger = logger
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._firstResolveLock = threading.Lock() # so concurrent first uses wait for a single resolution
+        self._resolving = False
+        self.setHostName(hostName)
+
+    # Set the host name (or IP address), which may include a port for the REST API (e.g., "192.168.1.145:8080")
+    def setHostName(self, hostName):
+
+        (name, separator, port) = hostName.partition(":")
+
+        with self._lock:
+            self._name = name
+            self._port = separator + port
+            self._resolveTime = None
+
+            # IP addresses don't need to be resolved
+            try:
+                ipaddress.ip_address(name)
+            except ValueError:
+                self._address = None
+                self._static = False
+            else:
+                self._address = name
+                self._static = True
+
+    # Return the pinned IP address (resolving the host name on first use)
+    def getAddress(self):
+
+        # read the pinned address together with its state, since the host name may be changed concurrently
+        with self._lock:
+            (address, static, resolveTime) = (self._address, self._static, self._resolveTime)
+
+        if address is None:
+            with self._firstResolveLock:
+                with self._lock:
+                    address = self._address
+                if address is None:
+                    return self._resolve()
+                return address
+
+        # the pin has expired if the TTL has passed or the host name was changed since the address was resolved
+        if not static and (resolveTime is None or time.time() - resolveTime > self._ttl):
+            self.refresh()
+
+        return address
+
+    # Return the host for the REST API calls - the pinned IP address and port (if any)
+    def getHost(self):
+        return self.getAddress() + self._port
+
+    # Resolve the host name again in the background, e.g., when the bridge can't be reached
+    def refresh(self):
+
+        with self._lock:
+            if self._static or self._resolving or (self._resolveTime is not None and time.time() - self._resolveTime < _DNS_MIN_RESOLVE_INTERVAL):
+                return
+            self._resolving = True
+
+        threading.Thread(target=self._resolve, name="Resolver", daemon=True).start()
+
+    # Resolve the host name and pin the address - returns the address
+    # Note: if the name can't be resolved, the last address is kept (or the host name is used if there is none)
+    def _resolve(self):
+
+        name = self._name
+        try:
+            address = socket.getaddrinfo(name, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+        except OSError as e:
+            self._logger.warning("Unable to resolve host name %s: %s", name, str(e))
+            address = None
+
+        with self._lock:
+            self._resolving = False
+
+            # ignore the result if the host name was changed in the meantime
+            if name != self._name:
+                return self._address or self._name
+
+            self._resolveTime = time.time()
+            if address is None:
+                if self._address is None:
+                    self._address = name
+            elif address != self._address:
+                if self._address not in (None, name):
+                    self._logger.info("Address for host name %s changed from %s to %s.", name, self._address, address)
+                self._address = address
+
+            return self._address
+
+# Error raised by HTTP transports for timeouts, connection errors, and HTTP errors
+# response is set for HTTP errors (status code 400 and above) and timeout is set for timeouts
+class bondTransportError(Exception):
+
+    def __init__(self, message, response=None, timeout=False):
+        super(bondTransportError, self).__init__(message)
+        self.response = response
+        self.timeout = timeout
+
+# HTTP transports used by bondBridgeConnection for the REST API calls are duck-typed objects with two methods:
+#   request(method, hostName, path, data, headers, timeout) - makes the HTTP request to the host and returns the
+#     response (with status_code, headers, content, text, and json()) or raises bondTransportError
+#   close() - releases any connections held by the transport
+
+# Transport that makes each request with requests (a new connection for each request)
+class bondRequestsTransport(object):
+
+    def request(self, method, hostName, path, data, headers, timeout):
+
+        try:
+            response = requests.request(method,
+                _API_ENDPOINT.format(
+                    host_name = hostName,
+                    path = path
+                ),
+                data = data,
+                headers = headers,
+                timeout=timeout
+            )
+            response.raise_for_status()
+
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
+            raise bondTransportError(str(e), e.response, isinstance(e, requests.exceptions.Timeout))
+
+        return response
+
+    # no connections are held between requests
+    def close(self):
+        pass
+
+# Response to a request made by bondHTTPClientTransport (or bondaio.AsyncBondBridgeConnection)
+class bondHTTPResponse(object):
+
+    def __init__(self, status_code, headers, content):
+
+        self.status_code = status_code
+        self.headers = headers # header names are case-insensitive
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+# Minimal transport that makes requests with http.client over persistent HTTP/1.1 (keep-alive) connections
+class bondHTTPClientTransport(object):
+
+    def __init__(self, maxIdleConnections=_HTTP_MAX_IDLE_CONNECTIONS):
+
+        self._maxIdleConnections = maxIdleConnections
+        self._lock = threading.Lock()
+        self._idle = {} # idle connections by host name
+
+    # Return a tuple of (connection, reused) for the host, reusing an idle connection if available
+    def _getConnection(self, hostName, timeout):
+
+        while True:
+            with self._lock:
+                idle = self._idle.get(hostName)
+                if not idle:
+                    break
+                conn = idle.pop()
+
+            # skip connections the bridge has already closed (the socket is readable at EOF)
+            try:
+                if conn.sock is not None and not select.select([conn.sock], [], [], 0)[0]:
+                    return (conn, True)
+            except (OSError, ValueError):
+                pass
+            conn.close()
+
+        return (http.client.HTTPConnection(hostName, timeout=timeout), False)
+
+    # Return the connection to the idle connections for the host (or close it if there are already enough)
+    def _releaseConnection(self, hostName, conn):
+
+        with self._lock:
+            idle = self._idle.setdefault(hostName, [])
+            if len(idle) < self._maxIdleConnections:
+                idle.append(conn)
+                return
+
+        conn.close()
+
+    def request(self, method, hostName, path, data, headers, timeout):
+
+        body = data.encode("utf-8") if data is not None else None
+
+        while True:
+            (conn, reused) = self._getConnection(hostName, timeout)
+            sent = False
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request(method, path, body, headers)
+                sent = True
+                resp = conn.getresponse()
+                content = resp.read()
+
+            # retry with a new connection if the bridge closed an idle connection - only if the request wasn't sent
+            # or is a GET, since the bridge may have already executed a PUT action (e.g., TogglePower) before the reset
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                conn.close()
+                if reused and (not sent or method == "GET"):
+                    continue
+                raise bondTransportError("Connection error for {}{}: {}".format(hostName, path, str(e)))
+            except socket.timeout as e:
+                conn.close()
+                raise bondTransportError("Timeout for {}{}: {}".format(hostName, path, str(e)), timeout=True)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise bondTransportError("Connection error for {}{}: {}".format(hostName, path, str(e)))
+
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._releaseConnection(hostName, conn)
+
+        response = bondHTTPResponse(resp.status, resp.headers, content)
+        _checkResponseStatus(response, resp.reason, hostName, path)
+
+        return response
+
+    def close(self):
+
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+# HTTP transports by name
+API_HTTP_TRANSPORTS = {
+    "requests": bondRequestsTransport,
+    "httpclient": bondHTTPClientTransport
+}
+
+# Collects request counts, latency histograms, status code counts, timeouts, errors, and bytes transferred
+# by endpoint (method and path template) for the REST API calls of a bridge connection
+class bondApiStats(object):
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    # Record a REST API call - response is None for timeouts and connection errors
+    def record(self, endpoint, latency, response, bytesSent, timeout=False):
+
+        with self._lock:
+
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = {
+                    "requests": 0,
+                    "latencySum": 0.0,
+                    "buckets": [0] * (len(API_STATS_BUCKETS_MS) + 1),
+                    "statusCodes": {},
+                    "timeouts": 0,
+                    "errors": 0,
+                    "bytesSent": 0,
+                    "bytesReceived": 0
+                }
+                self._endpoints[endpoint] = stats
+
+            stats["requests"] += 1
+            stats["latencySum"] += latency
+            stats["buckets"][bisect.bisect_left(API_STATS_BUCKETS_MS, latency)] += 1
+            stats["bytesSent"] += bytesSent
+
+            if response is not None:
+                stats["statusCodes"][response.status_code] = stats["statusCodes"].get(response.status_code, 0) + 1
+                stats["bytesReceived"] += len(response.content)
+            elif timeout:
+                stats["timeouts"] += 1
+            else:
+                stats["errors"] += 1
+
+    # Return a copy of the stats by endpoint
+    def snapshot(self):
+
+        with self._lock:
+            return {endpoint: dict(stats, buckets=list(stats["buckets"]), statusCodes=dict(stats["statusCodes"])) for (endpoint, stats) in self._endpoints.items()}
+
+# Sinks that receive API call stats from bondBridgeConnection.flushStats() are duck-typed objects with one method:
+#   emit(hostName, stats) - receives the stats by endpoint for the bridge with the specified host name
+
+# Sink that writes a summary of the API call stats to a logger
+class bondApiStatsLogSink(object):
+
+    def __init__(self, logger=_LOGGER, level=logging.INFO):
+
+        self._logger = logger
+        self._level = level
+
+    def emit(self, hostName, stats):
+
+        for endpoint in sorted(stats):
+            endpointStats = stats[endpoint]
+            self._logger.log(self._level, "API stats for %s %s - requests: %d, average: %.1f ms, status codes: %s, timeouts: %d, errors: %d, bytes sent/received: %d/%d",
+                hostName,
+                endpoint,
+                endpointStats["requests"],
+                endpointStats["latencySum"] / endpointStats["requests"],
+                str(endpointStats["statusCodes"]),
+                endpointStats["timeouts"],
+                endpointStats["errors"],
+                endpointStats["bytesSent"],
+                endpointStats["bytesReceived"]
+            )
+
+# Sink that appends the API call stats to a file as JSON lines
+class bondApiStatsFileSink(object):
+
+    def __init__(self, fileName):
+
+        self._fileName = fileName
+        self._lock = threading.Lock()
+
+    def emit(self, hostName, stats):
+
+        line = json.dumps({"time": time.time(), "host": hostName, "buckets": API_STATS_BUCKETS_MS, "stats": stats}, separators=(",", ":"))
+        with self._lock:
+            with open(self._fileName, "a") as f:
+                f.write(line + "\n")
+
+# Long-lived mDNS watcher that reports the current IP address of Bond Bridges and SBB devices as they are
+# announced or updated on the network, e.g., to follow address changes from DHCP
+class bondBridgeWatcher(object):
+
+    def __init__(self, callback, logger=_LOGGER):
+        """Parameters:
+        callback -- function called with (bond ID, IP address) each time a bridge is announced or updated
+        logger -- logger for the watcher
+        """
+
+        self._callback = callback
+        self._logger = logger
+        self._zeroconf = None
+        self._browser = None
+
+    # Start browsing for Bond Bridges and SBB devices on a Zeroconf thread
+    def start(self):
+
+        self._logger.debug("Starting Bond Bridge watcher...")
+        self._zeroconf = Zeroconf()
+        self._browser = ServiceBrowser(self._zeroconf, _BOND_SERVICE_TYPE, self)
+
+    # Stop browsing and release the Zeroconf threads and resources
+    def stop(self):
+
+        if self._zeroconf is not None:
+            self._browser.cancel()
+            self._zeroconf.close()
+            self._zeroconf = None
+
+    def remove_service(self, zeroconf, type, name):
+        pass
+
+    def add_service(self, zeroconf, type, name):
+
+        info = zeroconf.get_service_info(type, name)
+        if info is None or not info.addresses:
+            self._logger.debug("Unable to resolve service info for Bond Bridge/device %s", name)
+            return
+
+        try:
+            self._callback(info.get_name(), str(ipaddress.IPv4Address(info.addresses[0])))
+        except Exception as e:
+            self._logger.error("Error in Bond Bridge watcher callback for %s: %s", name, str(e))
+
+    def update_service(self, zeroconf, type, name):
+        self.add_service(zeroconf, type, name)
+
+# Appends timestamped raw BPUP datagrams from one or more bridge connections to a compact binary file
+# Each record is the header (time, host name length, message length) followed by the host name and the datagram
+class bondBPUPRecorder(object):
+
+    def __init__(self, fileName):
+
+        self._lock = threading.Lock()
+        self._file = open(fileName, "ab")
+
+        # write the signature to a new file
+        if self._file.tell() == 0:
+            self._file.write(_BPUP_RECORD_SIGNATURE)
+            self._file.flush()
+
+    # Append a datagram received from the bridge with the specified host name
+    def record(self, hostName, msg):
+
+        host = hostName.encode("utf-8")[:255]
+        data = _BPUP_RECORD_HEADER.pack(time.time(), len(host), len(msg)) + host + msg
+
+        with self._lock:
+            if self._file is not None:
+                self._file.write(data)
+                self._file.flush()
+
+    def close(self):
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def bondReadBPUPRecording(fileName):
+    """Read a BPUP traffic recording written by bondBPUPRecorder - for external calling
+    
+    Parameters:
+    fileName -- name of the recording file
+    Yields:
+    tuple of (time, host name, raw datagram) for each record
+    Raises:
+    ValueError if the file is not a BPUP traffic recording or is truncated
+    """
+
+    with open(fileName, "rb") as f:
+
+        if f.read(len(_BPUP_RECORD_SIGNATURE)) != _BPUP_RECORD_SIGNATURE:
+            raise ValueError("Not a BPUP traffic recording: " + fileName)
+
+        while True:
+            header = f.read(_BPUP_RECORD_HEADER.size)
+            if not header:
+                break
+            if len(header) < _BPUP_RECORD_HEADER.size:
+                raise ValueError("Truncated BPUP traffic recording: " + fileName)
+
+            (recordTime, hostLength, msgLength) = _BPUP_RECORD_HEADER.unpack(header)
+            data = f.read(hostLength + msgLength)
+            if len(data) < hostLength + msgLength:
+                raise ValueError("Truncated BPUP traffic recording: " + fileName)
+
+            yield (recordTime, data[:hostLength].decode("utf-8"), data[hostLength:])
+
+# Parse a BPUP message from the bridge
+# Returns a tuple of (device ID, state data, message data) - device ID and state data are None if not a status message
+# Raises json.decoder.JSONDecodeError or KeyError for unexpected message data
+def _BPUP_parseMessage(msg):
+
+    # Note: BPUP byte list responses should parse with json.loads() including trailing newline character
+    respData = json.loads(msg)
+
+    # check for a status message
+    if "t" in respData and "err_id" not in respData:
+
+        # parse device ID and state from the status message
+        state = respData["b"]
+        matches = _BPUP_STATE_PATH_PATTERN.match(respData["t"])
+        if matches:
+            return (matches.group(1), state, respData)
+        else:
+            raise KeyError
+
+    return (None, None, respData)
+
+# Parse a BPUP datagram and log error and status update messages - returns tuple of (device ID, state, error) with
+# device ID None for messages that aren't status updates (e.g., keep-alive responses)
+# Note: raises json.decoder.JSONDecodeError or KeyError for unexpected message data, as _BPUP_parseMessage() does
+def _BPUP_readMessage(msg, logger):
+
+    deviceID, state, respData = _BPUP_parseMessage(msg)
+
+    # check for error message
+    if "err_id" in respData:
+        logger.warning("Bridge %s returned BPUP error: %d - %s", respData["B"], respData["err_id"], respData["err_msg"])
+        return (None, None, True)
+
+    # check for a status message
+    if deviceID is not None:
+        logger.debug("Status update message received from Bond Bridge: Device ID %s, Message %s", deviceID, state)
+
+    return (deviceID, state, False)
+
 def bondGetBridgeInfo(hostName, token, logger=_LOGGER):
     """Make authenticated call to retrieve the Bridge/SBB Device info - for external calling
 
@@ -603,18 +1259,40 @@ def bondGetBridgeToken(hostName, logger=_LOGGER):
         logger.exception("Unexpected error from HTTP call in bondGetBridgeToken(): %s", sys.exc_info()[0])
         raise
 
-def bondDiscoverBridges(timeout=5, logger=_LOGGER):
+def bondDiscoverBridges(timeout=5, logger=_LOGGER, callback=None, expected=None):
     """Discover Bond Bridges and Smart By Bond devices using mDNS service discover
 
     Parameters:
     timeout -- timeout for mDNS discovery (Avahi Browse) (defaults to 5 seconds)
+    callback -- function called with the dictionary for each bridge or SBB device as it is discovered (optional)
+    expected -- number of bridges or collection of bond IDs to wait for before returning early (optional)
     Returns:
     Array of dictionaries, one for each bridge or SBB device discovered
     """
-    # class for service listener
+
+    bridges = []
+    for bridgeDescriptor in bondDiscoverBridgesStream(timeout, expected, logger):
+        if callback is not None:
+            callback(bridgeDescriptor)
+        bridges.append(bridgeDescriptor)
+
+    return bridges
+
+def bondDiscoverBridgesStream(timeout=5, expected=None, logger=_LOGGER):
+    """Discover Bond Bridges and Smart By Bond devices using mDNS service discover, yielding each as it is resolved
+
+    Parameters:
+    timeout -- maximum time for mDNS discovery (defaults to 5 seconds)
+    expected -- number of bridges or collection of bond IDs to wait for before ending discovery early (optional)
+    Yields:
+    Dictionary for each bridge or SBB device discovered (de-duplicated by bondid)
+    """
+
+    # class for service listener - resolved bridges are passed to the generator through a queue
     class serviceListener:
 
-        bridges = []
+        def __init__(self):
+            self.resolved = queue.Queue()
 
         def remove_service(self, zeroconf, type, name):
             pass
@@ -625,12 +1303,22 @@ def bondDiscoverBridges(timeout=5, logger=_LOGGER):
             # uncomment the next line to dump info for the service
             #logger.debug("Service %s added, service info: %s", name, info)
 
+            if info is None or not info.addresses:
+                logger.warning("Unable to resolve service info for Bond Bridge/device %s", name)
+                return
+
             bridgeDescriptor = {"bondid": info.get_name(), "hostname": info.server.rstrip("."), "ipaddress":str(ipaddress.IPv4Address(info.addresses[0]))}
-            logger.info("Bond Bridge/device discovered: %s", str(bridgeDescriptor))
+            self.resolved.put(bridgeDescriptor)
+
+        # updated services are resolved again and ignored by the generator if already discovered
+        def update_service(self, zeroconf, type, name):
+            self.add_service(zeroconf, type, name)
 
-            self.bridges.append(bridgeDescriptor)
+    logger.debug("in API bondDiscoverBridgesStream()...")
 
-    logger.debug("in API bondDiscoverBridges()...")
+    # bond IDs expected (if specified as a collection) are matched case insensitive
+    if expected is not None and not isinstance(expected, int):
+        expected = {bondID.upper() for bondID in expected}
 
     # creaate Zeroconf instance and listener for service discovery
     zeroconf = Zeroconf()
@@ -639,11 +1327,38 @@ def bondDiscoverBridges(timeout=5, logger=_LOGGER):
     # browse for Bond Bridges and SBB devices
     browser = ServiceBrowser(zeroconf, _BOND_SERVICE_TYPE, listener)
 
-    # wait the specified time for response(s)
-    time.sleep(timeout)
-    browser.cancel()
+    try:
+
+        # yield each bridge as it is resolved until the timeout or the expected bridges have been found
+        discovered = set()
+        endTime = time.time() + timeout
+        while True:
+
+            remaining = endTime - time.time()
+            if remaining <= 0:
+                break
+
+            try:
+                bridgeDescriptor = listener.resolved.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            bondID = bridgeDescriptor["bondid"].upper()
+            if bondID in discovered:
+                continue
+            discovered.add(bondID)
+
+            logger.info("Bond Bridge/device discovered: %s", str(bridgeDescriptor))
+            yield bridgeDescriptor
+
+            if isinstance(expected, int):
+                if len(discovered) >= expected:
+                    break
+            elif expected is not None and expected <= discovered:
+                break
 
-    # close the Zeroconf instance to release threads and resources
-    zeroconf.close()
+    finally:
 
-    return listener.bridges
+        # close the Zeroconf instance to release threads and resources
+        browser.cancel()
+        zeroconf.close()
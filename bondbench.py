@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the bondapi and nodeserver hot paths with baseline comparison
+Run "python bondbench.py --help" for command line options
+"""
+
+import sys
+import os
+import logging
+import json
+import time
+import argparse
+import tracemalloc
+import importlib.util
+import bondapi
+import bondsim
+
+# Pickup the root logger, and add a handler for module testing if none exists
+_LOGGER = logging.getLogger()
+if not _LOGGER.hasHandlers():
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.WARNING)
+
+# Benchmark defaults
+_BENCH_MIN_TIME = 0.2 # minimum time for each timing run (seconds)
+_BENCH_REPEAT = 5 # number of timing runs for each benchmark (best run is reported)
+_BENCH_THRESHOLD = 0.20 # slowdown versus baseline flagged as a regression
+_BENCH_SIM_ADDRESS = "127.0.0.1"
+_BENCH_SIM_HTTP_PORT = 18080
+_BENCH_NODE_TABLE_SIZE = 1000 # number of device nodes for dispatch benchmarks
+_BENCH_BRIDGE_COUNT = 10 # number of bridges for dispatch benchmarks
+
+# Load the nodeserver module (bond-poly.py can't be imported by name)
+def loadNodeServer():
+
+    spec = importlib.util.spec_from_file_location("bondpoly", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bond-poly.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # polyinterface redirects stdout and stderr to its logger when imported
+    sys.stdout = sys.__stdout__
+    sys.stderr = sys.__stderr__
+    module.polyinterface.LOGGER.setLevel(logging.WARNING)
+
+    return module
+
+# Time a function - returns the best time per call (seconds) from the timing runs
+def timeFunction(func, minTime=_BENCH_MIN_TIME, repeat=_BENCH_REPEAT):
+
+    # calibrate the number of calls per timing run
+    number = 1
+    while True:
+        startTime = time.perf_counter()
+        for i in range(number):
+            func()
+        elapsed = time.perf_counter() - startTime
+        if elapsed >= minTime / 10:
+            break
+        number *= 10
+    number = max(1, int(number * minTime / elapsed))
+
+    best = None
+    for r in range(repeat):
+        startTime = time.perf_counter()
+        for i in range(number):
+            func()
+        elapsed = (time.perf_counter() - startTime) / number
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+# Measure the memory allocated during a call of a function - returns the peak traced memory above the
+# memory in use before the call (bytes)
+def measureAllocations(func):
+
+    # warm up any caches before tracing
+    func()
+
+    tracemalloc.start()
+    try:
+        func()
+        tracemalloc.reset_peak()
+        (baseline, peak) = tracemalloc.get_traced_memory()
+        func()
+        (current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak - baseline
+
+# Response object returned instead of making HTTP calls to time _call_api() request building only
+class _NullResponse(object):
+
+    status_code = 204
+    headers = {"content-length": "0"}
+    text = ""
+
+    def raise_for_status(self):
+        pass
+
+# Benchmark _call_api() request building with the HTTP call itself replaced
+def benchCallApiBuild(context):
+
+    conn = bondapi.bondBridgeConnection("127.0.0.1", "0123456789abcdef")
+    response = _NullResponse()
+
+    def request(*args, **kwargs):
+        return response
+
+    context["restore"].append((bondapi.requests, "request", bondapi.requests.request))
+    bondapi.requests.request = request
+
+    return lambda: conn._call_api(bondapi._API_DEVICE_ACTION, "aabbccdd", bondapi.API_ACTION_SET_SPEED, 3)
+
+# Benchmark a complete _call_api() round trip to a simulated bridge with the HTTP transport
+def benchCallApiSim(transportName):
+
+    def setup(context):
+
+        bridge = context["simBridge"]
+        conn = bondapi.bondBridgeConnection(bridge.host, bridge.token, transport=bondapi.API_HTTP_TRANSPORTS[transportName]())
+        context["connections"].append(conn)
+        deviceID = bridge.deviceIDs[0]
+
+        return lambda: conn._call_api(bondapi._API_GET_DEVICE_STATE, deviceID)
+
+    return setup
+
+# Benchmark parsing of BPUP status datagrams
+def benchBPUPParse(context):
+
+    msg = b'{"B":"ZZBL12345","d":0,"t":"devices/aabbccdd/state","i":"00000000000000000000","s":200,"m":0,"f":255,"b":{"power":1,"speed":3,"direction":1,"light":0,"brightness":100}}\n'
+
+    return lambda: bondapi._BPUP_parseMessage(msg)
+
+# Benchmark dispatch of BPUP status updates to the nodes of a bridge over a large node table
+def benchBPUPDispatch(context):
+
+    controller = context["controller"]
+    bridge = controller.nodes[context["bridgeAddrs"][0]]
+    deviceID = context["deviceIDs"][0] # ceiling fan node
+    states = _FAN_STATES
+    counter = [0]
+
+    def dispatch():
+        counter[0] ^= 1
+        bridge._BPUP_statusUpdate(deviceID, states[counter[0]])
+
+    return dispatch
+
+# Benchmark setDrivers() of a node class (alternating state data so the driver values change)
+def benchSetDrivers(nodeDefID, states):
+
+    def setup(context):
+
+        node = context["nodesByType"][nodeDefID]
+        counter = [0]
+
+        def setDrivers():
+            counter[0] ^= 1
+            node.setDrivers(states[counter[0]], False)
+
+        return setDrivers
+
+    return setup
+
+_FAN_STATES = ({"power": 1, "speed": 3, "direction": 1, "light": 1, "brightness": 50}, {"power": 0, "speed": 3, "direction": -1, "light": 0, "brightness": 50})
+
+# Benchmarks by name
+_BENCHMARKS = [
+    ("call_api_build", benchCallApiBuild),
+    ("call_api_sim", benchCallApiSim("requests")),
+    ("call_api_sim_httpclient", benchCallApiSim("httpclient")),
+    ("bpup_parse", benchBPUPParse),
+    ("bpup_dispatch_%d" % _BENCH_NODE_TABLE_SIZE, benchBPUPDispatch),
+    ("setdrivers_ceiling_fan", benchSetDrivers("CEILING_FAN", _FAN_STATES)),
+    ("setdrivers_ceiling_fan_unchanged", benchSetDrivers("CEILING_FAN", (_FAN_STATES[0], _FAN_STATES[0]))),
+    ("setdrivers_light", benchSetDrivers("LIGHT", _FAN_STATES)),
+    ("setdrivers_nodim_light", benchSetDrivers("NODIM_LIGHT", _FAN_STATES)),
+    ("setdrivers_generic", benchSetDrivers("GENERIC", ({"power": 1}, {"power": 0}))),
+    ("setdrivers_shade", benchSetDrivers("SHADE", ({"open": 1}, {"open": 0})))
+]
+
+# Build the context for the benchmarks: simulated bridge and a controller with a large node table
+def buildContext():
+
+    nodeServer = loadNodeServer()
+    context = {"restore": [], "nodesByType": {}, "bridgeAddrs": [], "deviceIDs": [], "connections": []}
+
+    # start a simulated bridge for the round trip benchmarks
+    context["simBridge"] = bondsim.SimulatedBridge(_BENCH_SIM_ADDRESS, _BENCH_SIM_HTTP_PORT, deviceCount=1)
+    context["simBridge"].start()
+
+    # create a controller with bridges and device nodes from custom data (no connections are made)
+    poly = bondsim.SimulatedPolyglot()
+    controller = nodeServer.Controller(poly)
+    controller.polyConfig = poly.config
+    context["controller"] = controller
+
+    for i in range(_BENCH_BRIDGE_COUNT):
+        bridgeAddr = "zzsim%04d" % i
+        controller.addCustomData(bridgeAddr, "127.0.0.1;token")
+        controller.addNode(nodeServer.Bridge(controller, controller.address, bridgeAddr, "Bridge %d" % i))
+        context["bridgeAddrs"].append(bridgeAddr)
+
+    # device nodes of each type, spread over the bridges
+    nodeTypes = [
+        ("CEILING_FAN", nodeServer.CeilingFan, "{};6;1"),
+        ("LIGHT", nodeServer.Light, "{};0;1"),
+        ("NODIM_LIGHT", nodeServer.NoDimLight, "{};0"),
+        ("GENERIC", nodeServer.Generic, "{}"),
+        ("SHADE", nodeServer.Shade, "{}")
+    ]
+    for i in range(_BENCH_NODE_TABLE_SIZE):
+        (nodeDefID, nodeClass, cData) = nodeTypes[i % len(nodeTypes)]
+        deviceID = "%08x" % i
+        addr = "dev%08x" % i
+        controller.addCustomData(addr, cData.format(deviceID))
+        node = controller.addNode(nodeClass(controller, context["bridgeAddrs"][i % _BENCH_BRIDGE_COUNT], addr, "Device %d" % i))
+        context["nodesByType"].setdefault(nodeDefID, node)
+        if i % _BENCH_BRIDGE_COUNT == 0:
+            context["deviceIDs"].append(deviceID)
+
+    return context
+
+# Release the benchmark context
+def releaseContext(context):
+
+    for (obj, name, value) in context["restore"]:
+        setattr(obj, name, value)
+    context["restore"] = []
+
+    for conn in context["connections"]:
+        conn.close()
+
+    context["simBridge"].stop()
+
+# Run the benchmarks - returns dictionary of results (microseconds per call) by benchmark name
+# If allocations is True, the memory allocated during a call is also measured and printed
+def runBenchmarks(nameFilter=None, minTime=_BENCH_MIN_TIME, repeat=_BENCH_REPEAT, allocations=False):
+
+    context = buildContext()
+    results = {}
+    try:
+        for (name, setup) in _BENCHMARKS:
+            if nameFilter and nameFilter not in name:
+                continue
+
+            func = setup(context)
+            results[name] = timeFunction(func, minTime, repeat) * 1000000
+            if allocations:
+                print("{:<34} {:>12.2f} us {:>10d} bytes allocated".format(name, results[name], measureAllocations(func)))
+            else:
+                print("{:<34} {:>12.2f} us".format(name, results[name]))
+
+            # restore anything patched by the benchmark
+            for (obj, attr, value) in context["restore"]:
+                setattr(obj, attr, value)
+            context["restore"] = []
+
+    finally:
+        releaseContext(context)
+
+    return results
+
+# Compare results to baseline - returns list of regressions as (name, baseline, result, ratio)
+def compareResults(baseline, results, threshold=_BENCH_THRESHOLD):
+
+    regressions = []
+    for name in sorted(results):
+        if name in baseline["results"]:
+            ratio = results[name] / baseline["results"][name]
+            flag = "REGRESSION" if ratio > 1 + threshold else ""
+            print("{:<34} {:>12.2f} us {:>12.2f} us {:>8.2f}x {}".format(name, baseline["results"][name], results[name], ratio, flag))
+            if flag:
+                regressions.append((name, baseline["results"][name], results[name], ratio))
+
+    return regressions
+
+# Run benchmarks from the command line
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run micro-benchmarks for bondapi and nodeserver hot paths.")
+    parser.add_argument("--save", metavar="FILE", help="save results as a JSON baseline file")
+    parser.add_argument("--compare", metavar="FILE", help="compare results to a JSON baseline file - exits with status 1 on regression")
+    parser.add_argument("--threshold", type=float, default=_BENCH_THRESHOLD, help="slowdown ratio flagged as a regression (default: %.2f)" % _BENCH_THRESHOLD)
+    parser.add_argument("--filter", help="only run benchmarks with names containing this string")
+    parser.add_argument("--min-time", type=float, default=_BENCH_MIN_TIME, help="minimum time per timing run in seconds (default: %.1f)" % _BENCH_MIN_TIME)
+    parser.add_argument("--repeat", type=int, default=_BENCH_REPEAT, help="number of timing runs per benchmark (default: %d)" % _BENCH_REPEAT)
+    parser.add_argument("--allocations", action="store_true", help="also measure the memory allocated during a call of each benchmark")
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.filter, args.min_time, args.repeat, args.allocations)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"time": time.time(), "python": sys.version.split()[0], "results": results}, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print("{:<34} {:>15} {:>15} {:>9}".format("benchmark", "baseline", "current", "ratio"))
+        if compareResults(baseline, results, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Replays a BPUP traffic recording (written by the nodeserver with the bpuprecordfile custom parameter) through
+the BPUP message parser and Bridge._BPUP_statusUpdate() to measure dispatch throughput on real traffic
+Run "python bondreplay.py --help" for command line options
+"""
+
+import sys
+import os
+import logging
+import json
+import time
+import argparse
+import tempfile
+import bondapi
+import bondsim
+import bondbench
+
+# Pickup the root logger, and add a handler for module testing if none exists
+_LOGGER = logging.getLogger()
+if not _LOGGER.hasHandlers():
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.WARNING)
+
+# Build a controller with bridge and device nodes for the bridges and devices in the recording
+# Node types are inferred from the state data of the first status update for each device
+def buildController(nodeServer, records):
+
+    bridges = {}
+    devices = {}
+    for (recordTime, hostName, msg) in records:
+        try:
+            (deviceID, state, respData) = bondapi._BPUP_parseMessage(msg)
+        except (json.decoder.JSONDecodeError, KeyError):
+            continue
+        if deviceID is not None:
+            bridgeAddr = respData["B"].lower()
+            bridges.setdefault(bridgeAddr, hostName)
+            devices.setdefault((bridgeAddr, deviceID), state)
+
+    poly = bondsim.SimulatedPolyglot()
+    controller = nodeServer.Controller(poly)
+    controller.polyConfig = poly.config
+
+    # bridge nodes (no connections are made)
+    for (bridgeAddr, hostName) in bridges.items():
+        controller.addCustomData(bridgeAddr, hostName + ";token")
+        controller.addNode(nodeServer.Bridge(controller, controller.address, bridgeAddr, bridgeAddr))
+
+    # device nodes of the types the nodeserver would create for the state data
+    for ((bridgeAddr, deviceID), state) in devices.items():
+
+        nodes = []
+        if "speed" in state:
+            nodes.append((nodeServer.CeilingFan, "{};6;1"))
+            if "brightness" in state:
+                nodes.append((nodeServer.Light, "{};0;0"))
+            elif "light" in state:
+                nodes.append((nodeServer.NoDimLight, "{};0"))
+        elif "open" in state:
+            nodes.append((nodeServer.Shade, "{}"))
+        elif "brightness" in state:
+            nodes.append((nodeServer.Light, "{};0;1"))
+        elif "light" in state:
+            nodes.append((nodeServer.NoDimLight, "{};0"))
+        elif "flame" in state:
+            nodes.append((nodeServer.Fireplace, "{}"))
+        else:
+            nodes.append((nodeServer.Generic, "{}"))
+
+        for (i, (nodeClass, cData)) in enumerate(nodes):
+            addr = nodeServer.getValidNodeAddress(bridgeAddr[-8:] + "_" + deviceID + ("_lt" if i else ""))
+            controller.addCustomData(addr, cData.format(deviceID))
+            controller.addNode(nodeClass(controller, bridgeAddr, addr, deviceID))
+
+    return controller
+
+# Replay the records through the parser and the bridge nodes - returns the results
+def replay(controller, records, realTime=False, speed=1.0):
+
+    results = {"records": len(records), "statusUpdates": 0, "otherMessages": 0, "errors": 0, "unknownBridges": 0, "parseTime": 0.0, "dispatchTime": 0.0, "maxLag": 0.0, "elapsed": 0.0}
+    if not records:
+        return results
+
+    firstTime = records[0][0]
+    startTime = time.perf_counter()
+    for (recordTime, hostName, msg) in records:
+
+        # wait until the time of the record (relative to the start of the recording) if replaying in real time
+        if realTime:
+            delay = (recordTime - firstTime) / speed - (time.perf_counter() - startTime)
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                results["maxLag"] = max(results["maxLag"], -delay)
+
+        parseStart = time.perf_counter()
+        try:
+            (deviceID, state, respData) = bondapi._BPUP_parseMessage(msg)
+        except (json.decoder.JSONDecodeError, KeyError):
+            results["errors"] += 1
+            continue
+        dispatchStart = time.perf_counter()
+        results["parseTime"] += dispatchStart - parseStart
+
+        if deviceID is None:
+            results["otherMessages"] += 1
+            continue
+
+        bridge = controller.nodes.get(respData["B"].lower())
+        if bridge is None:
+            results["unknownBridges"] += 1
+            continue
+
+        bridge._BPUP_statusUpdate(deviceID, state)
+        results["dispatchTime"] += time.perf_counter() - dispatchStart
+        results["statusUpdates"] += 1
+
+    results["elapsed"] = time.perf_counter() - startTime
+    results["recordedDuration"] = records[-1][0] - firstTime
+    results["polyglotMessages"] = sum(controller.poly.messages.values())
+
+    return results
+
+# Replay a recording from the command line
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay a BPUP traffic recording through the nodeserver BPUP dispatch path.")
+    parser.add_argument("recording", help="BPUP traffic recording file")
+    parser.add_argument("--realtime", action="store_true", help="replay with the recorded timing instead of as fast as possible")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed factor for real time replay (default: 1.0)")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times to replay the recording (default: 1)")
+    parser.add_argument("--output", metavar="FILE", help="write the results as JSON to the file")
+    args = parser.parse_args()
+
+    records = list(bondapi.bondReadBPUPRecording(args.recording))
+    outputFile = os.path.abspath(args.output) if args.output else None
+
+    # run the nodeserver in a temporary directory so logs don't end up in the working directory
+    os.chdir(tempfile.mkdtemp(prefix="bondreplay"))
+    controller = buildController(bondbench.loadNodeServer(), records)
+    print("{} records from {} bridges, {} nodes".format(len(records), len(set(record[1] for record in records)), len(controller.nodes)))
+
+    allResults = []
+    for i in range(args.repeat):
+        results = replay(controller, records, args.realtime, args.speed)
+        allResults.append(results)
+        print("replay {}: {} status updates in {:.3f} s ({:.0f} updates/s), parse {:.1f} us/record, dispatch {:.1f} us/update, {} errors, {} unknown bridges{}".format(
+            i + 1,
+            results["statusUpdates"],
+            results["elapsed"],
+            results["statusUpdates"] / results["elapsed"] if results["elapsed"] else 0,
+            results["parseTime"] / results["records"] * 1000000 if results["records"] else 0,
+            results["dispatchTime"] / results["statusUpdates"] * 1000000 if results["statusUpdates"] else 0,
+            results["errors"],
+            results["unknownBridges"],
+            ", max lag {:.1f} ms".format(results["maxLag"] * 1000) if args.realtime else ""
+        ))
+
+    if outputFile:
+        with open(outputFile, "w") as f:
+            json.dump(allResults, f, indent=2)
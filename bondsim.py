@@ -0,0 +1,588 @@
+#!/usr/bin/env python
+"""
+Local simulator for Bond Bridge local API (HTTP and BPUP) for testing and benchmarking without hardware
+Run "python bondsim.py --help" for command line options
+"""
+
+import sys
+import logging
+import json
+import time
+import threading
+import random
+import socket
+import re
+import argparse
+import ipaddress
+import queue
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Pickup the root logger, and add a handler for module testing if none exists
+_LOGGER = logging.getLogger()
+if not _LOGGER.hasHandlers():
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.INFO)
+
+# Simulator defaults
+_SIM_HTTP_PORT = 80
+_SIM_BPUP_PORT = 30007
+_SIM_BPUP_BUFFER_SIZE = 256
+_SIM_SUBSCRIPTION_TIMEOUT = 120 # BPUP clients must send a keep-alive within this time to keep receiving pushes (seconds)
+_SIM_FW_VERSION = "v3.1.0-sim"
+_SIM_DEFAULT_MIX = "CF:4,MS:2,FP:1,GX:1"
+
+# REST API paths handled by the simulator
+_SIM_DEVICE_PATH_REGEX = r"^/v2/devices/([^/]+)(?:/(properties|state|actions/([^/]+)))?$"
+
+# Device templates by device type
+_SIM_DEVICE_TYPES = {
+    "CF": {
+        "name": "Ceiling Fan",
+        "actions": [
+            "TurnOn", "TurnOff", "TogglePower", "SetSpeed", "IncreaseSpeed", "DecreaseSpeed", "SetDirection", "ToggleDirection",
+            "TurnLightOn", "TurnLightOff", "ToggleLight", "SetBrightness", "IncreaseBrightness", "DecreaseBrightness"
+        ],
+        "state": {"power": 0, "speed": 1, "direction": 1, "light": 0, "brightness": 100},
+        "properties": {"max_speed": 6}
+    },
+    "FP": {
+        "name": "Fireplace",
+        "actions": ["TurnOn", "TurnOff", "TogglePower"],
+        "state": {"power": 0},
+        "properties": {}
+    },
+    "MS": {
+        "name": "Shade",
+        "actions": ["Open", "Close", "ToggleOpen"],
+        "state": {"open": 0},
+        "properties": {}
+    },
+    "GX": {
+        "name": "Generic Device",
+        "actions": ["TurnOn", "TurnOff", "TogglePower"],
+        "state": {"power": 0},
+        "properties": {}
+    }
+}
+
+# Simulated Bond Bridge with HTTP server for the local REST API and UDP socket for BPUP
+class SimulatedBridge(object):
+
+    def __init__(self, address="127.0.0.1", httpPort=_SIM_HTTP_PORT, bpupPort=_SIM_BPUP_PORT, index=0, deviceCount=8, mix=_SIM_DEFAULT_MIX,
+        latency=0.0, jitter=0.0, loss=0.0, pushRate=0.0, locked=False, seed=None):
+
+        self.address = address
+        self.httpPort = httpPort
+        self.bpupPort = bpupPort
+        self.latency = latency # response latency (seconds)
+        self.jitter = jitter # random additional response latency (seconds)
+        self.loss = loss # probability of dropping each BPUP datagram
+        self.pushRate = pushRate # rate of spontaneous state changes pushed over BPUP (per second)
+        self.pushing = True # set to False to pause spontaneous state changes
+        self.locked = locked
+
+        self._random = random.Random(seed if seed is not None else index)
+        self.bondID = "ZZSIM%04d" % index
+        self.name = "Sim Bridge %d" % index
+        self.token = "%016x" % self._random.getrandbits(64)
+
+        # counters for benchmarking
+        self.stats = {"requests": 0, "actions": 0, "pushes": 0, "dropped": 0, "keepalives": 0}
+
+        self._lock = threading.Lock()
+        self._subscribers = {} # BPUP client addresses and time of last keep-alive
+        self._devices = {}
+        self._buildDevices(deviceCount, mix)
+
+        self._httpServer = None
+        self._bpupSocket = None
+        self._threads = []
+        self._running = False
+
+    # return a copy of the current state of each device
+    def getDeviceStates(self):
+
+        with self._lock:
+            return {deviceID: dict(self._devices[deviceID]["state"]) for deviceID in self._devices}
+
+    # hostname (and port) to use for the bridge in bondBridgeConnection
+    @property
+    def host(self):
+
+        if self.httpPort == _SIM_HTTP_PORT:
+            return self.address
+        else:
+            return "{}:{}".format(self.address, self.httpPort)
+
+    # return a list of the device IDs for the bridge
+    @property
+    def deviceIDs(self):
+        return list(self._devices)
+
+    # Start the HTTP server, BPUP listener, and push generator threads
+    def start(self):
+
+        self._running = True
+
+        # create the HTTP server with a request handler bound to this bridge
+        bridge = self
+        class handler(_SimRequestHandler):
+            simBridge = bridge
+        self._httpServer = _SimHTTPServer((self.address, self.httpPort), handler)
+        self._httpServer.daemon_threads = True
+
+        # create the UDP socket for BPUP
+        self._bpupSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._bpupSocket.bind((self.address, self.bpupPort))
+        self._bpupSocket.settimeout(1)
+
+        self._threads = [
+            threading.Thread(target=self._httpServer.serve_forever, name="SimHTTP_" + self.bondID),
+            threading.Thread(target=self._BPUP_Listener, name="SimBPUP_" + self.bondID)
+        ]
+        if self.pushRate > 0:
+            self._threads.append(threading.Thread(target=self._pushGenerator, name="SimPush_" + self.bondID))
+
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+        _LOGGER.info("Simulated bridge %s started at %s with %d devices (token %s).", self.bondID, self.host, len(self._devices), self.token)
+
+    # Stop the simulated bridge
+    def stop(self):
+
+        self._running = False
+        if self._httpServer is not None:
+            self._httpServer.shutdown()
+            self._httpServer.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self._bpupSocket is not None:
+            self._bpupSocket.close()
+
+    # Execute an action for a device - returns an HTTP status code
+    def execAction(self, deviceID, action, argument):
+
+        device = self._devices.get(deviceID)
+        if device is None or action not in device["actions"]:
+            return 404
+
+        with self._lock:
+            self.stats["actions"] += 1
+            try:
+                _applyAction(device, action, argument)
+            except (TypeError, ValueError):
+                return 400
+
+        # push the new state of the device to the BPUP subscribers
+        self.pushState(deviceID)
+
+        return 204
+
+    # Push the state of the device to the BPUP subscribers
+    def pushState(self, deviceID):
+
+        with self._lock:
+            message = {
+                "B": self.bondID,
+                "d": 0,
+                "t": "devices/{}/state".format(deviceID),
+                "s": 200,
+                "m": 0,
+                "f": 255,
+                "b": dict(self._devices[deviceID]["state"])
+            }
+            currentTime = time.time()
+            subscribers = [addr for addr in self._subscribers if currentTime - self._subscribers[addr] < _SIM_SUBSCRIPTION_TIMEOUT]
+
+        datagram = (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+        for addr in subscribers:
+            self._sendDatagram(datagram, addr)
+            self.stats["pushes"] += 1
+
+    # Handle a REST API request - returns HTTP status code and response data (or None)
+    def handleRequest(self, method, path, token, body):
+
+        self.stats["requests"] += 1
+
+        # simulate response latency
+        delay = self.latency + self._random.random() * self.jitter
+        if delay > 0:
+            time.sleep(delay)
+
+        if path == "/v2/token" and method == "GET":
+            if self.locked:
+                return (200, {"locked": 1})
+            else:
+                return (200, {"locked": 0, "token": self.token})
+
+        # all other calls require the token
+        if token != self.token:
+            return (401, {"_error_id": 401, "_error_msg": "Unauthorized"})
+
+        if path == "/v2/sys/version" and method == "GET":
+            return (200, {"target": "zermatt", "fw_ver": _SIM_FW_VERSION, "bondid": self.bondID, "make": "Olibra", "model": "BD-SIM", "api": 2})
+
+        elif path == "/v2/bridge" and method == "GET":
+            return (200, {"name": self.name, "location": "Simulator", "bluelight": 127})
+
+        elif path == "/v2/devices" and method == "GET":
+            respData = {"_": "%08x" % len(self._devices)}
+            for deviceID in self._devices:
+                respData[deviceID] = {"_": self._devices[deviceID]["hash"]}
+            return (200, respData)
+
+        matches = re.match(_SIM_DEVICE_PATH_REGEX, path)
+        if matches is None or matches.group(1) not in self._devices:
+            return (404, None)
+
+        deviceID, resource, action = matches.groups()
+        device = self._devices[deviceID]
+
+        if resource is None and method == "GET":
+            return (200, {"name": device["name"], "type": device["type"], "location": "Simulator", "actions": device["actions"], "_": device["hash"]})
+
+        elif resource == "properties" and method == "GET":
+            return (200, dict(device["properties"]))
+
+        elif resource == "state" and method == "GET":
+            with self._lock:
+                return (200, dict(device["state"]))
+
+        elif action is not None and method == "PUT":
+            try:
+                argument = json.loads(body).get("argument") if body else None
+            except ValueError:
+                return (400, None)
+            return (self.execAction(deviceID, action, argument), None)
+
+        return (405, None)
+
+    # build the devices for the bridge from the device type mix
+    def _buildDevices(self, deviceCount, mix):
+
+        # parse the mix ("CF:4,MS:2") into a list of weighted device types
+        types = []
+        for item in mix.split(","):
+            devType, _, weight = item.partition(":")
+            types.extend([devType.strip().upper()] * int(weight or 1))
+
+        for i in range(deviceCount):
+            devType = types[i % len(types)]
+            template = _SIM_DEVICE_TYPES[devType]
+            deviceID = "%08x" % self._random.getrandbits(32)
+            self._devices[deviceID] = {
+                "name": "{} {}".format(template["name"], i + 1),
+                "type": devType,
+                "actions": list(template["actions"]),
+                "state": dict(template["state"]),
+                "properties": dict(template["properties"]),
+                "hash": "%08x" % self._random.getrandbits(32)
+            }
+
+    # send a datagram to a BPUP client, simulating packet loss
+    def _sendDatagram(self, datagram, addr):
+
+        if self.loss > 0 and self._random.random() < self.loss:
+            self.stats["dropped"] += 1
+            return
+
+        try:
+            self._bpupSocket.sendto(datagram, addr)
+        except OSError as e:
+            _LOGGER.debug("BPUP send to %s failed: %s", str(addr), str(e))
+
+    # Listen for BPUP keep-alive datagrams and subscribe the clients to pushes
+    def _BPUP_Listener(self):
+
+        reply = (json.dumps({"B": self.bondID, "d": 0, "v": _SIM_FW_VERSION}, separators=(",", ":")) + "\n").encode("utf-8")
+
+        while self._running:
+
+            try:
+                msg, addr = self._bpupSocket.recvfrom(_SIM_BPUP_BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            # any datagram from a client is treated as a keep-alive
+            with self._lock:
+                self._subscribers[addr] = time.time()
+            self.stats["keepalives"] += 1
+
+            self._sendDatagram(reply, addr)
+
+    # Randomly change the state of devices (like a remote control would) and push the state changes
+    def _pushGenerator(self):
+
+        deviceIDs = list(self._devices)
+
+        while self._running:
+
+            time.sleep(self._random.expovariate(self.pushRate))
+            if not self.pushing:
+                continue
+
+            deviceID = self._random.choice(deviceIDs)
+            device = self._devices[deviceID]
+            with self._lock:
+                key = self._random.choice(list(device["state"]))
+                if key in ("speed",):
+                    device["state"][key] = self._random.randint(1, device["properties"]["max_speed"])
+                elif key in ("brightness",):
+                    device["state"][key] = self._random.randint(1, 100)
+                elif key in ("direction",):
+                    device["state"][key] = -device["state"][key]
+                else:
+                    device["state"][key] = 1 - device["state"][key]
+
+            self.pushState(deviceID)
+
+# HTTP server for the simulated bridge REST API
+class _SimHTTPServer(ThreadingHTTPServer):
+
+    # log errors (e.g., connections reset by clients) at debug level instead of printing to stderr
+    def handle_error(self, request, client_address):
+        _LOGGER.debug("Simulated bridge HTTP error for client %s: %s", str(client_address), str(sys.exc_info()[1]))
+
+# HTTP request handler for the simulated bridge REST API
+class _SimRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1" # support persistent connections
+    disable_nagle_algorithm = True # headers and body are written separately - don't delay the body on persistent connections
+    simBridge = None
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def _handle(self, method):
+
+        # read the request body
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+
+        status, respData = self.simBridge.handleRequest(method, self.path, self.headers.get("BOND-Token"), body)
+
+        # no body for 204 (No Content) responses, which would corrupt the next response on a persistent connection
+        if status == 204:
+            data = b""
+        else:
+            data = json.dumps(respData).encode("utf-8") if respData is not None else b"{}"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # log requests at debug level only
+    def log_message(self, format, *args):
+        _LOGGER.debug("Simulated bridge %s: %s", self.simBridge.bondID, format % args)
+
+# Stand-in for the polyinterface Interface (Polyglot MQTT connection) for running the nodeserver Controller
+# against simulated bridges - counts the messages sent to Polyglot instead of publishing them
+class SimulatedPolyglot(object):
+
+    def __init__(self, customParams=None, customData=None, nodes=None):
+
+        self.inQueue = queue.Queue()
+        self.connected = True
+        self.polyglotConnected = True
+        self.config = {
+            "customParams": dict(customParams or {}),
+            "customData": dict(customData or {}),
+            "nodes": list(nodes or []),
+            "notices": {}
+        }
+        self.messages = collections.Counter() # count of messages sent to Polyglot by type
+        self._configObservers = []
+        self._stopObservers = []
+
+    def onConfig(self, callback):
+        self._configObservers.append(callback)
+
+    def onStop(self, callback):
+        self._stopObservers.append(callback)
+
+    # Send the config to the nodeserver (starts the Controller)
+    def start(self):
+
+        for callback in self._configObservers:
+            callback(self.config)
+
+    # Call the stop methods registered by the nodeserver
+    def stop(self):
+
+        for callback in self._stopObservers:
+            callback()
+
+    # Queue input (e.g., {"shortPoll": {}} or {"command": {"address": addr, "cmd": "DON"}}) for the nodeserver
+    def input(self, command):
+        self.inQueue.put(command)
+
+    def send(self, message):
+
+        for key in message:
+            self.messages[key] += 1
+
+    def addNode(self, node):
+
+        self.messages["addnode"] += 1
+        self.config["nodes"] = [n for n in self.config["nodes"] if n["address"] != node.address]
+        self.config["nodes"].append({
+            "address": node.address,
+            "name": node.name,
+            "node_def_id": node.id,
+            "primary": node.primary,
+            "drivers": [dict(driver) for driver in node.drivers],
+            "isprimary": node.address == node.primary,
+            "timeAdded": int(time.time()),
+            "enabled": True,
+            "added": True
+        })
+
+    def delNode(self, address):
+
+        self.messages["removenode"] += 1
+        self.config["nodes"] = [n for n in self.config["nodes"] if n["address"] != address]
+
+    def saveCustomData(self, data):
+
+        self.messages["customdata"] += 1
+        self.config["customData"] = dict(data)
+
+    def saveCustomParams(self, data):
+
+        self.messages["customparams"] += 1
+        self.config["customParams"] = dict(data)
+
+    def addNotice(self, data):
+
+        self.messages["addnotice"] += 1
+        self.config["notices"][data["key"]] = data["value"]
+
+    def removeNotice(self, data):
+        self.config["notices"].pop(data["key"], None)
+
+    def installprofile(self):
+        pass
+
+    def restart(self):
+        pass
+
+# apply an action to the state of a simulated device
+def _applyAction(device, action, argument):
+
+    state = device["state"]
+
+    if action == "TurnOn":
+        state["power"] = 1
+    elif action == "TurnOff":
+        state["power"] = 0
+    elif action == "TogglePower":
+        state["power"] = 1 - state["power"]
+    elif action == "SetSpeed":
+        state["speed"] = max(1, min(int(argument), device["properties"]["max_speed"]))
+        state["power"] = 1
+    elif action == "IncreaseSpeed":
+        state["speed"] = min(state["speed"] + int(argument or 1), device["properties"]["max_speed"])
+        state["power"] = 1
+    elif action == "DecreaseSpeed":
+        state["speed"] = max(state["speed"] - int(argument or 1), 1)
+        state["power"] = 1
+    elif action == "SetDirection":
+        state["direction"] = -1 if int(argument) == -1 else 1
+    elif action == "ToggleDirection":
+        state["direction"] = -state["direction"]
+    elif action == "TurnLightOn":
+        state["light"] = 1
+    elif action == "TurnLightOff":
+        state["light"] = 0
+    elif action == "ToggleLight":
+        state["light"] = 1 - state["light"]
+    elif action == "SetBrightness":
+        state["brightness"] = max(1, min(int(argument), 100))
+        state["light"] = 1
+    elif action == "IncreaseBrightness":
+        state["brightness"] = min(state["brightness"] + int(argument or 1), 100)
+        state["light"] = 1
+    elif action == "DecreaseBrightness":
+        state["brightness"] = max(state["brightness"] - int(argument or 1), 1)
+        state["light"] = 1
+    elif action == "Open":
+        state["open"] = 1
+    elif action == "Close":
+        state["open"] = 0
+    elif action == "ToggleOpen":
+        state["open"] = 1 - state["open"]
+
+def simStartBridges(count=1, address="127.0.0.1", httpPort=_SIM_HTTP_PORT, bpupPort=_SIM_BPUP_PORT, **kwargs):
+    """Start a number of simulated bridges - for external calling
+
+    Parameters:
+    count -- number of bridges to simulate
+    address -- IP address for the first bridge - each additional bridge uses the next address (e.g., 127.0.0.1, 127.0.0.2, ...)
+    httpPort -- port for the REST API (if not 80, the bridge hosts must be specified as "address:port")
+    bpupPort -- UDP port for BPUP (bondapi always uses 30007)
+    kwargs -- additional options for SimulatedBridge (deviceCount, mix, latency, jitter, loss, pushRate, locked, seed)
+    Returns:
+    list of started SimulatedBridge objects
+    """
+
+    bridges = []
+    firstAddress = ipaddress.IPv4Address(address)
+    for i in range(count):
+        bridge = SimulatedBridge(str(firstAddress + i), httpPort, bpupPort, index=i, **kwargs)
+        bridge.start()
+        bridges.append(bridge)
+
+    return bridges
+
+# Run simulated bridges from the command line
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Simulate Bond Bridges (HTTP local API and BPUP) for testing and benchmarking.")
+    parser.add_argument("--bridges", type=int, default=1, help="number of bridges to simulate (default: 1)")
+    parser.add_argument("--address", default="127.0.0.1", help="IP address of the first bridge - additional bridges use the following addresses (default: 127.0.0.1)")
+    parser.add_argument("--http-port", type=int, default=_SIM_HTTP_PORT, help="port for the HTTP local API (default: 80)")
+    parser.add_argument("--devices", type=int, default=8, help="number of devices per bridge (default: 8)")
+    parser.add_argument("--mix", default=_SIM_DEFAULT_MIX, help="device type mix as TYPE:WEIGHT list (default: %s)" % _SIM_DEFAULT_MIX)
+    parser.add_argument("--latency", type=float, default=0.0, help="HTTP response latency in milliseconds (default: 0)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random additional HTTP response latency in milliseconds (default: 0)")
+    parser.add_argument("--loss", type=float, default=0.0, help="BPUP datagram loss probability 0.0-1.0 (default: 0)")
+    parser.add_argument("--push-rate", type=float, default=0.0, help="spontaneous BPUP state pushes per second per bridge (default: 0)")
+    parser.add_argument("--locked", action="store_true", help="simulate bridges with locked tokens")
+    parser.add_argument("--debug", action="store_true", help="log each request")
+    args = parser.parse_args()
+
+    if args.debug:
+        _LOGGER.setLevel(logging.DEBUG)
+
+    bridges = simStartBridges(
+        args.bridges,
+        args.address,
+        args.http_port,
+        deviceCount=args.devices,
+        mix=args.mix,
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        loss=args.loss,
+        pushRate=args.push_rate,
+        locked=args.locked
+    )
+
+    # print the custom parameter values for configuring the nodeserver with the simulated bridges
+    print("hostname: " + ";".join([bridge.host for bridge in bridges]))
+    print("token: " + ";".join([bridge.token for bridge in bridges]))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for bridge in bridges:
+            bridge.stop()
+        sys.exit(0)
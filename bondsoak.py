@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+Scale soak test for the nodeserver: drives the Controller with a stand-in Polyglot interface against many
+simulated bridges (run in a separate process) through discovery, shortPoll cycles, command storms, and
+sustained BPUP pushes
+Run "python bondsoak.py --help" for command line options
+"""
+
+import sys
+import os
+import logging
+import json
+import time
+import threading
+import random
+import argparse
+import tempfile
+import resource
+import multiprocessing
+import bondsim
+import bondbench
+
+# Pickup the root logger, and add a handler for module testing if none exists
+_LOGGER = logging.getLogger()
+if not _LOGGER.hasHandlers():
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.WARNING)
+
+# Soak test defaults
+_SOAK_SIM_ADDRESS = "127.0.0.1"
+_SOAK_SIM_HTTP_PORT = 18080
+_SOAK_SETTLE_TIME = 3 # time to wait for BPUP pushes to settle before checking state consistency (seconds)
+_SOAK_LATENCY_COMMANDS = 5 # number of commands sent to a single device for the command latency check
+_SOAK_LATENCY_GAP = 0.5 # time between the commands of the command latency check (seconds)
+
+# Run simulated bridges in a child process, controlled through a pipe
+def _simProcess(conn, count, address, httpPort, options):
+
+    bridges = bondsim.simStartBridges(count, address, httpPort, **options)
+    conn.send([(bridge.bondID, bridge.host, bridge.token) for bridge in bridges])
+
+    while True:
+        request = conn.recv()
+        if request == "stats":
+            stats = {}
+            for bridge in bridges:
+                for key in bridge.stats:
+                    stats[key] = stats.get(key, 0) + bridge.stats[key]
+            conn.send(stats)
+        elif request == "pause":
+            for bridge in bridges:
+                bridge.pushing = False
+            conn.send(True)
+        elif request == "resume":
+            for bridge in bridges:
+                bridge.pushing = True
+            conn.send(True)
+        elif request == "states":
+            conn.send({bridge.bondID: bridge.getDeviceStates() for bridge in bridges})
+        elif request == "stop":
+            for bridge in bridges:
+                bridge.stop()
+            conn.send(True)
+            break
+
+# Return the resident set size of this process (bytes)
+def getRSS():
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # fall back to the maximum RSS (kilobytes on Linux, bytes on macOS)
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRSS if sys.platform == "darwin" else maxRSS * 1024
+
+# Soak test for the nodeserver
+class SoakTest(object):
+
+    def __init__(self, args):
+
+        self.args = args
+        self.report = {"config": vars(args), "phases": {}, "samples": []}
+        self.received = 0 # BPUP status updates received by the bridge nodes
+        self._receivedLock = threading.Lock()
+
+    # Send a request to the simulator process and return the response
+    def simRequest(self, request):
+
+        self._simConn.send(request)
+        return self._simConn.recv()
+
+    # Run the soak test and return the report
+    def run(self):
+
+        args = self.args
+
+        # start the simulated bridges in a child process
+        self._simConn, childConn = multiprocessing.Pipe()
+        options = {
+            "deviceCount": args.devices,
+            "mix": args.mix,
+            "latency": args.latency / 1000,
+            "jitter": args.jitter / 1000,
+            "loss": args.loss,
+            "pushRate": args.push_rate
+        }
+        self._simProcess = multiprocessing.Process(target=_simProcess, args=(childConn, args.bridges, _SOAK_SIM_ADDRESS, _SOAK_SIM_HTTP_PORT, options), daemon=True)
+        self._simProcess.start()
+        simBridges = self._simConn.recv()
+
+        # run the nodeserver in a temporary directory so logs and snapshot files don't end up in the working directory
+        os.chdir(tempfile.mkdtemp(prefix="bondsoak"))
+        self.nodeServer = bondbench.loadNodeServer()
+
+        # count BPUP status updates received by the bridge nodes
+        statusUpdate = self.nodeServer.Bridge._BPUP_statusUpdate
+        def countedStatusUpdate(bridge, deviceID, respData):
+            with self._receivedLock:
+                self.received += 1
+            statusUpdate(bridge, deviceID, respData)
+        self.nodeServer.Bridge._BPUP_statusUpdate = countedStatusUpdate
+
+        # start the controller with the simulated bridges configured in the custom parameters
+        self.poly = bondsim.SimulatedPolyglot(customParams={
+            "hostname": ";".join([bridge[1] for bridge in simBridges]),
+            "token": ";".join([bridge[2] for bridge in simBridges])
+        })
+        self.controller = self.nodeServer.Controller(self.poly)
+        self.poly.start()
+        self.controller._threads["ns"].join()
+
+        try:
+            self.phaseDiscovery()
+            self.phaseShortPoll()
+            self.phaseCommandLatency()
+            self.phaseCommandStorm()
+            self.phaseSustained()
+            self.phaseConsistency()
+        finally:
+            self.poly.stop()
+            self.simRequest("stop")
+            self._simProcess.join()
+
+        return self.report
+
+    # Run discovery for all bridges
+    def phaseDiscovery(self):
+
+        startTime = time.time()
+        self.controller.discover()
+        elapsed = time.time() - startTime
+
+        self.deviceNodes = [addr for addr in self.controller.nodes if self.controller.nodes[addr].id not in ("CONTROLLER", "BRIDGE", "GROUP")]
+        self.report["phases"]["discovery"] = {"time": elapsed, "nodes": len(self.controller.nodes), "deviceNodes": len(self.deviceNodes)}
+        print("discovery: {:.2f} s, {} nodes ({} device nodes)".format(elapsed, len(self.controller.nodes), len(self.deviceNodes)))
+
+    # Run a number of shortPoll cycles
+    def phaseShortPoll(self):
+
+        cycleTimes = []
+        for i in range(self.args.poll_cycles):
+            startTime = time.time()
+            self.controller.shortPoll()
+            cycleTimes.append(time.time() - startTime)
+
+        self.report["phases"]["shortPoll"] = {"cycles": len(cycleTimes), "min": min(cycleTimes), "max": max(cycleTimes), "average": sum(cycleTimes) / len(cycleTimes)}
+        print("shortPoll: {} cycles, average {:.2f} s, max {:.2f} s".format(len(cycleTimes), sum(cycleTimes) / len(cycleTimes), max(cycleTimes)))
+
+    # Send spaced On and Off commands to a single device and check that the traced latency (command to BPUP
+    # confirmation and driver update) is well under the gap between the commands, i.e., each command is matched
+    # to its own status update rather than the one for the next command
+    def phaseCommandLatency(self):
+
+        addr = next(addr for addr in self.deviceNodes if "DON" in self.controller.nodes[addr].commands)
+        for i in range(_SOAK_LATENCY_COMMANDS):
+            self.poly.input({"command": {"address": addr, "cmd": "DOF" if i % 2 else "DON"}})
+            time.sleep(_SOAK_LATENCY_GAP)
+
+        # sum the segments over the actions sent for the commands
+        stats = self.controller.tracer.getStats()
+        segments = {}
+        for histograms in stats["histograms"].values():
+            for (segment, histogram) in histograms.items():
+                (count, total) = segments.get(segment, (0, 0.0))
+                segments[segment] = (count + histogram["count"], total + histogram["sum"])
+        (count, total) = segments.get("total", (0, 0.0))
+        average = total / count if count else None
+        confirmCount = segments.get("confirm", (0, 0.0))[0]
+
+        # the average command latency reported by the bridge node (GV0, in ms) must agree
+        bridge = self.controller.nodes[addr].parent
+        bridge.updatePerformanceDrivers()
+        bridgeLatency = next(driver["value"] for driver in bridge.drivers if driver["driver"] == "GV0")
+
+        passed = count == _SOAK_LATENCY_COMMANDS and average < _SOAK_LATENCY_GAP * 1000 / 2 and 0 < bridgeLatency < _SOAK_LATENCY_GAP * 1000 / 2
+
+        self.report["phases"]["commandLatency"] = {
+            "commands": _SOAK_LATENCY_COMMANDS,
+            "confirmed": confirmCount,
+            "pending": stats["pending"],
+            "averageTotal": average,
+            "averageConfirm": segments["confirm"][1] / confirmCount if confirmCount else None,
+            "bridgeLatency": bridgeLatency,
+            "passed": passed
+        }
+        print("command latency: {} of {} commands confirmed, average {} ms, bridge GV0 {} ms (gap {:.0f} ms) - {}".format(
+            count, _SOAK_LATENCY_COMMANDS, "{:.1f}".format(average) if count else "-", bridgeLatency, _SOAK_LATENCY_GAP * 1000, "passed" if passed else "FAILED"
+        ))
+
+    # Queue a storm of commands for random device nodes through the Polyglot input queue
+    def phaseCommandStorm(self):
+
+        rand = random.Random(0)
+        startTime = time.time()
+        for i in range(self.args.commands):
+            self.poly.input({"command": {"address": rand.choice(self.deviceNodes), "cmd": rand.choice(("DON", "DOF"))}})
+        self.poly.inQueue.join()
+        elapsed = time.time() - startTime
+
+        self.report["phases"]["commandStorm"] = {"commands": self.args.commands, "time": elapsed, "rate": self.args.commands / elapsed}
+        print("command storm: {} commands in {:.2f} s ({:.1f} commands/s)".format(self.args.commands, elapsed, self.args.commands / elapsed))
+
+    # Run shortPoll cycles at the poll interval while the simulated bridges push state changes, sampling resource usage
+    def phaseSustained(self):
+
+        args = self.args
+        startTime = time.time()
+        startCPU = time.process_time()
+        startReceived = self.received
+        startRSS = getRSS()
+
+        print("{:>8} {:>8} {:>10} {:>10} {:>9} {:>10} {:>12}".format("elapsed", "threads", "rss_mb", "received", "cycle_s", "cpu_s", "cpu_us/push"))
+        while time.time() - startTime < args.duration:
+
+            time.sleep(min(args.poll_interval, max(0, args.duration - (time.time() - startTime))))
+
+            cycleStart = time.time()
+            self.controller.shortPoll()
+            cycleTime = time.time() - cycleStart
+
+            received = self.received - startReceived
+            cpu = time.process_time() - startCPU
+            sample = {
+                "elapsed": time.time() - startTime,
+                "threads": threading.active_count(),
+                "rss": getRSS(),
+                "received": received,
+                "cycleTime": cycleTime,
+                "cpu": cpu,
+                "cpuPerPush": cpu / received if received else None
+            }
+            self.report["samples"].append(sample)
+            print("{:>8.0f} {:>8} {:>10.1f} {:>10} {:>9.2f} {:>10.2f} {:>12}".format(
+                sample["elapsed"], sample["threads"], sample["rss"] / 1048576, received, cycleTime, cpu,
+                "{:.1f}".format(sample["cpuPerPush"] * 1000000) if received else "-"
+            ))
+
+        last = self.report["samples"][-1] if self.report["samples"] else None
+        self.report["phases"]["sustained"] = {
+            "duration": time.time() - startTime,
+            "received": self.received - startReceived,
+            "rssGrowth": getRSS() - startRSS,
+            "cpuPerPush": last["cpuPerPush"] if last else None
+        }
+
+    # Pause the pushes, let them settle, and compare the cached device states of the bridge nodes to the simulator
+    def phaseConsistency(self):
+
+        self.simRequest("pause")
+        time.sleep(_SOAK_SETTLE_TIME)
+
+        simStats = self.simRequest("stats")
+        simStates = self.simRequest("states")
+
+        mismatches = 0
+        devices = 0
+        for bondID in simStates:
+            bridge = self.controller.nodes.get(bondID.lower())
+            cachedStates = bridge.getDeviceStates() if bridge is not None else {}
+            for deviceID in simStates[bondID]:
+                devices += 1
+                if cachedStates.get(deviceID) != simStates[bondID][deviceID]:
+                    mismatches += 1
+
+        delivered = simStats["pushes"] - simStats["dropped"]
+        self.report["phases"]["consistency"] = {
+            "devices": devices,
+            "mismatches": mismatches,
+            "pushesSent": simStats["pushes"],
+            "pushesDropped": simStats["dropped"],
+            "pushesReceived": self.received,
+            "missedUpdates": max(0, delivered - self.received)
+        }
+        print("consistency: {} of {} devices out of sync, {} pushes sent, {} dropped by simulator, {} received, {} missed".format(
+            mismatches, devices, simStats["pushes"], simStats["dropped"], self.received, max(0, delivered - self.received)
+        ))
+
+# Run the soak test from the command line
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Soak test the nodeserver against many simulated bridges.")
+    parser.add_argument("--bridges", type=int, default=20, help="number of simulated bridges (default: 20)")
+    parser.add_argument("--devices", type=int, default=50, help="number of devices per bridge (default: 50)")
+    parser.add_argument("--mix", default=bondsim._SIM_DEFAULT_MIX, help="device type mix as TYPE:WEIGHT list (default: %s)" % bondsim._SIM_DEFAULT_MIX)
+    parser.add_argument("--latency", type=float, default=5.0, help="HTTP response latency in milliseconds (default: 5)")
+    parser.add_argument("--jitter", type=float, default=5.0, help="random additional HTTP response latency in milliseconds (default: 5)")
+    parser.add_argument("--loss", type=float, default=0.0, help="BPUP datagram loss probability 0.0-1.0 (default: 0)")
+    parser.add_argument("--push-rate", type=float, default=1.0, help="BPUP state pushes per second per bridge (default: 1)")
+    parser.add_argument("--poll-cycles", type=int, default=3, help="number of back-to-back shortPoll cycles (default: 3)")
+    parser.add_argument("--commands", type=int, default=500, help="number of commands in the command storm (default: 500)")
+    parser.add_argument("--duration", type=float, default=60, help="duration of the sustained push phase in seconds (default: 60)")
+    parser.add_argument("--poll-interval", type=float, default=10, help="shortPoll interval during the sustained push phase in seconds (default: 10)")
+    parser.add_argument("--output", metavar="FILE", help="write the report as JSON to the file")
+    args = parser.parse_args()
+
+    outputFile = os.path.abspath(args.output) if args.output else None
+    report = SoakTest(args).run()
+
+    if outputFile:
+        with open(outputFile, "w") as f:
+            json.dump(report, f, indent=2)
+
+    # exit with status 1 if a check failed
+    if not report["phases"]["commandLatency"]["passed"]:
+        sys.exit(1)
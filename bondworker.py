@@ -0,0 +1,480 @@
+#!/usr/bin/python3
+"""
+Worker processes for Bond bridge connections
+Runs the bondapi.bondBridgeConnection instances (REST API calls, BPUP listeners, and polling) for groups of
+bridges in separate processes and streams BPUP state changes and poll results back to the nodeserver over a pipe,
+so that the bridges can use more than one core and a hung bridge or worker doesn't stall the others
+"""
+
+import logging
+import time
+import threading
+import itertools
+import concurrent.futures
+import multiprocessing
+import bondapi
+
+# Pickup the root logger, and add a handler for module testing if none exists
+_LOGGER = logging.getLogger()
+if not _LOGGER.hasHandlers():
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.DEBUG)
+
+# IPC messages are tuples with the message type as the first element
+_MSG_OPEN = 0 # to worker: (type, bridge key, host name, token, HTTP transport name)
+_MSG_CALL = 1 # to worker: (type, request ID, bridge key, method, args)
+_MSG_STOP = 2 # to worker: (type,)
+_MSG_RESULT = 3 # from worker: (type, request ID, result)
+_MSG_STATE = 4 # from worker: (type, bridge key, device ID, state data)
+_MSG_RECORD = 5 # from worker: (type, host name, BPUP datagram)
+_MSG_LOG = 6 # from worker: (type, level, message)
+
+# methods of bondBridgeConnection that may be called in the worker
+_WORKER_METHODS = ("startBPUPListener", "setHostName", "enableStats", "getStats", "setBPUPRecorder", "getDeviceList", "getDeviceProperties", "getDeviceState", "execDeviceAction", "getBridgeInfo", "isBridgeAlive", "pollDeviceStates", "close")
+
+_WORKER_MAX_THREADS = 8 # maximum number of concurrent calls in a worker process
+WORKER_CALL_TIMEOUT = 15 # time to wait for the result of a call before treating it as failed (seconds)
+_WORKER_QUERY_TIMEOUT = 2 # time to wait for the result of a stats query (seconds)
+_WORKER_HUNG_TIME = 60 # age of the oldest outstanding call at which a worker process is considered hung (seconds)
+_WORKER_STOP_TIMEOUT = 5
+
+# Logging handler that sends the log messages of a worker process to the nodeserver
+class _PipeLogHandler(logging.Handler):
+
+    def __init__(self, send):
+        super(_PipeLogHandler, self).__init__()
+        self._send = send
+
+    def emit(self, record):
+        try:
+            self._send((_MSG_LOG, record.levelno, self.format(record)))
+        except Exception:
+            pass
+
+# BPUP recorder that sends the datagrams received in a worker process to the recorder of the nodeserver
+class _PipeRecorder(object):
+
+    def __init__(self, send):
+        self._send = send
+
+    def record(self, hostName, msg):
+        self._send((_MSG_RECORD, hostName, msg))
+
+# Main function of a worker process
+def _workerMain(conn, level):
+
+    sendLock = threading.Lock()
+    def send(msg):
+        with sendLock:
+            conn.send(msg)
+
+    # send all log messages to the nodeserver (replacing any handlers setup by imports of the main module)
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(_PipeLogHandler(send))
+    logger.setLevel(level)
+
+    connections = {}
+
+    # Poll the bridge and the state of the specified devices - also returns the failed request count and keep-alive RTT
+    def pollDeviceStates(bridge, deviceIDs):
+
+        states = {}
+        alive = bridge.isBridgeAlive()
+        if alive:
+            for deviceID in deviceIDs:
+                state = bridge.getDeviceState(deviceID)
+                if state:
+                    states[deviceID] = state
+
+        return (alive, states, bridge.getFailedRequestCount(), bridge.getKeepAliveRTT())
+
+    # Call the method for the bridge and send the result
+    def call(requestID, key, method, args):
+
+        try:
+            bridge = connections[key]
+            if method not in _WORKER_METHODS:
+                raise ValueError("unsupported method")
+            elif method == "pollDeviceStates":
+                result = pollDeviceStates(bridge, *args)
+            elif method == "startBPUPListener":
+                result = bridge.startBPUPListener(lambda deviceID, state: send((_MSG_STATE, key, deviceID, state)))
+            elif method == "setBPUPRecorder":
+                result = bridge.setBPUPRecorder(_PipeRecorder(send) if args[0] else None)
+            else:
+                result = getattr(bridge, method)(*args)
+        except Exception as e:
+            logger.error("Call to %s() for bridge %s raised an exception: %s", method, key, str(e))
+            result = None
+
+        # always resolve the call, even if the result can't be sent (e.g., it can't be pickled)
+        try:
+            send((_MSG_RESULT, requestID, result))
+        except Exception as e:
+            logger.error("Unable to send the result of %s() for bridge %s: %s", method, key, str(e))
+            try:
+                send((_MSG_RESULT, requestID, None))
+            except Exception:
+                pass
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_WORKER_MAX_THREADS, thread_name_prefix="WorkerCall") as executor:
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if msg[0] == _MSG_OPEN:
+                transport = bondapi.API_HTTP_TRANSPORTS[msg[4]]() if msg[4] else None
+                connections[msg[1]] = bondapi.bondBridgeConnection(msg[2], msg[3], logger=logger, transport=transport)
+            elif msg[0] == _MSG_CALL:
+                executor.submit(call, *msg[1:])
+            elif msg[0] == _MSG_STOP:
+                break
+
+        for bridge in connections.values():
+            bridge.close()
+
+# A worker process and the connection to it
+class WorkerProcess(object):
+
+    def __init__(self, index, logger=_LOGGER):
+
+        self.index = index
+        self._logger = logger
+        self._process = None
+        self._conn = None
+        self._sendLock = threading.Lock()
+        self._pendingLock = threading.Lock()
+        self._pending = {} # futures for outstanding calls as tuples of (time, future) by request ID
+        self._abandonedTime = None # submit time of the oldest call abandoned since the worker last sent a result
+        self._requestIDs = itertools.count()
+        self.connections = {} # WorkerBondBridgeConnection instances by bridge key
+        self.restarts = 0
+
+    # Start the worker process and open the connections for the bridges assigned to it
+    def start(self):
+
+        context = multiprocessing.get_context("spawn")
+        (self._conn, childConn) = context.Pipe()
+        self._process = context.Process(target=_workerMain, args=(childConn, self._logger.getEffectiveLevel()), name="BondWorker%d" % self.index, daemon=True)
+        self._process.start()
+        childConn.close()
+
+        threading.Thread(target=self._receive, args=(self._conn,), name="WorkerReceiver%d" % self.index, daemon=True).start()
+
+        for connection in list(self.connections.values()):
+            connection._open()
+
+    # Stop the worker process
+    def stop(self):
+
+        self._send((_MSG_STOP,))
+        if self._process is not None:
+            self._process.join(_WORKER_STOP_TIMEOUT)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._failPending()
+
+    # Kill and restart the worker process
+    def restart(self):
+
+        if self._process is not None and self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._conn.close()
+        self._failPending()
+        with self._pendingLock:
+            self._abandonedTime = None
+        self.restarts += 1
+        self.start()
+
+    # Return whether the worker process is running
+    def isAlive(self):
+        return self._process is not None and self._process.is_alive()
+
+    # Return the age of the oldest outstanding call, including calls abandoned since the worker last sent a result
+    # (seconds, or 0 if none)
+    def getPendingAge(self):
+
+        with self._pendingLock:
+            submitTimes = [submitTime for (submitTime, future) in self._pending.values()]
+            if self._abandonedTime is not None:
+                submitTimes.append(self._abandonedTime)
+            if submitTimes:
+                return time.time() - min(submitTimes)
+            else:
+                return 0
+
+    # Return the number of outstanding calls
+    def getPendingCount(self):
+        return len(self._pending)
+
+    # Send a message to the worker process - returns False if the worker can't be reached
+    def _send(self, msg):
+
+        try:
+            with self._sendLock:
+                self._conn.send(msg)
+        except (AttributeError, OSError, ValueError):
+            return False
+        else:
+            return True
+
+    # Call a method for the bridge in the worker process - returns a future for the result (None if the call failed)
+    def submit(self, key, method, *args):
+
+        future = concurrent.futures.Future()
+        requestID = next(self._requestIDs)
+        with self._pendingLock:
+            self._pending[requestID] = (time.time(), future)
+
+        if not self._send((_MSG_CALL, requestID, key, method, args)):
+            self._resolve(requestID, None)
+
+        return future
+
+    # Stop waiting for an outstanding call that timed out - the call no longer counts towards the pending age
+    # unless the worker doesn't send any result before it would be considered hung
+    def abandon(self, future):
+
+        with self._pendingLock:
+            for (requestID, (submitTime, pendingFuture)) in list(self._pending.items()):
+                if pendingFuture is future:
+                    del self._pending[requestID]
+                    if self._abandonedTime is None or submitTime < self._abandonedTime:
+                        self._abandonedTime = submitTime
+                    break
+
+    # Set the result of an outstanding call
+    def _resolve(self, requestID, result):
+
+        with self._pendingLock:
+            (submitTime, future) = self._pending.pop(requestID, (None, None))
+
+        if future is not None:
+            future.set_result(result)
+
+    # Fail all outstanding calls, e.g., when the worker process dies
+    def _failPending(self):
+
+        with self._pendingLock:
+            pending = list(self._pending)
+        for requestID in pending:
+            self._resolve(requestID, None)
+
+    # Receive messages from the worker process until it exits
+    def _receive(self, conn):
+
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if msg[0] == _MSG_STATE:
+                connection = self.connections.get(msg[1])
+                if connection is not None and connection._stateCallback is not None:
+                    try:
+                        connection._stateCallback(msg[2], msg[3])
+                    except Exception as e:
+                        self._logger.error("BPUP state callback for bridge %s raised an exception: %s", msg[1], str(e))
+            elif msg[0] == _MSG_RESULT:
+                with self._pendingLock:
+                    self._abandonedTime = None # the worker is responsive
+                self._resolve(msg[1], msg[2])
+            elif msg[0] == _MSG_RECORD:
+                for connection in list(self.connections.values()):
+                    if connection._BPUP_recorder is not None and connection.getHostName() == msg[1]:
+                        connection._BPUP_recorder.record(msg[1], msg[2])
+                        break
+            elif msg[0] == _MSG_LOG:
+                self._logger.log(msg[1], "Worker %d: %s", self.index, msg[2])
+
+        # fail the outstanding calls of the connection (unless the worker has already been restarted)
+        if conn is self._conn:
+            self._logger.warning("Connection to worker process %d closed.", self.index)
+            self._failPending()
+
+# Pool of worker processes that the bridge connections are distributed across
+class WorkerPool(object):
+
+    def __init__(self, count, logger=_LOGGER, transportName=None):
+
+        self._logger = logger
+        self._transportName = transportName # name of the HTTP transport in bondapi.API_HTTP_TRANSPORTS (None for default)
+        self.workers = [WorkerProcess(i, logger) for i in range(count)]
+        for worker in self.workers:
+            worker.start()
+
+    # Create a connection for the bridge in the worker process with the fewest bridges
+    def createConnection(self, key, hostName, token):
+
+        worker = min(self.workers, key=lambda worker: len(worker.connections))
+        return WorkerBondBridgeConnection(worker, key, hostName, token, self._logger, self._transportName)
+
+    # Restart worker processes that have died or are hung - returns the number of workers restarted
+    def checkWorkers(self):
+
+        restarted = 0
+        for worker in self.workers:
+            if not worker.isAlive():
+                self._logger.error("Worker process %d exited - restarting with %d bridges.", worker.index, len(worker.connections))
+            elif worker.getPendingAge() > _WORKER_HUNG_TIME:
+                self._logger.error("Worker process %d has not responded for %.0f seconds - restarting with %d bridges.", worker.index, worker.getPendingAge(), len(worker.connections))
+            else:
+                continue
+            worker.restart()
+            restarted += 1
+
+        return restarted
+
+    # Stop all worker processes
+    def stop(self):
+
+        for worker in self.workers:
+            worker.stop()
+
+# Blocking connection with the surface of bondapi.bondBridgeConnection for a bridge in a worker process
+# Note: BPUP state callbacks are called on the receiver thread of the worker process
+class WorkerBondBridgeConnection(object):
+
+    def __init__(self, worker, key, hostName, token, logger=_LOGGER, transportName=None):
+
+        self._worker = worker
+        self._key = key
+        self._hostName = hostName
+        self._token = token
+        self._transportName = transportName
+        self._logger = logger
+        self._stateCallback = None
+        self._statsSinks = None
+        self._BPUP_recorder = None
+
+        # failed request count and keep-alive round trip time as of the last poll
+        self._failedRequests = 0
+        self._keepAliveRTT = None
+
+        worker.connections[key] = self
+        self._open()
+
+    # Open the connection in the worker process (again after a restart) with the listener, stats, and recorder
+    def _open(self):
+
+        self._worker._send((_MSG_OPEN, self._key, self._hostName, self._token, self._transportName))
+        if self._statsSinks is not None:
+            self._worker.submit(self._key, "enableStats")
+        if self._BPUP_recorder is not None:
+            self._worker.submit(self._key, "setBPUPRecorder", True)
+        if self._stateCallback is not None:
+            self._worker.submit(self._key, "startBPUPListener")
+
+    # Call the method in the worker process and wait for the result (None if the call failed or timed out)
+    def _call(self, method, *args, timeout=WORKER_CALL_TIMEOUT):
+
+        future = self._worker.submit(self._key, method, *args)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self._logger.warning("Call to %s() for bridge %s in worker process %d timed out.", method, self._key, self._worker.index)
+            self._worker.abandon(future)
+            return None
+
+    def startBPUPListener(self, stateCallback):
+
+        self._stateCallback = stateCallback
+        self._worker.submit(self._key, "startBPUPListener")
+
+    def setHostName(self, hostName):
+
+        self._hostName = hostName
+        self._worker.submit(self._key, "setHostName", hostName)
+
+    def getHostName(self):
+        return self._hostName
+
+    # stats are collected in the worker process and sent to the sinks in this process
+    def enableStats(self, sinks=None):
+
+        self._statsSinks = list(sinks or [])
+        self._worker.submit(self._key, "enableStats")
+
+    def addStatsSink(self, sink):
+        self._statsSinks.append(sink)
+
+    def getStats(self):
+
+        if self._statsSinks is None:
+            return None
+        else:
+            return self._call("getStats", timeout=_WORKER_QUERY_TIMEOUT)
+
+    def flushStats(self):
+
+        stats = self.getStats()
+        if stats is not None:
+            for sink in self._statsSinks:
+                try:
+                    sink.emit(self._hostName, stats)
+                except Exception as e:
+                    self._logger.warning("Error sending API call stats to sink %s: %s", type(sink).__name__, str(e))
+
+    # datagrams are recorded in this process
+    def setBPUPRecorder(self, recorder):
+
+        self._BPUP_recorder = recorder
+        self._worker.submit(self._key, "setBPUPRecorder", recorder is not None)
+
+    def getFailedRequestCount(self):
+        return self._failedRequests
+
+    def getKeepAliveRTT(self):
+        return self._keepAliveRTT
+
+    def getDeviceList(self):
+        return self._call("getDeviceList")
+
+    def getDeviceProperties(self, deviceID):
+        return self._call("getDeviceProperties", deviceID)
+
+    def getDeviceState(self, deviceID):
+        return self._call("getDeviceState", deviceID)
+
+    def execDeviceAction(self, deviceID, action, argument = None):
+        return self._call("execDeviceAction", deviceID, action, argument) or False
+
+    def getBridgeInfo(self):
+        return self._call("getBridgeInfo")
+
+    def isBridgeAlive(self):
+        return self._call("isBridgeAlive") or False
+
+    # Start polling the bridge and the state of the specified devices - returns a future for getPollResult()
+    def submitPoll(self, deviceIDs):
+        return self._worker.submit(self._key, "pollDeviceStates", deviceIDs)
+
+    # Wait for the result of a poll - returns tuple of (bridge alive, dictionary of state data by device ID)
+    def getPollResult(self, future, timeout=WORKER_CALL_TIMEOUT):
+
+        try:
+            result = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self._logger.warning("Poll of bridge %s in worker process %d timed out.", self._key, self._worker.index)
+            self._worker.abandon(future)
+            result = None
+
+        if result is None:
+            return (False, {})
+
+        (alive, states, self._failedRequests, self._keepAliveRTT) = result
+        return (alive, states)
+
+    def pollDeviceStates(self, deviceIDs):
+        return self.getPollResult(self.submitPoll(deviceIDs))
+
+    def close(self):
+
+        self._stateCallback = None
+        self._worker.submit(self._key, "close")
+        self._worker.connections.pop(self._key, None)